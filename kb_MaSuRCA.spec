@@ -59,19 +59,30 @@ module kb_MaSuRCA {
         2. PARAMETERS
         string graph_kmer_size - the k-mer size for deBruijn graph values between 25 and 127 are supported, 'auto' will compute the optimal size based on the read data and GC content
         bool use_linking_mates - set this to 1 for all Illumina-only assemblies; set this to 1 if you have less than 20x long reads (454, Sanger, Pacbio) and less than 50x CLONE coverage by Illumina, Sanger or 454 mate pairs; otherwise keep at 0
-        string dna_source - indicate 'bacteria' or 'other organisms' for setting limit_jump_coverage and cgwErrorRate values
+        string dna_source - indicate 'bacteria' or 'other organisms' for setting limit_jump_coverage and cgwErrorRate values; when omitted they are set from the genome size estimated from the reads
         int limit_jump_coverage - this parameter is useful if you have too many Illumina jumping library mates. Typically set it to 60 for bacteria and 300 for the other organisms
         CA_PARAMETERS: these are the additional parameters to Celera Assembler.  do not worry about performance, number or processors or batch sizes -- these are computed automatically. 
         float cgwErrorRate=0.15 - set cgwErrorRate=0.25 for bacteria and 0.1<=cgwErrorRate<=0.15 for other organisms.
         int kmer_count_threshold - minimum count k-mers used in error correction 1 means all k-mers are used.  one can increase to 2 if Illumina coverage >100
         bool close_gaps - whether to attempt to close gaps in scaffolds with Illumina data (1) or not (0)
-        int num_threads - auto-detected number of cpus to use, mandatory
-        int jf_size  - this is mandatory jellyfish hash size -- a safe value is estimated_genome_size*estimated_coverage (e.g., 2000000000)
+        int num_threads - number of cpus to use; defaults to the cpus available to the job
+        int jf_size  - jellyfish hash size -- a safe value is estimated_genome_size*estimated_coverage (e.g., 2000000000); when omitted it is estimated from the total bases and the k-mer sketch genome size of the input reads
         bool SOAP_ASSEMBLY - set this to 1 to use SOAPdenovo contigging/scaffolding module.  Assembly will be worse but will run faster. Useful for very large (>5Gbp) genomes
         bool do_homopolymer_trim - specifies if we do (1) or do not (0) want to trim long runs of homopolymers 
 
         string workspace_name - the name of the workspace from which to take input and store output.
         string output_contigset_name - the name of the output contigset
+        string packaging_profile - which outputs go into the report's zip file: 'minimal' (final scaffolds,
+            config, logs and QUAST), 'standard' (default, adds the final CA sequences and summaries) or
+            'full' (all intermediate files)
+        bool resume - set this to 1 to run in a project directory keyed by the inputs and parameters, so that
+            re-running an interrupted job skips the MaSuRCA stages that already completed
+        string reduce_reads - reduce deep paired-end libraries before assembling: 'none' (default), 'subsample'
+            (keep random read pairs down to target_coverage times the estimated genome size) or 'normalize'
+            (digital normalization, drop the read pairs whose median k-mer coverage reaches target_coverage)
+        int target_coverage - the coverage kept by reduce_reads; defaults to 100 for 'subsample' and 20 for 'normalize'
+        bool plan_only - set this to 1 to only generate config.txt and assemble.sh from the workspace metadata
+            of the inputs, without downloading them, and return them with the forecast resources of the run
         list<paired_readsParams> read_libraries - Illumina PairedEndLibrary files to assemble
 
         @optional jump_libraries
@@ -84,6 +95,13 @@ module kb_MaSuRCA {
         @optional close_gaps
         @optional soap_assembly
         @optional do_homopolymer_trim
+        @optional num_threads
+        @optional jf_size
+        @optional packaging_profile
+        @optional resume
+        @optional reduce_reads
+        @optional target_coverage
+        @optional plan_only
      */
 
     typedef structure {
@@ -106,19 +124,182 @@ module kb_MaSuRCA {
 
         string output_contigset_name;
         bool create_report;
+        string packaging_profile;
+        bool resume;
+        string reduce_reads;
+        int target_coverage;
+        bool plan_only;
     } masurcaAssemblerParams;
            
+    /* The resources forecast for a run by plan_only
+    total_bases - the bases of the Illumina inputs, from their workspace metadata
+    long_reads_bases - the bases of the PacBio/Nanopore inputs
+    num_threads, jf_size - the NUM_THREADS and JF_SIZE of the generated config.txt
+    cpu_hours - a rough estimate of the CPU time of the run, from uncalibrated per base rates
+    wall_hours - a rough estimate of the wall time of the run on num_threads CPUs
+    memory_bytes - the peak resident memory of the run
+    disk_bytes - the peak scratch usage of the run, downloads included
+    cpu_seconds, memory, disk - the per stage forecasts the above are made of
+    config - the generated config.txt
+    assemble_script - the assemble.sh generated by masurca from config.txt
+    */
+    typedef structure {
+        int total_bases;
+        int long_reads_bases;
+        int num_threads;
+        int jf_size;
+        float cpu_hours;
+        float wall_hours;
+        int memory_bytes;
+        int disk_bytes;
+        mapping<string, int> cpu_seconds;
+        mapping<string, int> memory;
+        mapping<string, int> disk;
+        string config;
+        string assemble_script;
+    } assemblyPlan;
+
     /* Output parameter items for run_masurca_assembler
     report_name - the name of the KBaseReport.Report workspace object.
     report_ref - the workspace reference of the report.
+    plan - the config, script and resources of the run, with plan_only set; report_name and
+    report_ref are then null
+
+    @optional plan
     */
     typedef structure {
         string report_name;
         string report_ref;
+        assemblyPlan plan;
     } masurcaResults;
     
     /* 
         Definition of run_masurca_assembler
      */
     funcdef run_masurca_assembler(masurcaAssemblerParams params) returns (masurcaResults output) authentication required;
+
+    /* Arguments for profile_reads
+        workspace_name - the name of the workspace holding the reads libraries
+        reads_libraries - the paired-end reads libraries to profile
+        num_threads - the number of processes counting the k-mers, all the available CPUs if omitted
+        kmer_size - the k-mer size of the histogram, 31 if omitted
+
+        @optional num_threads
+        @optional kmer_size
+    */
+    typedef structure {
+        string workspace_name;
+        list<paired_readsParams> reads_libraries;
+        int num_threads;
+        int kmer_size;
+    } profileReadsParams;
+
+    /* Output of profile_reads, the estimates being null when the histogram shows no coverage peak
+        genome_size - the estimated genome size
+        coverage - the estimated base coverage of the genome by the reads
+        kmer_coverage - the depth of the main peak of the k-mer histogram
+        repeat_fraction - the share of the genomic k-mers from repeats
+        heterozygosity - the estimated rate of heterozygous sites
+        error_mass - the share of the k-mers from sequencing errors
+        verdict - 'under-sequenced', 'ok', 'over-sequenced' or 'unknown'
+        histogram - the number of distinct k-mers seen 0, 1, 2... times among the sampled ones
+    */
+    typedef structure {
+        int kmer_size;
+        int total_bases;
+        int sampled_bases;
+        int genome_size;
+        float coverage;
+        float kmer_coverage;
+        float repeat_fraction;
+        float heterozygosity;
+        float error_mass;
+        string verdict;
+        list<int> histogram;
+    } profileReadsResults;
+
+    /*
+        Estimate the genome size, coverage, repeat fraction and heterozygosity of reads libraries
+        from their k-mer histogram, before committing to an assembly
+    */
+    funcdef profile_reads(profileReadsParams params) returns (profileReadsResults output) authentication required;
+
+    /* A variant of the parameters of a sweep, the parameters left out taking their value from
+        the assembly_params of the sweep
+        name - the name of the variant, made of its parameters if omitted
+
+        @optional name
+        @optional graph_kmer_size
+        @optional kmer_count_threshold
+        @optional close_gaps
+        @optional soap_assembly
+    */
+    typedef structure {
+        string name;
+        string graph_kmer_size;
+        int kmer_count_threshold;
+        bool close_gaps;
+        bool soap_assembly;
+    } sweepVariant;
+
+    /* Arguments for run_masurca_sweep
+        assembly_params - the parameters of run_masurca_assembler shared by all the variants, the
+            output_contigset_name being suffixed with the name of each variant
+        variants - the variants to assemble
+        max_cores - the cores the variants running side by side may use together, all the available
+            CPUs if omitted
+        max_memory_bytes - the memory they may use together, the memory limit of the container if omitted
+
+        @optional max_cores
+        @optional max_memory_bytes
+    */
+    typedef structure {
+        masurcaAssemblerParams assembly_params;
+        list<sweepVariant> variants;
+        int max_cores;
+        int max_memory_bytes;
+    } sweepParams;
+
+    /* The outcome of a variant of a sweep
+        overrides - the parameters of the variant
+        assembly_ref - the saved assembly, null when the variant failed
+        error - why the variant failed, null when it did not
+        shared_from - the variant whose jellyfish database and corrected reads this one reused
+        stats - the contig count, total length, N50... of the assembly
+        resources - the wall time, CPU time and peak memory of the assemble.sh run
+
+        @optional exit_code
+        @optional assembly_ref
+        @optional error
+        @optional shared_from
+        @optional stats
+        @optional resources
+    */
+    typedef structure {
+        string name;
+        mapping<string, UnspecifiedObject> overrides;
+        int exit_code;
+        string assembly_ref;
+        string error;
+        string shared_from;
+        mapping<string, UnspecifiedObject> stats;
+        mapping<string, UnspecifiedObject> resources;
+    } sweepVariantResult;
+
+    /* Output of run_masurca_sweep
+        report_name, report_ref - the report comparing the variants, with create_report set in
+            assembly_params
+        variants - the outcome of each variant
+    */
+    typedef structure {
+        string report_name;
+        string report_ref;
+        list<sweepVariantResult> variants;
+    } sweepResults;
+
+    /*
+        Assemble the same reads with several variants of the parameters, staging the reads once,
+        and compare the assemblies in a single report
+    */
+    funcdef run_masurca_sweep(sweepParams params) returns (sweepResults output) authentication required;
 };
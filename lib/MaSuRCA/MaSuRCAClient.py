@@ -55,7 +55,8 @@ class kb_MaSuRCA(object):
            (454, Sanger, Pacbio) and less than 50x CLONE coverage by
            Illumina, Sanger or 454 mate pairs; otherwise keep at 0 string
            dna_source - indicate 'bacteria' or 'other organisms' for setting
-           limit_jump_coverage and cgwErrorRate values int
+           limit_jump_coverage and cgwErrorRate values; when omitted they are
+           set from the genome size estimated from the reads int
            limit_jump_coverage - this parameter is useful if you have too
            many Illumina jumping library mates. Typically set it to 60 for
            bacteria and 300 for the other organisms CA_PARAMETERS: these are
@@ -67,54 +68,287 @@ class kb_MaSuRCA(object):
            used in error correction 1 means all k-mers are used.  one can
            increase to 2 if Illumina coverage >100 bool close_gaps - whether
            to attempt to close gaps in scaffolds with Illumina data (1) or
-           not (0) int num_threads - auto-detected number of cpus to use,
-           mandatory int jf_size  - this is mandatory jellyfish hash size --
-           a safe value is estimated_genome_size*estimated_coverage (e.g.,
-           2000000000) bool SOAP_ASSEMBLY - set this to 1 to use SOAPdenovo
-           contigging/scaffolding module.  Assembly will be worse but will
-           run faster. Useful for very large (>5Gbp) genomes bool
-           do_homopolymer_trim - specifies if we do (1) or do not (0) want to
-           trim long runs of homopolymers string workspace_name - the name of
-           the workspace from which to take input and store output. string
-           output_contigset_name - the name of the output contigset
-           list<paired_readsParams> read_libraries - Illumina
-           PairedEndLibrary files to assemble @optional jump_libraries
-           @optional pacbio_reads @optional other_frg_file @optional
-           graph_kmer_size @optional use_linking_mates @optional dna_source
-           @optional kmer_count_threshold @optional close_gaps @optional
-           soap_assembly @optional do_homopolymer_trim) -> structure:
-           parameter "workspace_name" of String, parameter "num_threads" of
-           Long, parameter "jf_size" of Long, parameter "reads_libraries" of
-           list of type "paired_readsParams" (parameter groups) -> structure:
-           parameter "pe_id" of type "obj_ref" (An X/Y/Z style KBase object
-           reference), parameter "pe_prefix" of String, parameter "pe_mean"
-           of Long, parameter "pe_stdev" of Long, parameter "jump_libraries"
-           of list of type "jump_readsParams" -> structure: parameter "jp_id"
-           of type "obj_ref" (An X/Y/Z style KBase object reference),
-           parameter "jp_prefix" of String, parameter "jp_mean" of Long,
-           parameter "jp_stdev" of Long, parameter "pacbio_reads" of type
-           "obj_ref" (An X/Y/Z style KBase object reference), parameter
-           "nanopore_reads" of type "obj_ref" (An X/Y/Z style KBase object
-           reference), parameter "other_frg_file" of String, parameter
-           "graph_kmer_size" of String, parameter "use_linking_mates" of type
-           "bool" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "dna_source" of String, parameter "kmer_count_threshold"
-           of Long, parameter "close_gaps" of type "bool" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter "soap_assembly" of
-           type "bool" (A boolean - 0 for false, 1 for true. @range (0, 1)),
-           parameter "do_homopolymer_trim" of type "bool" (A boolean - 0 for
-           false, 1 for true. @range (0, 1)), parameter
-           "output_contigset_name" of String, parameter "create_report" of
-           type "bool" (A boolean - 0 for false, 1 for true. @range (0, 1))
+           not (0) int num_threads - number of cpus to use; defaults to the
+           cpus available to the job int jf_size  - jellyfish hash size -- a
+           safe value is estimated_genome_size*estimated_coverage (e.g.,
+           2000000000); when omitted it is estimated from the total bases and
+           the k-mer sketch genome size of the input reads bool SOAP_ASSEMBLY
+           - set this to 1 to use SOAPdenovo contigging/scaffolding module. 
+           Assembly will be worse but will run faster. Useful for very large
+           (>5Gbp) genomes bool do_homopolymer_trim - specifies if we do (1)
+           or do not (0) want to trim long runs of homopolymers string
+           workspace_name - the name of the workspace from which to take
+           input and store output. string output_contigset_name - the name of
+           the output contigset string packaging_profile - which outputs go
+           into the report's zip file: 'minimal' (final scaffolds, config,
+           logs and QUAST), 'standard' (default, adds the final CA sequences
+           and summaries) or 'full' (all intermediate files) bool resume -
+           set this to 1 to run in a project directory keyed by the inputs
+           and parameters, so that re-running an interrupted job skips the
+           MaSuRCA stages that already completed string reduce_reads - reduce
+           deep paired-end libraries before assembling: 'none' (default),
+           'subsample' (keep random read pairs down to target_coverage times
+           the estimated genome size) or 'normalize' (digital normalization,
+           drop the read pairs whose median k-mer coverage reaches
+           target_coverage) int target_coverage - the coverage kept by
+           reduce_reads; defaults to 100 for 'subsample' and 20 for
+           'normalize' bool plan_only - set this to 1 to only generate
+           config.txt and assemble.sh from the workspace metadata of the
+           inputs, without downloading them, and return them with the
+           forecast resources of the run list<paired_readsParams>
+           read_libraries - Illumina PairedEndLibrary files to assemble
+           @optional jump_libraries @optional pacbio_reads @optional
+           other_frg_file @optional graph_kmer_size @optional
+           use_linking_mates @optional dna_source @optional
+           kmer_count_threshold @optional close_gaps @optional soap_assembly
+           @optional do_homopolymer_trim @optional num_threads @optional
+           jf_size @optional packaging_profile @optional resume @optional
+           reduce_reads @optional target_coverage @optional plan_only) ->
+           structure: parameter "workspace_name" of String, parameter
+           "num_threads" of Long, parameter "jf_size" of Long, parameter
+           "reads_libraries" of list of type "paired_readsParams" (parameter
+           groups) -> structure: parameter "pe_id" of type "obj_ref" (An
+           X/Y/Z style KBase object reference), parameter "pe_prefix" of
+           String, parameter "pe_mean" of Long, parameter "pe_stdev" of Long,
+           parameter "jump_libraries" of list of type "jump_readsParams" ->
+           structure: parameter "jp_id" of type "obj_ref" (An X/Y/Z style
+           KBase object reference), parameter "jp_prefix" of String,
+           parameter "jp_mean" of Long, parameter "jp_stdev" of Long,
+           parameter "pacbio_reads" of type "obj_ref" (An X/Y/Z style KBase
+           object reference), parameter "nanopore_reads" of type "obj_ref"
+           (An X/Y/Z style KBase object reference), parameter
+           "other_frg_file" of String, parameter "graph_kmer_size" of String,
+           parameter "use_linking_mates" of type "bool" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "dna_source" of
+           String, parameter "kmer_count_threshold" of Long, parameter
+           "close_gaps" of type "bool" (A boolean - 0 for false, 1 for true.
+           @range (0, 1)), parameter "soap_assembly" of type "bool" (A
+           boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "do_homopolymer_trim" of type "bool" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "output_contigset_name" of
+           String, parameter "create_report" of type "bool" (A boolean - 0
+           for false, 1 for true. @range (0, 1)), parameter
+           "packaging_profile" of String, parameter "resume" of type "bool"
+           (A boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "reduce_reads" of String, parameter "target_coverage" of Long,
+           parameter "plan_only" of type "bool" (A boolean - 0 for false, 1
+           for true. @range (0, 1))
         :returns: instance of type "masurcaResults" (Output parameter items
            for run_masurca_assembler report_name - the name of the
            KBaseReport.Report workspace object. report_ref - the workspace
-           reference of the report.) -> structure: parameter "report_name" of
-           String, parameter "report_ref" of String
+           reference of the report. plan - the config, script and resources
+           of the run, with plan_only set; report_name and report_ref are
+           then null @optional plan) -> structure: parameter "report_name" of
+           String, parameter "report_ref" of String, parameter "plan" of type
+           "assemblyPlan" (The resources forecast for a run by plan_only
+           total_bases - the bases of the Illumina inputs, from their
+           workspace metadata long_reads_bases - the bases of the
+           PacBio/Nanopore inputs num_threads, jf_size - the NUM_THREADS and
+           JF_SIZE of the generated config.txt cpu_hours - a rough estimate
+           of the CPU time of the run, from uncalibrated per base rates
+           wall_hours - a rough estimate of the wall time of the run on
+           num_threads CPUs memory_bytes - the peak resident memory of the
+           run disk_bytes - the peak scratch usage of the run, downloads
+           included cpu_seconds, memory, disk - the per stage forecasts the
+           above are made of config - the generated config.txt
+           assemble_script - the assemble.sh generated by masurca from
+           config.txt) -> structure: parameter "total_bases" of Long,
+           parameter "long_reads_bases" of Long, parameter "num_threads" of
+           Long, parameter "jf_size" of Long, parameter "cpu_hours" of
+           Double, parameter "wall_hours" of Double, parameter "memory_bytes"
+           of Long, parameter "disk_bytes" of Long, parameter "cpu_seconds"
+           of mapping from String to Long, parameter "memory" of mapping from
+           String to Long, parameter "disk" of mapping from String to Long,
+           parameter "config" of String, parameter "assemble_script" of
+           String
         """
         return self._client.call_method('kb_MaSuRCA.run_masurca_assembler',
                                         [params], self._service_ver, context)
 
+    def profile_reads(self, params, context=None):
+        """
+        Estimate the genome size, coverage, repeat fraction and heterozygosity of reads libraries
+        from their k-mer histogram, before committing to an assembly
+        :param params: instance of type "profileReadsParams" (Arguments for
+           profile_reads workspace_name - the name of the workspace holding
+           the reads libraries reads_libraries - the paired-end reads
+           libraries to profile num_threads - the number of processes
+           counting the k-mers, all the available CPUs if omitted kmer_size -
+           the k-mer size of the histogram, 31 if omitted @optional
+           num_threads @optional kmer_size) -> structure: parameter
+           "workspace_name" of String, parameter "reads_libraries" of list of
+           type "paired_readsParams" (parameter groups) -> structure:
+           parameter "pe_id" of type "obj_ref" (An X/Y/Z style KBase object
+           reference), parameter "pe_prefix" of String, parameter "pe_mean"
+           of Long, parameter "pe_stdev" of Long, parameter "num_threads" of
+           Long, parameter "kmer_size" of Long
+        :returns: instance of type "profileReadsResults" (Output of
+           profile_reads, the estimates being null when the histogram shows
+           no coverage peak genome_size - the estimated genome size coverage
+           - the estimated base coverage of the genome by the reads
+           kmer_coverage - the depth of the main peak of the k-mer histogram
+           repeat_fraction - the share of the genomic k-mers from repeats
+           heterozygosity - the estimated rate of heterozygous sites
+           error_mass - the share of the k-mers from sequencing errors
+           verdict - 'under-sequenced', 'ok', 'over-sequenced' or 'unknown'
+           histogram - the number of distinct k-mers seen 0, 1, 2... times
+           among the sampled ones) -> structure: parameter "kmer_size" of
+           Long, parameter "total_bases" of Long, parameter "sampled_bases"
+           of Long, parameter "genome_size" of Long, parameter "coverage" of
+           Double, parameter "kmer_coverage" of Double, parameter
+           "repeat_fraction" of Double, parameter "heterozygosity" of Double,
+           parameter "error_mass" of Double, parameter "verdict" of String,
+           parameter "histogram" of list of Long
+        """
+        return self._client.call_method('kb_MaSuRCA.profile_reads',
+                                        [params], self._service_ver, context)
+
+    def run_masurca_sweep(self, params, context=None):
+        """
+        Assemble the same reads with several variants of the parameters, staging the reads once,
+        and compare the assemblies in a single report
+        :param params: instance of type "sweepParams" (Arguments for
+           run_masurca_sweep assembly_params - the parameters of
+           run_masurca_assembler shared by all the variants, the
+           output_contigset_name being suffixed with the name of each variant
+           variants - the variants to assemble max_cores - the cores the
+           variants running side by side may use together, all the available
+           CPUs if omitted max_memory_bytes - the memory they may use
+           together, the memory limit of the container if omitted @optional
+           max_cores @optional max_memory_bytes) -> structure: parameter
+           "assembly_params" of type "masurcaAssemblerParams" (Arguments for
+           run_masurca_assembler *******for creating the sr_config.txt
+           file******* 1. DATA consisting of 5 fields: 1)two_letter_prefix
+           2)mean 3)stdev 4)fastq(.gz)_fwd_reads 5)fastq(.gz)_rev_reads.
+           e.g., PE= pe 180 20  /FULL_PATH/frag_1.fastq 
+           /FULL_PATH/frag_2.fastq JUMP= sh 3600 200 
+           /FULL_PATH/short_1.fastq  /FULL_PATH/short_2.fastq #pacbio OR
+           nanopore reads must be in a single fasta or fastq file with
+           absolute path, can be gzipped #if you have both types of reads
+           supply them both as NANOPORE type PACBIO=/FULL_PATH/pacbio.fa
+           NANOPORE=/FULL_PATH/nanopore.fa OTHER=/FULL_PATH/file.frg 2.
+           PARAMETERS string graph_kmer_size - the k-mer size for deBruijn
+           graph values between 25 and 127 are supported, 'auto' will compute
+           the optimal size based on the read data and GC content bool
+           use_linking_mates - set this to 1 for all Illumina-only
+           assemblies; set this to 1 if you have less than 20x long reads
+           (454, Sanger, Pacbio) and less than 50x CLONE coverage by
+           Illumina, Sanger or 454 mate pairs; otherwise keep at 0 string
+           dna_source - indicate 'bacteria' or 'other organisms' for setting
+           limit_jump_coverage and cgwErrorRate values; when omitted they are
+           set from the genome size estimated from the reads int
+           limit_jump_coverage - this parameter is useful if you have too
+           many Illumina jumping library mates. Typically set it to 60 for
+           bacteria and 300 for the other organisms CA_PARAMETERS: these are
+           the additional parameters to Celera Assembler.  do not worry about
+           performance, number or processors or batch sizes -- these are
+           computed automatically. float cgwErrorRate=0.15 - set
+           cgwErrorRate=0.25 for bacteria and 0.1<=cgwErrorRate<=0.15 for
+           other organisms. int kmer_count_threshold - minimum count k-mers
+           used in error correction 1 means all k-mers are used.  one can
+           increase to 2 if Illumina coverage >100 bool close_gaps - whether
+           to attempt to close gaps in scaffolds with Illumina data (1) or
+           not (0) int num_threads - number of cpus to use; defaults to the
+           cpus available to the job int jf_size  - jellyfish hash size -- a
+           safe value is estimated_genome_size*estimated_coverage (e.g.,
+           2000000000); when omitted it is estimated from the total bases and
+           the k-mer sketch genome size of the input reads bool SOAP_ASSEMBLY
+           - set this to 1 to use SOAPdenovo contigging/scaffolding module. 
+           Assembly will be worse but will run faster. Useful for very large
+           (>5Gbp) genomes bool do_homopolymer_trim - specifies if we do (1)
+           or do not (0) want to trim long runs of homopolymers string
+           workspace_name - the name of the workspace from which to take
+           input and store output. string output_contigset_name - the name of
+           the output contigset string packaging_profile - which outputs go
+           into the report's zip file: 'minimal' (final scaffolds, config,
+           logs and QUAST), 'standard' (default, adds the final CA sequences
+           and summaries) or 'full' (all intermediate files) bool resume -
+           set this to 1 to run in a project directory keyed by the inputs
+           and parameters, so that re-running an interrupted job skips the
+           MaSuRCA stages that already completed string reduce_reads - reduce
+           deep paired-end libraries before assembling: 'none' (default),
+           'subsample' (keep random read pairs down to target_coverage times
+           the estimated genome size) or 'normalize' (digital normalization,
+           drop the read pairs whose median k-mer coverage reaches
+           target_coverage) int target_coverage - the coverage kept by
+           reduce_reads; defaults to 100 for 'subsample' and 20 for
+           'normalize' bool plan_only - set this to 1 to only generate
+           config.txt and assemble.sh from the workspace metadata of the
+           inputs, without downloading them, and return them with the
+           forecast resources of the run list<paired_readsParams>
+           read_libraries - Illumina PairedEndLibrary files to assemble
+           @optional jump_libraries @optional pacbio_reads @optional
+           other_frg_file @optional graph_kmer_size @optional
+           use_linking_mates @optional dna_source @optional
+           kmer_count_threshold @optional close_gaps @optional soap_assembly
+           @optional do_homopolymer_trim @optional num_threads @optional
+           jf_size @optional packaging_profile @optional resume @optional
+           reduce_reads @optional target_coverage @optional plan_only) ->
+           structure: parameter "workspace_name" of String, parameter
+           "num_threads" of Long, parameter "jf_size" of Long, parameter
+           "reads_libraries" of list of type "paired_readsParams" (parameter
+           groups) -> structure: parameter "pe_id" of type "obj_ref" (An
+           X/Y/Z style KBase object reference), parameter "pe_prefix" of
+           String, parameter "pe_mean" of Long, parameter "pe_stdev" of Long,
+           parameter "jump_libraries" of list of type "jump_readsParams" ->
+           structure: parameter "jp_id" of type "obj_ref" (An X/Y/Z style
+           KBase object reference), parameter "jp_prefix" of String,
+           parameter "jp_mean" of Long, parameter "jp_stdev" of Long,
+           parameter "pacbio_reads" of type "obj_ref" (An X/Y/Z style KBase
+           object reference), parameter "nanopore_reads" of type "obj_ref"
+           (An X/Y/Z style KBase object reference), parameter
+           "other_frg_file" of String, parameter "graph_kmer_size" of String,
+           parameter "use_linking_mates" of type "bool" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "dna_source" of
+           String, parameter "kmer_count_threshold" of Long, parameter
+           "close_gaps" of type "bool" (A boolean - 0 for false, 1 for true.
+           @range (0, 1)), parameter "soap_assembly" of type "bool" (A
+           boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "do_homopolymer_trim" of type "bool" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "output_contigset_name" of
+           String, parameter "create_report" of type "bool" (A boolean - 0
+           for false, 1 for true. @range (0, 1)), parameter
+           "packaging_profile" of String, parameter "resume" of type "bool"
+           (A boolean - 0 for false, 1 for true. @range (0, 1)), parameter
+           "reduce_reads" of String, parameter "target_coverage" of Long,
+           parameter "plan_only" of type "bool" (A boolean - 0 for false, 1
+           for true. @range (0, 1)), parameter "variants" of list of type
+           "sweepVariant" (A variant of the parameters of a sweep, the
+           parameters left out taking their value from the assembly_params of
+           the sweep name - the name of the variant, made of its parameters
+           if omitted @optional name @optional graph_kmer_size @optional
+           kmer_count_threshold @optional close_gaps @optional soap_assembly)
+           -> structure: parameter "name" of String, parameter
+           "graph_kmer_size" of String, parameter "kmer_count_threshold" of
+           Long, parameter "close_gaps" of type "bool" (A boolean - 0 for
+           false, 1 for true. @range (0, 1)), parameter "soap_assembly" of
+           type "bool" (A boolean - 0 for false, 1 for true. @range (0, 1)),
+           parameter "max_cores" of Long, parameter "max_memory_bytes" of
+           Long
+        :returns: instance of type "sweepResults" (Output of
+           run_masurca_sweep report_name, report_ref - the report comparing
+           the variants, with create_report set in assembly_params variants -
+           the outcome of each variant) -> structure: parameter "report_name"
+           of String, parameter "report_ref" of String, parameter "variants"
+           of list of type "sweepVariantResult" (The outcome of a variant of
+           a sweep overrides - the parameters of the variant assembly_ref -
+           the saved assembly, null when the variant failed error - why the
+           variant failed, null when it did not shared_from - the variant
+           whose jellyfish database and corrected reads this one reused stats
+           - the contig count, total length, N50... of the assembly resources
+           - the wall time, CPU time and peak memory of the assemble.sh run
+           @optional exit_code @optional assembly_ref @optional error
+           @optional shared_from @optional stats @optional resources) ->
+           structure: parameter "name" of String, parameter "overrides" of
+           mapping from String to unspecified object, parameter "exit_code"
+           of Long, parameter "assembly_ref" of String, parameter "error" of
+           String, parameter "shared_from" of String, parameter "stats" of
+           mapping from String to unspecified object, parameter "resources"
+           of mapping from String to unspecified object
+        """
+        return self._client.call_method('kb_MaSuRCA.run_masurca_sweep',
+                                        [params], self._service_ver, context)
+
     def status(self, context=None):
         return self._client.call_method('kb_MaSuRCA.status',
                                         [], self._service_ver, context)
@@ -342,6 +342,14 @@ class Application(object):
                              name='kb_MaSuRCA.run_masurca_assembler',
                              types=[dict])
         self.method_authentication['kb_MaSuRCA.run_masurca_assembler'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_MaSuRCA.profile_reads,
+                             name='kb_MaSuRCA.profile_reads',
+                             types=[dict])
+        self.method_authentication['kb_MaSuRCA.profile_reads'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_MaSuRCA.run_masurca_sweep,
+                             name='kb_MaSuRCA.run_masurca_sweep',
+                             types=[dict])
+        self.method_authentication['kb_MaSuRCA.run_masurca_sweep'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_MaSuRCA.status,
                              name='kb_MaSuRCA.status',
                              types=[dict])
@@ -1,31 +1,151 @@
+import os
+import re
 import sys
+import time
+import threading
 import subprocess
 
+from MaSuRCA.core.resource_monitor import ResourceMonitor
+
+# seconds to wait for the output pipe to drain once the command exited; a descendant that
+# outlives the command (a daemonized helper) keeps the pipe open and would block us forever
+OUTPUT_DRAIN_SECONDS = 30
+
 
 class Program_Runner:
 
-    def __init__(self, cmd, work_dir):
+    def __init__(self, cmd, work_dir, sample_interval=None):
         self.work_dir = work_dir
         self.executableName = cmd
+        # seconds between resource samples of the child process tree, falsy to disable
+        self.sample_interval = sample_interval
+        self.output_drain_seconds = OUTPUT_DRAIN_SECONDS
+        self.last_run_summary = None
 
     def run(self, command, cwd_dir=None):
         '''
         options is an array of command-line parameters passed
         to the RQCFilter App
         '''
+        exitCode, summary = self.run_with_summary(command, cwd_dir)
+        return exitCode
+
+    def run_with_summary(self, command, cwd_dir=None, output_handlers=None, new_session=False):
+        '''
+        run the command while sampling the resource usage of its process tree and return
+        (exit_code, summary), the summary holding the wall time, CPU-seconds, peak memory,
+        I/O and open files of the run plus the path of the sampled time series. The output
+        is waited for at most output_drain_seconds after the command exited.
+        With output_handlers, the merged stdout/stderr of the command is streamed line by
+        line to each handler's on_line(line) (and echoed to stdout); the handlers are also
+        told on_start(pid) and on_exit(exit_code, summary). A handler that stops the run
+        (e.g. the Watchdog) sets its failure attribute, which is added to the raised error.
+        With new_session, the command leads a new session and process group, so that the
+        whole group can be signalled.
+        '''
         cmmd = command
         if not cwd_dir:
             cwd_dir = self.work_dir
 
-        res = subprocess.Popen(cmmd, cwd=cwd_dir, shell=False)
-        exitCode = res.wait()
+        series_file = None
+        if self.sample_interval:
+            series_name = re.sub(r'[^\w.-]', '_', os.path.basename(cmmd[-1]))[:64]
+            series_file = os.path.join(cwd_dir, 'resource_usage_' + series_name + '.tsv')
+
+        output_handlers = output_handlers or []
+        start_time = time.time()
+        if output_handlers:
+            res = subprocess.Popen(cmmd, cwd=cwd_dir, shell=False, start_new_session=new_session,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        else:
+            res = subprocess.Popen(cmmd, cwd=cwd_dir, shell=False,
+                                   start_new_session=new_session)
+        for handler in output_handlers:
+            handler.on_start(res.pid)
+        reader = None
+        if output_handlers:
+            reader = threading.Thread(target=self._pump_output,
+                                      args=(res.stdout, output_handlers))
+            reader.daemon = True
+            reader.start()
+        monitor = None
+        if self.sample_interval:
+            monitor = ResourceMonitor(res.pid, self.sample_interval, series_file)
+            monitor.start()
+        try:
+            # wait4 reports the CPU time and max RSS of the child and its reaped descendants
+            _, status, rusage = os.wait4(res.pid, 0)
+        finally:
+            if monitor:
+                monitor.stop()
+            if reader:
+                # the pipe closes once the last process holding it exits
+                reader.join(self.output_drain_seconds)
+                if reader.is_alive():
+                    # the daemon reader goes on draining the pipe for the leftover process
+                    print('Output of {} still open {} s after it exited, no longer '
+                          'waited for'.format(os.path.basename(cmmd[-1]),
+                                              self.output_drain_seconds))
+        if os.WIFSIGNALED(status):
+            exitCode = -os.WTERMSIG(status)
+        else:
+            exitCode = os.WEXITSTATUS(status)
+        res.returncode = exitCode
 
-        if (exitCode == 0):
+        summary = self._summarize(exitCode, time.time() - start_time, rusage, monitor)
+        summary['series_file'] = series_file
+        self.last_run_summary = summary
+        for handler in output_handlers:
+            handler.on_exit(exitCode, summary)
+
+        failures = [h.failure for h in output_handlers if getattr(h, 'failure', None)]
+        if (exitCode == 0 and not failures):
             print('\n', ' '.join(cmmd),
                   ' was executed successfully, exit code: ' + str(exitCode))
         else:
             if sys.exc_info()[0]:
                 print('Error > ', sys.exc_info()[0])
             raise ValueError('Error running command: ' + ' '.join(cmmd) +
-                             '\nExit Code: ' + str(exitCode))
-        return exitCode
+                             '\nExit Code: ' + str(exitCode) +
+                             ''.join('\n' + f for f in failures))
+        return exitCode, summary
+
+    def _pump_output(self, stream, output_handlers):
+        '''
+        drain the child's output pipe until EOF, so the child never blocks on a full pipe
+        '''
+        for raw_line in iter(stream.readline, b''):
+            line = raw_line.decode('utf-8', 'replace').rstrip('\n')
+            print(line)
+            for handler in output_handlers:
+                try:
+                    handler.on_line(line)
+                except Exception as e:
+                    print('Output handler error > ', e)
+        stream.close()
+
+    def _summarize(self, exit_code, wall_seconds, rusage, monitor):
+        '''
+        combine the rusage of the finished child with the peaks sampled during the run.
+        peak_rss_bytes is the peak of the summed RSS of the process tree, an upper bound that
+        counts shared pages once per process; peak_pss_bytes shares them out.
+        '''
+        max_process_rss = rusage.ru_maxrss * 1024  # ru_maxrss is in kilobytes on Linux
+        summary = {'exit_code': exit_code,
+                   'wall_seconds': wall_seconds,
+                   'user_seconds': rusage.ru_utime,
+                   'system_seconds': rusage.ru_stime,
+                   'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+                   'max_process_rss_bytes': max_process_rss,
+                   'peak_rss_bytes': max_process_rss,
+                   'samples': 0}
+        if monitor:
+            peaks = monitor.peak_values()
+            summary.update({'peak_rss_bytes': max(max_process_rss, peaks['rss_bytes']),
+                            'peak_pss_bytes': peaks['pss_bytes'],
+                            'peak_processes': peaks['processes'],
+                            'peak_open_files': peaks['open_files'],
+                            'read_bytes': peaks['read_bytes'],
+                            'write_bytes': peaks['write_bytes'],
+                            'samples': monitor.samples})
+        return summary
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import glob
+import json
+import time
+import shutil
+
+from MaSuRCA.core.resource_monitor import sample_process_tree
+
+# The stages of a MaSuRCA assemble.sh run in execution order, each with the pattern of the
+# output line announcing it. assemble.sh logs its own steps as '[date] message' lines while
+# the Celera Assembler (CA) steps are recognized from the executables runCA launches.
+# The first matching pattern wins.
+ASSEMBLE_STAGES = [
+    ('read_stats', re.compile(r'Processing \w+ library reads|Average PE read length')),
+    ('jellyfish', re.compile(r'Creating mer database')),
+    ('error_correction', re.compile(r'Error correct')),
+    ('genome_size', re.compile(r'Estimating genome size')),
+    ('k_unitigs', re.compile(r'Creating k-unitigs')),
+    ('super_reads', re.compile(r'Computing super reads')),
+    ('mega_reads', re.compile(r'[Mm]ega-reads')),
+    ('ca_overlap', re.compile(r'Celera Assembler|Running assembly|\b(gatekeeper|meryl|'
+                              r'overlapInCore|overlapStore|overlapStoreBuild)\b')),
+    ('ca_unitig', re.compile(r'\b(bogart|unitigger|buildUnitigs)\b')),
+    ('ca_consensus', re.compile(r'\b(utgcns|ctgcns|consensus)\b')),
+    ('ca_scaffold', re.compile(r'\b(cgw|terminator)\b')),
+    ('gap_closing', re.compile(r'Gap clos|closeGaps')),
+    ('done', re.compile(r'Assembly complete')),
+]
+STAGE_NAMES = [name for name, _ in ASSEMBLE_STAGES]
+STARTUP_STAGE = 'startup'
+
+# The outputs, relative to the project dir, a finished stage leaves behind. assemble.sh skips
+# a step whose output file exists, so the outputs of an unfinished non-CA stage have to be
+# removed before resuming; runCA keeps its own success markers under CA/ and resumes itself.
+STAGE_OUTPUTS = {
+    'jellyfish': ['quorum_mer_db.jf'],
+    'error_correction': ['pe.cor.fa'],
+    'genome_size': ['k_u_hash_0'],
+    'k_unitigs': ['guillaumeKUnitigsAtLeast32bases_all.fasta'],
+    'super_reads': ['work1/superReadSequences.fasta'],
+    'mega_reads': ['mr.*.fa'],
+    'ca_overlap': ['CA/genome.ovlStore'],
+    'ca_unitig': ['CA/4-unitigger/unitigger.success'],
+    'ca_consensus': ['CA/5-consensus/consensus.success'],
+    'ca_scaffold': ['CA/9-terminator/genome.scf.fasta'],
+    'gap_closing': ['CA/10-gapclose/genome.scf.fasta'],
+    'done': ['CA/final.genome.scf.fasta'],
+}
+CA_MANAGED_STAGES = ['ca_overlap', 'ca_unitig', 'ca_consensus', 'ca_scaffold']
+CHECKPOINT_FILE = 'masurca_checkpoints.json'
+
+
+def detect_stage(line):
+    """
+    detect_stage: the name of the stage the output line announces, or None
+    """
+    for name, pattern in ASSEMBLE_STAGES:
+        if pattern.search(line):
+            return name
+    return None
+
+
+def stage_outputs(proj_dir, stage):
+    """
+    stage_outputs: the STAGE_OUTPUTS of stage present in proj_dir
+    """
+    paths = []
+    for pattern in STAGE_OUTPUTS.get(stage, []):
+        paths.extend(glob.glob(os.path.join(proj_dir, pattern)))
+    return paths
+
+
+def load_checkpoints(proj_dir):
+    """
+    load_checkpoints: the stages recorded as completed in the project dir
+    """
+    checkpoint_path = os.path.join(proj_dir, CHECKPOINT_FILE)
+    if not os.path.isfile(checkpoint_path):
+        return []
+    try:
+        with open(checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file).get('completed', [])
+    except ValueError:
+        return []
+
+
+def detect_checkpoints(proj_dir):
+    """
+    detect_checkpoints: return (completed_stages, first_incomplete_stage) of a previous run
+    in proj_dir. A stage only counts as completed if it was recorded as such and its outputs
+    are still in place; the stages are checked in execution order. Stages never entered by
+    the previous run (e.g. mega_reads without long reads) are passed over.
+    """
+    recorded = load_checkpoints(proj_dir)
+    completed = []
+    for stage in STAGE_NAMES:
+        if stage not in recorded:
+            if any(s in recorded for s in STAGE_NAMES[STAGE_NAMES.index(stage) + 1:]):
+                continue
+            return completed, stage
+        if STAGE_OUTPUTS.get(stage) and not stage_outputs(proj_dir, stage):
+            return completed, stage
+        completed.append(stage)
+    return completed, None
+
+
+def prepare_resume(proj_dir):
+    """
+    prepare_resume: remove the possibly partial outputs of the first incomplete stage and
+    of the non-CA stages after it, so that assemble.sh redoes exactly those, and rewrite
+    the checkpoint file to the verified completed stages. Returns the detect_checkpoints
+    result.
+    """
+    completed, first_incomplete = detect_checkpoints(proj_dir)
+    if first_incomplete is not None:
+        for stage in STAGE_NAMES[STAGE_NAMES.index(first_incomplete):]:
+            if stage in CA_MANAGED_STAGES:
+                continue
+            for path in stage_outputs(proj_dir, stage):
+                print('Removing partial output {} of stage {}'.format(path, stage))
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+    save_checkpoints(proj_dir, completed)
+    return completed, first_incomplete
+
+
+def save_checkpoints(proj_dir, completed):
+    checkpoint_path = os.path.join(proj_dir, CHECKPOINT_FILE)
+    with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+        json.dump({'completed': completed, 'time': time.time()}, checkpoint_file)
+    os.rename(checkpoint_path + '.tmp', checkpoint_path)
+
+
+class StageTracker(object):
+    """
+    StageTracker: an output handler for Program_Runner that follows the stage transitions
+    in the assemble.sh output and accumulates the wall-clock and CPU time spent per stage.
+    A stage entered several times (e.g. CA consensus before and after scaffolding) adds up
+    its segments.
+    With a checkpoint_dir, the stages left for a later stage are recorded as completed in
+    its checkpoint file, for resuming an interrupted run.
+    """
+
+    def __init__(self, checkpoint_dir=None):
+        self.pid = None
+        self.current_stage = None
+        self.stage_start = None
+        self.stage_cpu_start = 0.0
+        self.stages = {}
+        self.order = []
+        self.checkpoint_dir = checkpoint_dir
+        self.completed = load_checkpoints(checkpoint_dir) if checkpoint_dir else []
+
+    def _checkpoint(self, upto_stage=None):
+        """
+        _checkpoint: record every stage seen before upto_stage in the stage order (all of
+        them when upto_stage is None) as completed
+        """
+        if not self.checkpoint_dir:
+            return
+        limit = STAGE_NAMES.index(upto_stage) if upto_stage else len(STAGE_NAMES)
+        newly_completed = [s for s in self.order
+                           if s in STAGE_NAMES[:limit] and s not in self.completed]
+        if newly_completed:
+            self.completed = [s for s in STAGE_NAMES
+                              if s in self.completed or s in newly_completed]
+            save_checkpoints(self.checkpoint_dir, self.completed)
+
+    def _cpu_seconds(self):
+        """
+        _cpu_seconds: the CPU time used so far by the process tree; kept monotonic since a
+        sample taken while the tree is exiting can miss processes
+        """
+        if self.pid is None:
+            return self.stage_cpu_start
+        return max(self.stage_cpu_start, sample_process_tree(self.pid)['cpu_seconds'])
+
+    def _enter(self, stage, now, cpu_seconds):
+        if self.current_stage is not None:
+            entry = self.stages.setdefault(
+                self.current_stage,
+                {'stage': self.current_stage, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                 'segments': 0, 'first_start': self.stage_start})
+            entry['wall_seconds'] += now - self.stage_start
+            entry['cpu_seconds'] += max(0.0, cpu_seconds - self.stage_cpu_start)
+            entry['segments'] += 1
+            if self.current_stage not in self.order:
+                self.order.append(self.current_stage)
+        self.current_stage = stage
+        self.stage_start = now
+        self.stage_cpu_start = cpu_seconds
+
+    def on_start(self, pid):
+        self.pid = pid
+        self._enter(STARTUP_STAGE, time.time(), 0.0)
+
+    def on_line(self, line):
+        stage = detect_stage(line)
+        if stage is not None and stage != self.current_stage:
+            print('Entering MaSuRCA stage {}'.format(stage))
+            self._enter(stage, time.time(), self._cpu_seconds())
+            self._checkpoint(stage)
+
+    def on_exit(self, exit_code, summary):
+        self._enter(None, time.time(), summary.get('cpu_seconds', self.stage_cpu_start))
+        if exit_code == 0:
+            self._checkpoint()
+
+    def table(self):
+        """
+        table: the per-stage timings in the order the stages were first entered
+        """
+        return [self.stages[s] for s in self.order]
+
+    def save(self, json_path):
+        with open(json_path, 'w') as json_file:
+            json.dump(self.table(), json_file, indent=1)
+
+    def format_table(self):
+        lines = ['{:<18}{:>14}{:>14}{:>10}'.format('Stage', 'Wall (s)', 'CPU (s)', 'Runs')]
+        for entry in self.table():
+            lines.append('{:<18}{:>14.1f}{:>14.1f}{:>10}'.format(
+                entry['stage'], entry['wall_seconds'], entry['cpu_seconds'],
+                entry['segments']))
+        return '\n'.join(lines)
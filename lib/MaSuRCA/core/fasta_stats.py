@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import mmap
+from array import array
+
+import numpy as np
+
+
+class FastaStats(object):
+    """
+    FastaStats: per-contig lengths of a FASTA file kept in a compact array, plus the
+    assembly-wide base composition, gap and contiguity metrics.
+
+    It can stand in for the {contig_id: length} dict _load_stats used to return:
+    iterating yields the contig ids and stats[contig_id] gives the length (by a linear
+    lookup, so prefer the lengths array for anything but spot checks).
+    """
+
+    def __init__(self):
+        self.contig_ids = []
+        self.lengths = array('L')
+        self.gc_count = 0
+        self.n_count = 0
+        self.gap_count = 0
+        self.gap_length = 0
+        self.longest_gap = 0
+
+    def __len__(self):
+        return len(self.contig_ids)
+
+    def __iter__(self):
+        return iter(self.contig_ids)
+
+    def __getitem__(self, contig_id):
+        try:
+            return self.lengths[self.contig_ids.index(contig_id)]
+        except ValueError:
+            raise KeyError(contig_id)
+
+    def __contains__(self, contig_id):
+        return contig_id in self.contig_ids
+
+    def items(self):
+        return zip(self.contig_ids, self.lengths)
+
+    def add_gap(self, gap_len):
+        self.gap_count += 1
+        self.gap_length += gap_len
+        if gap_len > self.longest_gap:
+            self.longest_gap = gap_len
+
+    @property
+    def total_length(self):
+        return sum(self.lengths)
+
+    @property
+    def gc_content(self):
+        """
+        gc_content: GC fraction over the called (non-N) bases
+        """
+        called = self.total_length - self.n_count
+        return self.gc_count / float(called) if called else 0.0
+
+    def _nx(self, fraction):
+        """
+        _nx: return (Nx, Lx) - the length of the shortest contig among the longest contigs
+        covering the given fraction of the total length, and the number of those contigs
+        """
+        if not len(self.lengths):
+            return 0, 0
+        desc = np.sort(np.array(self.lengths, dtype=np.int64))[::-1]
+        cumsum = np.cumsum(desc)
+        idx = int(np.searchsorted(cumsum, cumsum[-1] * fraction, side='left'))
+        return int(desc[idx]), idx + 1
+
+    def summary(self):
+        """
+        summary: the assembly-wide metrics as a plain dict
+        """
+        n50, l50 = self._nx(0.5)
+        n90, l90 = self._nx(0.9)
+        return {'contig_count': len(self),
+                'total_length': self.total_length,
+                'max_length': max(self.lengths) if len(self.lengths) else 0,
+                'gc_content': self.gc_content,
+                'n_count': self.n_count,
+                'gap_count': self.gap_count,
+                'gap_length': self.gap_length,
+                'longest_gap': self.longest_gap,
+                'n50': n50, 'l50': l50,
+                'n90': n90, 'l90': l90}
+
+
+class FastaScanner(object):
+    """
+    FastaScanner: single pass, memory-bounded FASTA scanner. The file is memory mapped and
+    each sequence is processed in chunks of chunk_size bytes, so the memory use does not
+    grow with the contig or file size.
+    """
+    WHITESPACE = b' \t\r\n\x0b\x0c'
+    GAP_RE = re.compile(b'[Nn]+')
+
+    def __init__(self, chunk_size=16 * 1024 * 1024):
+        self.chunk_size = chunk_size
+
+    def scan(self, fasta_path):
+        stats = FastaStats()
+        with open(fasta_path, 'rb') as fasta_file:
+            if os.fstat(fasta_file.fileno()).st_size == 0:
+                raise Exception("There are no contigs in this file")
+            mm = mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._scan_records(mm, stats)
+            finally:
+                mm.close()
+        if not len(stats):
+            raise Exception("There are no contigs in this file")
+        return stats
+
+    def _scan_records(self, mm, stats):
+        size = len(mm)
+        if mm[0:1] == b'>':
+            hdr = 0
+        else:
+            hdr = mm.find(b'\n>')
+            hdr = -1 if hdr < 0 else hdr + 1
+        while hdr >= 0:
+            eol = mm.find(b'\n', hdr)
+            if eol < 0:
+                eol = size
+            fasta_header = mm[hdr + 1:eol].strip()
+            contig_id = fasta_header.split(b' ', 1)[0].decode('utf-8')
+            nxt = mm.find(b'\n>', eol)
+            seq_end = size if nxt < 0 else nxt
+            stats.contig_ids.append(contig_id)
+            stats.lengths.append(self._scan_sequence(mm, eol + 1, seq_end, stats))
+            hdr = -1 if nxt < 0 else nxt + 1
+
+    def _scan_sequence(self, mm, start, end, stats):
+        """
+        _scan_sequence: accumulate composition and gap runs of mm[start:end] chunk by chunk
+        and return the sequence length. A gap run spanning a chunk boundary is carried over.
+        """
+        seq_len = 0
+        open_gap = 0
+        for chunk_start in range(start, end, self.chunk_size):
+            seq = mm[chunk_start:min(chunk_start + self.chunk_size, end)].translate(
+                None, self.WHITESPACE)
+            if not seq:
+                continue
+            seq_len += len(seq)
+            stats.gc_count += (seq.count(b'G') + seq.count(b'C') +
+                               seq.count(b'g') + seq.count(b'c'))
+            n_count = seq.count(b'N') + seq.count(b'n')
+            if not n_count:
+                if open_gap:
+                    stats.add_gap(open_gap)
+                    open_gap = 0
+                continue
+            stats.n_count += n_count
+            if open_gap and seq[0:1] not in (b'N', b'n'):
+                stats.add_gap(open_gap)
+                open_gap = 0
+            for m in self.GAP_RE.finditer(seq):
+                gap_len = m.end() - m.start()
+                if m.start() == 0:
+                    gap_len += open_gap
+                    open_gap = 0
+                if m.end() == len(seq):
+                    open_gap = gap_len
+                else:
+                    stats.add_gap(gap_len)
+        if open_gap:
+            stats.add_gap(open_gap)
+        return seq_len
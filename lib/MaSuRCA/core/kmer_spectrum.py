@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+import math
+import itertools
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+from MaSuRCA.core.read_stats import open_reads, iter_records, kmer_hash_array, _BASE_CODES
+
+# GRAPH_KMER_SIZE values evaluated, within the 25 to 127 supported by MaSuRCA
+CANDIDATE_KS = [25, 31, 41, 51, 61, 71, 81, 95, 111, 127]
+# Only the k-mers starting with one of the sampled prefixes or ending with the reverse
+# complement of one are counted, about 2 / 4 ** length of them per prefix (1/32 for the
+# PREFIX_LEN ones). The rule is the same for a k-mer and its reverse complement, so every
+# occurrence of a sampled k-mer is counted, on either strand, and the sampled spectrum of
+# all the reads has the depth of the full one at a fraction of the memory. Longer prefixes,
+# up to MAX_PREFIX_LEN, sample fewer k-mers from the larger datasets.
+PREFIX_LEN = 3
+MAX_PREFIX_LEN = 8
+# the distinct k-mers a count may hold, a few GB of memory
+DEFAULT_MAX_KMERS = 20000000
+MAX_HISTO_COUNT = 10000
+# bases of the reads hashed at a time, some 100 MB of the memory of a worker per k
+BATCH_BASES = 1000000
+# distinct k-mers of the batches below which their counts are not merged yet
+MERGE_MIN_KMERS = 1000000
+_DIGITS = bytes.maketrans(b'ACGT', b'0123')
+# least depth of the main peak of a sampled spectrum for it to be analyzed
+MIN_SAMPLE_PEAK = 5
+# least height of a peak at twice the depth of the highest one, relative to it, for the
+# highest one to be taken as the het peak
+HET_PEAK_MIN_RATIO = 0.1
+# least k-mer depth of the main peak, in the full data, for a k to be chosen
+MIN_PEAK_DEPTH = 8
+PLOT_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b',
+               '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+
+def sample_prefixes(n, length=PREFIX_LEN):
+    """
+    sample_prefixes: n of the prefixes of the given length, evenly spaced from an offset
+    into their sorted list, so that they are spread over the alphabet rather than all
+    starting with A, and the longer ones are no homopolymer runs
+    """
+    prefixes = [''.join(p).encode('ascii') for p in itertools.product('ACGT', repeat=length)]
+    n = max(1, min(len(prefixes), n))
+    step = len(prefixes) // n
+    offset = int(len(prefixes) * 0.618)
+    return sorted(prefixes[(offset + i * step) % len(prefixes)] for i in range(n))
+
+
+def bounded_prefixes(n, expected_kmers, max_kmers=DEFAULT_MAX_KMERS):
+    """
+    bounded_prefixes: up to n prefixes sampling at most max_kmers of the expected_kmers
+    distinct k-mers, as long as needed from PREFIX_LEN to MAX_PREFIX_LEN. n prefixes of
+    PREFIX_LEN when expected_kmers is unknown.
+    """
+    length = PREFIX_LEN
+    if expected_kmers:
+        # each prefix samples about 2 / 4 ** length of the k-mers
+        while length < MAX_PREFIX_LEN and expected_kmers * 2 / 4.0 ** length > max_kmers:
+            length += 1
+        n = min(n, int(max_kmers / (expected_kmers * 2 / 4.0 ** length)))
+    return sample_prefixes(n, length)
+
+
+ALL_PREFIXES = sample_prefixes(4 ** PREFIX_LEN)
+SAMPLE_PREFIXES = sample_prefixes(1)
+
+
+def _prefix_codes(prefixes):
+    # the prefixes as base 4 numbers of the 2 bit codes of read_stats
+    return np.array(sorted(int(p.upper().translate(_DIGITS), 4) for p in prefixes),
+                    dtype=np.int64)
+
+
+def _window_codes(codes, length):
+    """
+    _window_codes: the base 4 number of the length codes starting at each position of the
+    int64 codes (meaningless for the windows holding an N)
+    """
+    n = len(codes) - length + 1
+    windows = np.zeros(n, dtype=np.int64)
+    for i in range(length):
+        windows *= 4
+        windows += codes[i:i + n]
+    return windows
+
+
+def _sampled_mask(codes, k, prefix_codes, prefix_len):
+    """
+    _sampled_mask: the boolean array of the k-mers of codes sampled by the prefixes of
+    prefix_codes, those starting with one of them or ending with its reverse complement.
+    The rule is the same for both strands of a k-mer.
+    """
+    n = len(codes) - k + 1
+    first = _window_codes(codes, prefix_len)[:n]
+    # the window of the reversed complemented codes ending at position i is the reverse
+    # complement of the one starting at i
+    last = _window_codes(3 - codes[::-1], prefix_len)[::-1][k - prefix_len:]
+    return np.isin(first, prefix_codes) | np.isin(last, prefix_codes)
+
+
+def _count_batch(task):
+    """
+    _count_batch: pool worker body, the distinct sampled canonical k-mer hashes of a batch
+    of sequences, for each k, with their counts, k-mer positions and sampled k-mers
+    """
+    seqs, ks, prefix_codes, prefix_len = task
+    codes = _BASE_CODES[np.frombuffer(b'N'.join(seqs), dtype=np.uint8)].astype(np.int64)
+    result = {}
+    for k in ks:
+        positions = sum(len(seq) - k + 1 for seq in seqs if len(seq) >= k)
+        if len(codes) < k:
+            result[k] = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64), 0, 0)
+            continue
+        hashes = kmer_hash_array(seqs, k, mask=_sampled_mask(codes, k, prefix_codes,
+                                                             prefix_len))
+        keys, counts = np.unique(hashes, return_counts=True)
+        result[k] = (keys, counts, positions, len(hashes))
+    return result
+
+
+class _KmerCounts(object):
+    """
+    _KmerCounts: the counts of the distinct k-mer hashes, merged from those of the batches
+    once these outgrow the merged ones, which keeps the merging to O(log) sorts per k-mer
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._parts = []
+        self._parts_size = 0
+
+    def add(self, keys, counts):
+        self._parts.append((keys, counts))
+        self._parts_size += len(keys)
+        if self._parts_size > max(len(self.keys), MERGE_MIN_KMERS):
+            self._merge()
+
+    def _merge(self):
+        if not self._parts:
+            return
+        keys = np.concatenate([self.keys] + [part[0] for part in self._parts])
+        counts = np.concatenate([self.counts] + [part[1] for part in self._parts])
+        self._parts = []
+        self._parts_size = 0
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts,
+                                  minlength=len(self.keys)).astype(np.int64)
+
+    def values(self):
+        self._merge()
+        return self.counts
+
+
+def _read_batches(reads_files, max_bases, stats):
+    """
+    _read_batches: yield the sequences of the reads files in batches of about BATCH_BASES,
+    of all of them or, with max_bases, of their first max_bases split between them,
+    adding the bases read up in stats
+    """
+    per_file = max_bases / max(1, len(reads_files)) if max_bases else None
+    for reads_path in reads_files:
+        file_bases = 0
+        batch = []
+        batch_bases = 0
+        with open_reads(reads_path) as reads_file:
+            for _, seq, _ in iter_records(reads_file):
+                batch.append(seq)
+                batch_bases += len(seq)
+                file_bases += len(seq)
+                if batch_bases >= BATCH_BASES:
+                    yield batch
+                    batch = []
+                    batch_bases = 0
+                if per_file and file_bases >= per_file:
+                    break
+        if batch:
+            yield batch
+        stats['bases'] += file_bases
+
+
+def _map_batches(tasks, workers):
+    """
+    _map_batches: yield _count_batch of the tasks, run by workers processes with at most
+    two tasks per worker read ahead, so that the reads are not all held in memory
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _count_batch(task)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_count_batch, (task,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def count_sampled_kmers(reads_files, ks, max_bases=None, prefixes=None, workers=1):
+    """
+    count_sampled_kmers: count the sampled canonical k-mers, for each k in ks, of all the
+    reads files or, with max_bases, of their first max_bases split between them. The reads
+    are hashed in batches, see kmer_hash_array, split between workers processes, and the
+    counts of the batches merged. Returns (counts, stats) where counts maps each k to the
+    array of the counts of its distinct sampled k-mers and stats holds the bases read and,
+    per k, the k-mer positions seen and sampled. prefixes (SAMPLE_PREFIXES by default)
+    select the k-mers counted; they, not the bases read, bound the memory.
+    """
+    prefixes = sorted(set(prefixes or SAMPLE_PREFIXES))
+    prefix_codes = _prefix_codes(prefixes)
+    merged = dict((k, _KmerCounts()) for k in ks)
+    stats = {'bases': 0, 'positions': dict((k, 0) for k in ks),
+             'sampled': dict((k, 0) for k in ks)}
+    tasks = ((batch, ks, prefix_codes, len(prefixes[0]))
+             for batch in _read_batches(reads_files, max_bases, stats))
+    for result in _map_batches(tasks, workers):
+        for k, (keys, counts, positions, sampled) in result.items():
+            merged[k].add(keys, counts)
+            stats['positions'][k] += positions
+            stats['sampled'][k] += sampled
+    return dict((k, merged[k].values()) for k in ks), stats
+
+
+def histogram(kmer_counts, max_count=MAX_HISTO_COUNT):
+    """
+    histogram: the k-mer spectrum of the array of the counts of the distinct k-mers, as the
+    list of the numbers of distinct k-mers seen 0, 1, ..., max_count times (the last bin
+    holding the higher counts)
+    """
+    histo = np.bincount(np.minimum(kmer_counts, max_count),
+                        minlength=max_count + 1).tolist()
+    while len(histo) > 2 and not histo[-1]:
+        histo.pop()
+    return histo
+
+
+def analyze_spectrum(histo, k, depth_scale=1.0, sample_rate=1.0):
+    """
+    analyze_spectrum: locate the error trough and the main peak of a k-mer spectrum and
+    estimate from them
+        error_mass: the share of the k-mer instances below the trough (sequencing errors)
+        solid_fraction: the share of the distinct k-mers at or above the trough
+        heterozygosity: the per base rate, from the k-mers of the half depth peak
+        repeat_fraction: the share of the solid k-mer instances deeper than 1.5 x the peak
+        depth: the depth of the main peak, fitted as the mean depth of the k-mers within
+            25% of the peak
+        peak_depth: that depth scaled by depth_scale to the full data
+        genome_size: the solid k-mer instances over the depth, over sample_rate
+        genomic_kmers: the distinct solid k-mers, over sample_rate
+        het_kmers: the distinct k-mers of the half depth peak, over sample_rate
+    Returns None when the spectrum has no distinct peak, e.g. for a too shallow sample.
+    """
+    trough = None
+    for c in range(1, len(histo) - 1):
+        if histo[c] <= histo[c + 1]:
+            trough = c
+            break
+    if trough is None:
+        return None
+    peak = max(range(trough, len(histo) - 1), key=lambda c: histo[c])
+    if peak < MIN_SAMPLE_PEAK or histo[peak] <= histo[trough]:
+        return None
+    # in a heterozygous genome the half depth peak of the het k-mers outgrows the main one
+    # as k increases; the main peak is then a local maximum at about twice the depth
+    double = [c for c in range(int(1.75 * peak), min(len(histo) - 1, int(2.25 * peak) + 1))
+              if histo[c] >= histo[c - 1] and histo[c] >= histo[c + 1]]
+    if double:
+        main = max(double, key=lambda c: histo[c])
+        if (histo[main] >= HET_PEAK_MIN_RATIO * histo[peak] and
+                min(histo[peak:main + 1]) < histo[main]):
+            peak = main
+
+    instances = sum(c * n for c, n in enumerate(histo))
+    solid_instances = sum(c * n for c, n in enumerate(histo) if c >= trough)
+    distinct = sum(histo[1:])
+    n_full = sum(histo[int(0.75 * peak):int(1.25 * peak) + 1])
+    depth = sum(c * histo[c] for c in range(int(0.75 * peak), min(len(histo) - 1,
+                                                                 int(1.25 * peak) + 1)))
+    depth = depth / float(n_full) if n_full else float(peak)
+    n_half = 0
+    if int(0.35 * peak) >= trough:
+        n_half = sum(histo[int(0.35 * peak):int(0.65 * peak) + 1])
+    # a het site turns the k k-mers covering it into two half depth k-mers, so there are
+    # about 2 k r G of those against (1 - k r) G at full depth
+    heterozygosity = n_half / float(k * (n_half + 2 * n_full)) if n_full else 0.0
+    return {'k': k,
+            'trough': trough,
+            'peak': peak,
+            'depth': depth,
+            'peak_depth': depth * depth_scale,
+            'error_mass': 1 - solid_instances / float(instances),
+            'solid_fraction': sum(histo[trough:]) / float(distinct),
+            'heterozygosity': heterozygosity,
+            'repeat_fraction': sum(c * n for c, n in enumerate(histo)
+                                   if c > 1.5 * peak) / float(solid_instances),
+            'genome_size': int(solid_instances / depth / sample_rate),
+            'genomic_kmers': int(sum(histo[trough:]) / sample_rate),
+            'het_kmers': int(n_half / sample_rate)}
+
+
+def kmer_score(analysis):
+    """
+    kmer_score: the objective maximized by choose_k, the distinct solid k-mers outside of the
+    half depth peak, genomic_kmers - het_kmers. The distinct solid k-mers grow with k as
+    repeats get resolved and shrink once the depth gets too low for the genomic k-mers to
+    stand out from the errors (the KmerGenie criterion, Chikhi and Medvedev 2014). Leaving
+    out the het k-mers, whose share grows with k, keeps het bubbles from fragmenting the
+    graph in heterozygous genomes.
+    """
+    return analysis['genomic_kmers'] - analysis['het_kmers']
+
+
+def choose_k(analyses):
+    """
+    choose_k: the k of the best kmer_score among the analyzed spectra whose main peak is at
+    least MIN_PEAK_DEPTH deep, or None
+    """
+    usable = [a for a in analyses if a and a['peak_depth'] >= MIN_PEAK_DEPTH]
+    if not usable:
+        return None
+    return max(usable, key=kmer_score)['k']
+
+
+class KmerSpectrumTuner(object):
+    """
+    KmerSpectrumTuner: a pre-pass over the reads computing the prefix sampled k-mer spectra
+    of the candidate GRAPH_KMER_SIZE values to choose k from, see choose_k. The first
+    max_bases of the reads are read (all of them when None) and the depths of the spectra
+    scaled by the total over the bases read; the memory is bounded by sampling fewer
+    k-mers, at most max_kmers over all the candidates, given the distinct k-mers per base
+    of the reads. Candidates longer than max_k_fraction of the median read length are
+    skipped, as they leave too few k-mers per read. The reads are hashed by workers
+    processes.
+    """
+
+    def __init__(self, ks=None, max_bases=None, max_k_fraction=0.8,
+                 max_kmers=DEFAULT_MAX_KMERS, workers=1):
+        self.ks = ks or CANDIDATE_KS
+        self.max_bases = max_bases
+        self.max_k_fraction = max_k_fraction
+        self.max_kmers = max_kmers
+        self.workers = max(1, workers)
+
+    def tune(self, reads_files, read_length, total_bases=None, distinct_per_base=None):
+        """
+        tune: return the dict of the 'chosen_k' (None when no spectrum is conclusive), the
+        per k 'analyses' and 'spectra', and the 'sampled_bases'. total_bases, of the
+        reads_files only, scales the depths of the spectra when max_bases cuts them short.
+        """
+        ks = [k for k in self.ks if k <= self.max_k_fraction * read_length] or self.ks[:1]
+        prefixes = SAMPLE_PREFIXES
+        if total_bases and distinct_per_base:
+            bases = min(total_bases, self.max_bases or total_bases)
+            prefixes = bounded_prefixes(1, distinct_per_base * bases * len(ks), self.max_kmers)
+        counts, stats = count_sampled_kmers(reads_files, ks, self.max_bases, prefixes,
+                                            self.workers)
+        depth_scale = 1.0
+        if total_bases and stats['bases']:
+            depth_scale = max(1.0, total_bases / float(stats['bases']))
+        spectra = {}
+        analyses = {}
+        for k in ks:
+            spectra[k] = histogram(counts[k])
+            counts[k] = None
+            rate = (stats['sampled'][k] / float(stats['positions'][k])
+                    if stats['positions'][k] else 1.0)
+            analyses[k] = analyze_spectrum(spectra[k], k, depth_scale, rate)
+        return {'chosen_k': choose_k(analyses.values()),
+                'analyses': analyses,
+                'spectra': spectra,
+                'sampled_bases': stats['bases']}
+
+
+def count_kmer_histogram(reads_files, k, prefixes=None, workers=4, max_bases=None):
+    """
+    count_kmer_histogram: the spectrum of the k-mers sampled by prefixes (ALL_PREFIXES, i.e.
+    all k-mers, by default) of the reads files, or of their first max_bases, the batches of
+    reads hashed by workers processes. Returns (histogram, stats) as count_sampled_kmers.
+    """
+    counts, stats = count_sampled_kmers(reads_files, [k], max_bases,
+                                        prefixes or ALL_PREFIXES, workers)
+    return histogram(counts[k]), stats
+
+
+class ReadsProfiler(object):
+    """
+    ReadsProfiler: profiles a reads dataset from its k-mer histogram, counted with
+    count_kmer_histogram over the first max_bases of the reads (all of them when None), its
+    depth scaled to the total_bases: genome size, k-mer and base coverage, repeat fraction,
+    heterozygosity and error k-mer mass, and whether the dataset is under or over sequenced
+    for MaSuRCA.
+    At most max_prefixes prefixes (about 1/8 of the k-mers by default) are sampled, and only
+    as many, as long, as needed to expect at most max_kmers distinct k-mers, given the
+    total_bases and distinct_per_base, the distinct k-mers per base of the reads (e.g. from
+    ReadStatsEstimator, mostly error k-mers in deep datasets).
+    """
+    # base coverage range MaSuRCA assembles well from
+    MIN_COVERAGE = 30
+    MAX_COVERAGE = 150
+
+    def __init__(self, k=31, workers=4, max_bases=None, max_kmers=DEFAULT_MAX_KMERS,
+                 max_prefixes=4):
+        self.k = k
+        self.workers = max(1, workers)
+        self.max_bases = max_bases
+        self.max_kmers = max_kmers
+        self.max_prefixes = max_prefixes
+
+    def _prefixes(self, total_bases, distinct_per_base):
+        bases = min(total_bases or 0, self.max_bases or total_bases or 0)
+        return bounded_prefixes(self.max_prefixes, distinct_per_base * bases
+                                if distinct_per_base else None, self.max_kmers)
+
+    def profile(self, reads_files, total_bases=None, read_length=None,
+                distinct_per_base=None):
+        prefixes = self._prefixes(total_bases, distinct_per_base)
+        histo, stats = count_kmer_histogram(reads_files, self.k, prefixes, self.workers,
+                                            self.max_bases)
+        positions = stats['positions'][self.k]
+        rate = stats['sampled'][self.k] / float(positions) if positions else 1.0
+        depth_scale = 1.0
+        if total_bases and stats['bases']:
+            depth_scale = max(1.0, total_bases / float(stats['bases']))
+        analysis = analyze_spectrum(histo, self.k, depth_scale, rate)
+        profile = {'kmer_size': self.k,
+                   'total_bases': total_bases,
+                   'sampled_bases': stats['bases'],
+                   'sampled_prefixes': len(prefixes),
+                   'histogram': histo,
+                   'genome_size': None,
+                   'kmer_coverage': None,
+                   'coverage': None,
+                   'repeat_fraction': None,
+                   'heterozygosity': None,
+                   'error_mass': None,
+                   'verdict': 'unknown'}
+        if analysis is None:
+            return profile
+        coverage = analysis['peak_depth']
+        if read_length and read_length > self.k:
+            # a read of length L holds L - k + 1 k-mers
+            coverage *= read_length / float(read_length - self.k + 1)
+        profile.update({'genome_size': analysis['genome_size'],
+                        'kmer_coverage': round(analysis['peak_depth'], 2),
+                        'coverage': round(coverage, 2),
+                        'repeat_fraction': round(analysis['repeat_fraction'], 4),
+                        'heterozygosity': round(analysis['heterozygosity'], 5),
+                        'error_mass': round(analysis['error_mass'], 4)})
+        if coverage < self.MIN_COVERAGE:
+            profile['verdict'] = 'under-sequenced'
+        elif coverage > self.MAX_COVERAGE:
+            profile['verdict'] = 'over-sequenced'
+        else:
+            profile['verdict'] = 'ok'
+        return profile
+
+
+def spectrum_svg(spectra, chosen_k=None, width=720, height=420, max_depth=None):
+    """
+    spectrum_svg: an SVG plot of the k-mer spectra ({k: histogram}), the number of distinct
+    k-mers (log scale) against their depth, the chosen k drawn thicker
+    """
+    max_depth = max_depth or min(max(len(h) for h in spectra.values()) - 1, 200)
+    left, bottom, top, right = 60, 40, 20, 110
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+    max_log = max(math.log10(n + 1) for h in spectra.values() for n in h[1:max_depth + 1]) or 1
+
+    def point(depth, n):
+        return '{:.1f},{:.1f}'.format(left + plot_w * (depth - 1) / float(max(1, max_depth - 1)),
+                                      top + plot_h * (1 - math.log10(n + 1) / max_log))
+
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" '
+             'font-family="sans-serif" font-size="12">'.format(width, height),
+             '<rect width="100%" height="100%" fill="white"/>',
+             '<line x1="{0}" y1="{1}" x2="{2}" y2="{1}" stroke="black"/>'.format(
+                 left, top + plot_h, left + plot_w),
+             '<line x1="{0}" y1="{1}" x2="{0}" y2="{2}" stroke="black"/>'.format(
+                 left, top, top + plot_h),
+             '<text x="{}" y="{}" text-anchor="middle">k-mer depth</text>'.format(
+                 left + plot_w / 2, height - 8),
+             '<text x="14" y="{0}" text-anchor="middle" transform="rotate(-90 14 {0})">'
+             'distinct k-mers (log)</text>'.format(top + plot_h / 2)]
+    for tick in range(0, max_depth + 1, max(1, max_depth // 10)):
+        x = left + plot_w * (max(tick, 1) - 1) / float(max(1, max_depth - 1))
+        parts.append('<text x="{:.1f}" y="{}" text-anchor="middle">{}</text>'.format(
+            x, top + plot_h + 16, max(tick, 1)))
+    for i, k in enumerate(sorted(spectra)):
+        histo = spectra[k]
+        color = PLOT_COLORS[i % len(PLOT_COLORS)]
+        points = ' '.join(point(d, histo[d]) for d in range(1, min(len(histo), max_depth + 1)))
+        parts.append('<polyline fill="none" stroke="{}" stroke-width="{}" points="{}"/>'.format(
+            color, 3 if k == chosen_k else 1, points))
+        parts.append('<text x="{}" y="{}" fill="{}">k={}{}</text>'.format(
+            left + plot_w + 10, top + 16 * (i + 1), color, k,
+            ' (chosen)' if k == chosen_k else ''))
+    parts.append('</svg>')
+    return '\n'.join(parts)
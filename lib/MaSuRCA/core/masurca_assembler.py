@@ -1,10 +1,21 @@
 import os
 import re
+import json
 import time
 import uuid
+import shutil
+import hashlib
+import copy
 
 from installed_clients.AssemblyUtilClient import AssemblyUtil
 from MaSuRCA.core.masurca_utils import masurca_utils
+from MaSuRCA.core.reads_cache import ReadsCache
+from MaSuRCA.core.assemble_stages import prepare_resume
+from MaSuRCA.core.task_graph import TaskGraph
+from MaSuRCA.core.masurca_utils import available_cpus
+from MaSuRCA.core.resource_forecast import forecast_memory, memory_limit_bytes
+from MaSuRCA.core.sweep import (validate_variants, share_groups, link_shared_outputs,
+                                SharedStagesDone)
 
 
 def log(message, prefix_newline=False):
@@ -34,6 +45,10 @@ class MaSuRCA_Assembler(object):
     PARAM_IN_CS_NAME = 'output_contigset_name'
     MaSuRCAR_PROJECT_DIR = 'masurca_project_dir'
     MaSuRCA_final_scaffold_sequences = 'final.genome.scf.fasta'
+    RESUME_DIR_PREFIX = 'masurca_resume_'
+    # parameters that do not change the assembly itself and are left out of the resume key
+    NON_ASSEMBLY_PARAMS = ['workspace_name', 'output_contigset_name', 'create_report',
+                           'packaging_profile', 'resume', 'num_threads', 'plan_only']
 
     def __init__(self, config, provenance):
         """
@@ -44,6 +59,7 @@ class MaSuRCA_Assembler(object):
         self.callback_url = config['SDK_CALLBACK_URL']
         self.token = config['KB_AUTH_TOKEN']
         self.provenance = provenance
+        self.config = config
 
         self.au = AssemblyUtil(self.callback_url)
 
@@ -72,12 +88,18 @@ class MaSuRCA_Assembler(object):
             fa_file_path = os.path.join(fa_file_dir, contig_fa_file)
 
             log("Load assembly from fasta file {}...".format(fa_file_path))
-            self.m_utils.save_assembly(fa_file_path, wsname,
-                                       params[self.PARAM_IN_CS_NAME])
+            # the upload, the stats, QUAST and the packaging run concurrently; only the
+            # report depends on them all
+            graph = TaskGraph()
+            graph.add('upload', lambda r: self.m_utils.save_assembly(
+                fa_file_path, wsname, params[self.PARAM_IN_CS_NAME]))
             if params['create_report'] == 1:
-                report_name, report_ref = self.m_utils.generate_report(
-                                            fa_file_path, params,
-                                            fa_file_dir, wsname)
+                self.m_utils.add_report_tasks(graph, fa_file_path, params, fa_file_dir,
+                                              wsname, deps=['upload'])
+            results = graph.run()
+            log('Finalization tasks (start, seconds):\n' + graph.format_timings())
+            if params['create_report'] == 1:
+                report_name, report_ref = results['report']
                 returnVal = {'report_name': report_name,
                              'report_ref': report_ref}
         else:
@@ -105,6 +127,40 @@ class MaSuRCA_Assembler(object):
         mkdir_p(prjdir)
         return prjdir
 
+    def _resume_key(self, params):
+        """
+        _resume_key: hash of the resolved input object versions, the assembly parameters and
+        the MaSuRCA version, identifying the project directory of a resumable run
+        """
+        key_params = dict((k, v) for k, v in params.items()
+                          if k not in self.NON_ASSEMBLY_PARAMS)
+        obj_infos = self.m_utils._get_object_infos(self.m_utils._input_refs(params))
+        key_params['input_objects'] = [ReadsCache.key_for(info) for info in obj_infos]
+        key_params['masurca_version'] = self.masurca_version
+        return hashlib.sha1(json.dumps(key_params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _use_resume_dir(self, params):
+        """
+        _use_resume_dir: move the run into the stable project directory keyed by the inputs
+        and parameters, and get the checkpoints of a previous attempt ready for resuming
+        """
+        resume_scratch = os.path.join(self.config['scratch'],
+                                      self.RESUME_DIR_PREFIX + self._resume_key(params)[:16])
+        mkdir_p(resume_scratch)
+        # the fresh uuid scratch dir created by __init__ is still empty
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        self.scratch = resume_scratch
+        self.proj_dir = self._create_proj_dir(self.scratch)
+        self.m_utils.set_proj_dir(self.proj_dir)
+
+        completed, first_incomplete = prepare_resume(self.proj_dir)
+        if completed:
+            log('Resuming MaSuRCA run in {}, completed stages: {}; restarting at: {}'.format(
+                self.proj_dir, ', '.join(completed), first_incomplete or 'none'))
+        else:
+            log('No completed stages found, starting a resumable run in {}'.format(
+                self.proj_dir))
+
     def _get_version_from_subactions(self, module_name, subactions):
         """
         _get_version_from_subactions: as the name says
@@ -125,9 +181,147 @@ class MaSuRCA_Assembler(object):
         # again, default to setting this to release
         return 'dev'  # 'release'
 
+    def profile_reads(self, params):
+        """
+        profile_reads: profile the PE reads libraries of params from their k-mer histogram
+        """
+        profile = self.m_utils.profile_reads(params)
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        return profile
+
+    def plan_masurca_assembler(self, params):
+        """
+        plan_masurca_assembler: generate the config.txt and assemble.sh of the run without
+        downloading its inputs, and return them with the resources the run needs
+        """
+        plan = self.m_utils.plan_masurca_assembler(params)
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        return {'report_name': None, 'report_ref': None, 'plan': plan}
+
+    def _run_variant(self, name, v_utils, v_params, assemble_file, handlers, shared_from):
+        """
+        _run_variant: run the assemble.sh of a variant of a sweep, after linking in the
+        outputs of the shared stages of the variant named shared_from, and save its assembly.
+        Returns the record of the variant; a failed variant is recorded, not raised.
+        """
+        record = {'name': name, 'shared_from': None}
+        try:
+            if shared_from:
+                linked = link_shared_outputs(os.path.join(self.proj_dir, shared_from),
+                                             v_utils.proj_dir)
+                if linked:
+                    log('Variant {} reuses {} of variant {}'.format(
+                        name, ', '.join(linked), shared_from))
+                    record['shared_from'] = shared_from
+            record['exit_code'] = v_utils.run_assemble(assemble_file, handlers)
+            record['resources'] = v_utils.assemble_resources
+            fa_file_dir = self._find_file_path(v_utils.proj_dir,
+                                               self.MaSuRCA_final_scaffold_sequences)
+            if record['exit_code'] != 0 or not fa_file_dir:
+                raise ValueError('masurca assemble process failed')
+            record['path'] = os.path.join(fa_file_dir, self.MaSuRCA_final_scaffold_sequences)
+            record['stats'] = v_utils._load_stats(record['path']).summary()
+            record['assembly_ref'] = v_utils.save_assembly(
+                record['path'], v_params['workspace_name'], v_params[self.PARAM_IN_CS_NAME])
+        except Exception as e:
+            log('Variant {} failed: {}'.format(name, e))
+            record['error'] = str(e)
+        finally:
+            # release the variants waiting on this one however its run ended
+            for handler in handlers:
+                handler.on_exit(record.get('exit_code', None), {})
+        return record
+
+    def run_masurca_sweep(self, params):
+        """
+        run_masurca_sweep: stage the reads once, then assemble them with each variant of the
+        parameters, as many variants at a time as the core and memory budget allows, and
+        compare the assemblies in a single report
+        """
+        variants = validate_variants(params.get('variants', None))
+        assembly_params = copy.deepcopy(params.get('assembly_params', None) or {})
+        threads_given = assembly_params.get('num_threads', None)
+        validated_params = self.m_utils.validate_params(assembly_params)
+        budget = {'cores': params.get('max_cores', None) or available_cpus(),
+                  'memory': params.get('max_memory_bytes', None) or memory_limit_bytes()}
+        if not budget['memory']:
+            del budget['memory']
+        if not threads_given:
+            validated_params['num_threads'] = max(1, budget['cores'] // len(variants))
+
+        # 1. stage the reads once for all the variants
+        pe_reads_data, jp_reads_data = self.m_utils.prepare_inputs(validated_params)
+        total_bases, long_bases = self.m_utils._input_sizes(validated_params)
+
+        # 2. render the config.txt and assemble.sh of each variant in a project dir of its own
+        v_params = dict()
+        runs = dict()
+        for name, overrides in variants:
+            v_dir = os.path.join(self.proj_dir, name)
+            mkdir_p(v_dir)
+            v_utils = self.m_utils.for_project(v_dir)
+            p = copy.deepcopy(validated_params)
+            p.update(overrides)
+            p[self.PARAM_IN_CS_NAME] = '{}.{}'.format(validated_params[self.PARAM_IN_CS_NAME],
+                                                      name)
+            # the overrides, e.g. soap_assembly, may change the memory the variant needs
+            v_utils._fit_memory(p)
+            config_file = v_utils._write_config(p, pe_reads_data, jp_reads_data)
+            if not config_file:
+                raise ValueError('Failed to create the config.txt file of variant ' + name)
+            memory = forecast_memory(p['jf_size'], p['num_threads'], total_bases, long_bases,
+                                     p.get('soap_assembly', None) == 1)['peak']
+            v_params[name] = p
+            runs[name] = (v_utils, v_utils.generate_assemble_script(config_file),
+                          {'cores': p['num_threads'], 'memory': memory})
+
+        # 3. run the variants within the budget; in each group of variants with the same
+        # error correction settings, the others reuse the jellyfish database and corrected
+        # reads of the first one as soon as it is past them
+        graph = TaskGraph()
+        for group in share_groups(v_params):
+            leader = group[0]
+            handlers = []
+            if len(group) > 1:
+                done = SharedStagesDone(runs[leader][0].proj_dir)
+                handlers.append(done)
+                graph.add('shared:' + leader, lambda r, done=done, leader=leader:
+                          leader if done.wait() else None)
+            graph.add('variant:' + leader,
+                      lambda r, name=leader, handlers=handlers: self._run_variant(
+                          name, runs[name][0], v_params[name], runs[name][1], handlers, None),
+                      resources=runs[leader][2])
+            for name in group[1:]:
+                graph.add('variant:' + name,
+                          lambda r, name=name, leader=leader: self._run_variant(
+                              name, runs[name][0], v_params[name], runs[name][1], [],
+                              r['shared:' + leader]),
+                          deps=['shared:' + leader], resources=runs[name][2])
+        log('Running {} variant(s) within {} cores and {}'.format(
+            len(variants), budget['cores'], '{:.1f} GB'.format(budget['memory'] / float(1024 ** 3))
+            if 'memory' in budget else 'no memory limit'))
+        results = graph.run(budget=budget)
+        log('Variant runs (start, seconds):\n' + graph.format_timings())
+        records = [results['variant:' + name] for name, _ in variants]
+        for record, (name, overrides) in zip(records, variants):
+            record['overrides'] = overrides
+
+        # 4. compare the variants in a single report
+        returnVal = {'report_name': None, 'report_ref': None,
+                     'variants': [dict((k, v) for k, v in r.items() if k != 'path')
+                                  for r in records]}
+        if validated_params['create_report'] == 1:
+            returnVal['report_name'], returnVal['report_ref'] = \
+                self.m_utils.save_sweep_report(records, validated_params)
+        return returnVal
+
     def run_masurca_assembler(self, params):
         # 1. validate & process the input parameters
         validated_params = self.m_utils.validate_params(params)
+        if validated_params.get('plan_only', None):
+            return self.plan_masurca_assembler(validated_params)
+        if validated_params.get('resume', None):
+            self._use_resume_dir(validated_params)
 
         # 2. create the configuration file
         config_file = self.m_utils.construct_masurca_assembler_cfg(validated_params)
@@ -3,14 +3,36 @@ import re
 import time
 import os
 import errno
-import zipfile
+import fnmatch
 import codecs
 import uuid
 import copy
+import json
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from pprint import pprint
 
 from MaSuRCA.core.Program_Runner import Program_Runner
+from MaSuRCA.core.assemble_stages import StageTracker
+from MaSuRCA.core.progress_log import ProgressLog, PROGRESS_LOG_FILE, PROGRESS_SNAPSHOT_FILE
+from MaSuRCA.core.watchdog import Watchdog, parse_stage_timeouts
+from MaSuRCA.core.reads_cache import ReadsCache
+from MaSuRCA.core.fasta_stats import FastaScanner
+from MaSuRCA.core.read_stats import ReadStatsEstimator, estimate_jf_size
+from MaSuRCA.core.kmer_spectrum import (KmerSpectrumTuner, ReadsProfiler, kmer_score,
+                                        spectrum_svg)
+from MaSuRCA.core.read_reduction import (ReadReducer, REDUCTION_MODES,
+                                         NORMALIZE_BASES_PER_SECOND)
+from MaSuRCA.core.reads_compression import ReadsFormatNormalizer
+from MaSuRCA.core.resource_forecast import (forecast_scratch, format_forecast, free_bytes,
+                                            scratch_suggestions, GZIP_FASTQ_BYTES_PER_BASE,
+                                            fit_memory, memory_limit_bytes, forecast_memory,
+                                            forecast_cpu, available_cpus,
+                                            PARALLEL_EFFICIENCY)
+from MaSuRCA.core.zip_packager import ZipPackager
+from MaSuRCA.core.task_graph import TaskGraph
+from MaSuRCA.core.sweep import format_comparison
+from MaSuRCA.core.service_clients import build_client, DEFAULT_POOL_MAXSIZE
 from installed_clients.WorkspaceClient import Workspace
 from installed_clients.KBaseReportClient import KBaseReport
 from installed_clients.AssemblyUtilClient import AssemblyUtil
@@ -54,6 +76,62 @@ class masurca_utils:
 
     INVALID_WS_OBJ_NAME_RE = re.compile('[^\\w\\|._-]')
 
+    ASSEMBLY_TYPES = ['KBaseFile.Assembly',
+                      'KBaseGenomeAnnotations.Assembly',
+                      'KBaseGenomes.ContigSet']
+    READS_TYPES = ['KBaseAssembly.SingleEndLibrary',
+                   'KBaseFile.SingleEndLibrary',
+                   'KBaseAssembly.PairedEndLibrary',
+                   'KBaseFile.PairedEndLibrary']
+    # the fields of the reads and assembly objects sizing the inputs, see _get_inputs_metadata
+    INPUT_SIZE_PATHS = ['/lib1/size', '/lib2/size', '/lib/size', '/total_bases', '/dna_size']
+    DEFAULT_STAGING_WORKERS = 4
+    DEFAULT_READS_CACHE_BYTES = 100 * 1024 ** 3
+    DEFAULT_ZIP_COMPRESSION_LEVEL = 6
+    DEFAULT_RESOURCE_SAMPLE_INTERVAL = 10
+    DEFAULT_SCRATCH_RESERVE_BYTES = 20 * 1024 ** 3
+    DEFAULT_ASSEMBLE_TIMEOUT = 0
+    DEFAULT_STALL_TIMEOUT = 3600
+    # normalizing goes at some 3 Mb/s, so this is about an hour and a half of it
+    DEFAULT_NORMALIZE_MAX_BASES = 15000000000
+    # bases of the PE reads sampled by the k-mer pre-pass, which hashes some 10 Mb/s per
+    # candidate k and worker; the depths of its spectra are scaled to all the reads
+    DEFAULT_KMER_PREPASS_MAX_BASES = 50000000
+    # bases of the PE reads the reads profile is counted from, its depth scaled likewise
+    DEFAULT_READS_PROFILE_MAX_BASES = 200000000
+    # genomes smaller than this get the bacteria settings when dna_source is not given
+    BACTERIA_MAX_GENOME_SIZE = 15000000
+
+    # glob rules, relative to the project dir, selecting the files packaged for the report
+    PACKAGING_PROFILES = {
+        # final scaffolds, the configuration, logs and the QUAST output
+        'minimal': {
+            'include': ['config.txt', 'assemble.sh', '*.log', '*.err',
+                        '*final.genome.scf.fasta', 'resource_*', 'stage_timings.json',
+                        PROGRESS_LOG_FILE, 'kmer_spectrum/*', 'reads_profile.json',
+                        'quast/*'],
+            'exclude': []
+        },
+        # plus the final CA/gap closing sequences and small summary files
+        'standard': {
+            'include': ['config.txt', 'assemble.sh', '*.log', '*.err', '*.txt',
+                        '*final.genome.*', 'resource_*', 'stage_timings.json',
+                        PROGRESS_LOG_FILE, 'kmer_spectrum/*', 'reads_profile.json',
+                        'quast/*',
+                        'CA/*.fasta', 'CA/*.qc',
+                        'CA/9-terminator/*.fasta', 'CA/9-terminator/*.qc',
+                        'CA/9-terminator/*.posmap.*', 'CA/10-gapclose/*.fasta'],
+            'exclude': ['reads/*', 'reduced_reads/*', '*Store*', '*.jf', 'k_u_hash*', '*.tmp']
+        },
+        # everything the run produced, intermediates included
+        'full': {
+            'include': ['*'],
+            'exclude': ['reads/*', 'reduced_reads/*', '*masurca_output.zip',
+                        '*quast_output.zip']
+        }
+    }
+    DEFAULT_PACKAGING_PROFILE = 'standard'
+
     def __init__(self, prj_dir, config):
         self.workspace_url = config['workspace-url']
         self.callback_url = config['SDK_CALLBACK_URL']
@@ -63,13 +141,99 @@ class masurca_utils:
         if 'handle-service-url' in config:
             self.handle_url = config['handle-service-url']
 
-        self.ws_client = Workspace(self.workspace_url, token=self.token)
-        self.ru = ReadsUtils(self.callback_url, token=self.token)
-        self.au = AssemblyUtil(self.callback_url, token=self.token)
-        self.kbr = KBaseReport(self.callback_url)
-        self.kbq = kb_quast(self.callback_url)
+        # the service clients keep up to client_pool_maxsize connections alive per host,
+        # client_keep_alive 0 closes them after every call
+        client_options = {
+            'pool_maxsize': int(config.get('client_pool_maxsize', DEFAULT_POOL_MAXSIZE)),
+            'keep_alive': str(config.get('client_keep_alive', '1')).strip() != '0'}
+        self.ws_client = build_client(Workspace, self.workspace_url, self.token,
+                                      **client_options)
+        self.ru = build_client(ReadsUtils, self.callback_url, self.token, **client_options)
+        self.au = build_client(AssemblyUtil, self.callback_url, self.token, **client_options)
+        self.kbr = build_client(KBaseReport, self.callback_url, **client_options)
+        self.kbq = build_client(kb_quast, self.callback_url, **client_options)
+        self.proj_dir = prj_dir
+        self.prog_runner = Program_Runner(
+            self.MaSuRCA_BIN, self.proj_dir,
+            sample_interval=float(config.get('resource_sample_interval',
+                                             self.DEFAULT_RESOURCE_SAMPLE_INTERVAL)))
+        self.assemble_resources = None
+        self.stage_tracker = None
+        # the progress of the running assemble.sh, readable by the status method
+        self.reads_estimate = None
+
+        # bounded worker pool size for staging the reads inputs concurrently
+        self.staging_workers = int(config.get('reads_staging_workers',
+                                              self.DEFAULT_STAGING_WORKERS))
+        # staged inputs, keyed by the full workspace ref, plus the per-library staging time
+        self.staged_reads = dict()
+        self.staged_fasta = dict()
+        self.staging_times = dict()
+        self.object_infos = dict()
+        self.inputs_metadata = dict()
+
+        # persistent reads cache shared by the runs using the same scratch space
+        self.reads_cache = ReadsCache(
+            config.get('reads_cache_dir', os.path.join(config['scratch'], 'reads_cache')),
+            config.get('reads_cache_max_bytes', self.DEFAULT_READS_CACHE_BYTES))
+
+        # compression level (0 for store-only) and process count for packaging the outputs
+        self.zip_compression_level = int(config.get('zip_compression_level',
+                                                    self.DEFAULT_ZIP_COMPRESSION_LEVEL))
+        self.zip_workers = int(config.get('zip_workers', 0)) or None
+
+        # scratch space to keep free when choosing between plain and compressed reads
+        self.scratch_reserve_bytes = int(config.get('scratch_reserve_bytes',
+                                                    self.DEFAULT_SCRATCH_RESERVE_BYTES))
+
+        # wall-clock limits (seconds, 0 for none) of assemble.sh as a whole and per stage
+        # ('stage:seconds,...'), and the time without any progress after which it is killed
+        self.assemble_timeout = float(config.get('assemble_timeout',
+                                                 self.DEFAULT_ASSEMBLE_TIMEOUT))
+        self.stage_timeouts = parse_stage_timeouts(config.get('stage_timeouts', ''))
+        self.stall_timeout = float(config.get('stall_timeout', self.DEFAULT_STALL_TIMEOUT))
+
+        # bases of the PE reads read to choose GRAPH_KMER_SIZE when it is not given and to
+        # profile the reads from their k-mer histogram, all of them when empty; 0 to leave
+        # GRAPH_KMER_SIZE to MaSuRCA and to skip the profiling
+        self.kmer_prepass_bases = self._max_bases(config.get(
+            'kmer_prepass_max_bases', self.DEFAULT_KMER_PREPASS_MAX_BASES))
+        self.kmer_tuning = None
+        self.profile_bases = self._max_bases(config.get(
+            'reads_profile_max_bases', self.DEFAULT_READS_PROFILE_MAX_BASES))
+        self.reads_profile = None
+        # PE bases above which reduce_reads 'normalize' subsamples instead
+        self.normalize_max_bases = int(config.get('normalize_max_bases',
+                                                  self.DEFAULT_NORMALIZE_MAX_BASES))
+
+    @staticmethod
+    def _max_bases(value):
+        """
+        _max_bases: the bases limit of a config value, None (all the bases) when empty
+        """
+        value = str(value).strip()
+        return int(value) if value else None
+
+    def for_project(self, prj_dir):
+        """
+        for_project: a copy of these utils working in another project dir, sharing the staged
+        inputs and their estimates but with a runner and run state of its own, e.g. for the
+        variants of a sweep running side by side
+        """
+        other = copy.copy(self)
+        other.proj_dir = prj_dir
+        other.prog_runner = Program_Runner(self.MaSuRCA_BIN, prj_dir,
+                                           sample_interval=self.prog_runner.sample_interval)
+        other.assemble_resources = None
+        other.stage_tracker = None
+        return other
+
+    def set_proj_dir(self, prj_dir):
+        """
+        set_proj_dir: switch to another project directory, e.g. the stable one of a resumed run
+        """
         self.proj_dir = prj_dir
-        self.prog_runner = Program_Runner(self.MaSuRCA_BIN, self.proj_dir)
+        self.prog_runner.work_dir = prj_dir
 
     def _has_long_reads(self, params):
         """
@@ -172,10 +336,10 @@ class masurca_utils:
             if param_str != '':
                 param_str += '\n'
             param_str += 'NUM_THREADS = ' + str(params[self.PARAM_IN_THREADN])
-        if params.get('jf_size', None):
+        if params.get(self.PARAM_IN_JF_SIZE, None):
             if param_str != '':
                 param_str += '\n'
-            param_str += 'JF_SIZE=' + str(params['jf_size'])
+            param_str += 'JF_SIZE=' + str(params[self.PARAM_IN_JF_SIZE])
         if params.get('kmer_count_threshold', None):
             if param_str != '':
                 param_str += '\n'
@@ -346,37 +510,193 @@ class masurca_utils:
             self._unique_prefix_check('jp_prefix', jp_reads_libs)
         return rds_data
 
-    def _get_kbreads_info(self, wsname, reads_refs):
+    def _full_ref(self, wsname, ref):
         """
-        _get_kbreads_info--from a set of given KBase reads refs, fetches the corresponding
-         reads info with as deinterleaved fastq files and returns a list of reads data in
-         the following structure:
-        reads_data = {
-                'fwd_file': path_to_fastq_file,
-                'type': reads_type, #('interleaved', 'paired', or 'single'
-                'seq_tech': sequencing_tech,
-                'reads_ref': KBase object ref for downstream convenience,
-                'reads_name': KBase object name for downstream convenience,
-                'rev_file': path_to_fastq_file, #only if paired end
-        }
+        _full_ref: qualify a bare object name/id with the workspace name
         """
-        obj_ids = []
-        for r in reads_refs:
-            if r:
-                obj_ids.append({'ref': r if '/' in r else (wsname + '/' + r)})
+        return ref if '/' in ref else (wsname + '/' + ref)
 
-        if not obj_ids:
-            return []
+    def _get_object_infos(self, refs):
+        """
+        _get_object_infos: resolve the workspace object_info of the given full refs with a
+        single get_object_info3 call for those not resolved yet
+        """
+        unresolved = []
+        for r in refs:
+            if r not in self.object_infos and r not in unresolved:
+                unresolved.append(r)
+        if unresolved:
+            ws_info = self.ws_client.get_object_info3(
+                {'objects': [{'ref': r} for r in unresolved]}).get('infos', [])
+            for wsi, ref in zip(ws_info, unresolved):
+                if not wsi:
+                    raise RuntimeError("An error occurred while fetching type info from the "
+                                       "Workspace. No information returned for reference "
+                                       "{}".format(ref))
+                self.object_infos[ref] = wsi
+        return [self.object_infos[r] for r in refs]
+
+    def resolve_input_refs(self, params):
+        """
+        resolve_input_refs: resolve the type, name and version of every input object of the
+        run in one batch; the later lookups are served from the memo
+        """
+        refs = self._input_refs(params)
+        if refs:
+            log('Resolving the workspace info of {} input object(s)'.format(len(refs)))
+            self._get_object_infos(refs)
 
-        ws_info = self.ws_client.get_object_info_new({'objects': obj_ids})
-        reads_params = []
+    def _get_inputs_metadata(self, refs):
+        """
+        _get_inputs_metadata: the file bytes and bases of the given full refs of reads or
+        assembly objects, from a single get_objects2 call fetching only their size fields for
+        those not fetched yet; values missing from the objects (e.g. the bases of the
+        KBaseAssembly types) are None
+        """
+        unresolved = []
+        for r in refs:
+            if r not in self.inputs_metadata and r not in unresolved:
+                unresolved.append(r)
+        if unresolved:
+            objs = self.ws_client.get_objects2(
+                {'objects': [{'ref': r, 'included': self.INPUT_SIZE_PATHS}
+                             for r in unresolved]})['data']
+            for obj, ref in zip(objs, unresolved):
+                data = obj.get('data', None) or {}
+                sizes = [data[lib]['size'] for lib in ('lib1', 'lib2', 'lib')
+                         if (data.get(lib, None) or {}).get('size', None)]
+                self.inputs_metadata[ref] = {
+                    'file_bytes': sum(sizes) if sizes else data.get('dna_size', None),
+                    'bases': data.get('total_bases', None) or data.get('dna_size', None)}
+        return [self.inputs_metadata[r] for r in refs]
+
+    def _input_bases(self, meta):
+        """
+        _input_bases: the bases of an input from its metadata, guessed from the size of its
+        (gzipped) files when the object does not record them
+        """
+        if meta['bases']:
+            return meta['bases']
+        return int((meta['file_bytes'] or 0) / GZIP_FASTQ_BYTES_PER_BASE)
 
-        reftoname = {}
-        for wsi, oid in zip(ws_info, obj_ids):
-            ref = oid['ref']
-            reads_params.append(ref)
-            obj_name = wsi[1]
-            reftoname[ref] = wsi[7] + '/' + obj_name
+    def _input_sizes(self, params):
+        """
+        _input_sizes: (total_bases, long_reads_bases) of the inputs of the run, the former
+        from the reads estimate once the reads are staged
+        """
+        wsname = params[self.PARAM_IN_WS]
+        long_refs = [self._full_ref(wsname, params[p]) for p in ('pacbio_reads', 'nanopore_reads')
+                     if params.get(p, None)]
+        if self.reads_estimate:
+            total_bases = self.reads_estimate['total_bases']
+        else:
+            total_bases = sum(self._input_bases(meta) for meta in self._get_inputs_metadata(
+                [r for r in self._input_refs(params) if r not in long_refs]))
+        long_bases = sum(self._input_bases(meta)
+                         for meta in self._get_inputs_metadata(long_refs))
+        return total_bases, long_bases
+
+    def _fit_memory(self, params):
+        """
+        _fit_memory: forecast the peak memory of the run and lower the jf_size and num_threads
+        of params when the forecast exceeds the memory limit of the container or node.
+        Returns the (jf_size, num_threads) the run goes with.
+        """
+        jf_size = params.get(self.PARAM_IN_JF_SIZE, None)
+        num_threads = params.get(self.PARAM_IN_THREADN, None)
+        limit = memory_limit_bytes()
+        if not jf_size or not num_threads or not limit:
+            return jf_size, num_threads
+
+        total_bases, long_bases = self._input_sizes(params)
+        fit_jf_size, fit_threads, forecast = fit_memory(
+            jf_size, num_threads, limit, total_bases, long_bases,
+            params.get('soap_assembly', None) == 1)
+        log('Memory forecast {:.1f} GB (jellyfish {:.1f} GB, assembly {:.1f} GB, mega-reads '
+            '{:.1f} GB), {:.1f} GB available'.format(
+                forecast['peak'] / float(1024 ** 3), forecast['jellyfish'] / float(1024 ** 3),
+                forecast['assembly'] / float(1024 ** 3),
+                forecast['mega_reads'] / float(1024 ** 3), limit / float(1024 ** 3)))
+        if (fit_jf_size, fit_threads) != (jf_size, num_threads):
+            log('Lowered JF_SIZE from {} to {} and NUM_THREADS from {} to {} to fit in '
+                'memory'.format(jf_size, fit_jf_size, num_threads, fit_threads))
+        if forecast['peak'] > limit:
+            log('WARNING: the run may still run out of memory, consider soap_assembly=1 or '
+                'reduce_reads')
+        params[self.PARAM_IN_JF_SIZE] = fit_jf_size
+        params[self.PARAM_IN_THREADN] = fit_threads
+        return fit_jf_size, fit_threads
+
+    def check_scratch_space(self, params, staged=False):
+        """
+        check_scratch_space: forecast the peak scratch usage of the run and fail fast when
+        the scratch file system cannot hold it. Before staging, the inputs are sized from the
+        workspace metadata and the reads not in the reads cache count as still to be written;
+        once staged, the reads estimate is used when there is one.
+        Returns the forecast dict.
+        """
+        wsname = params[self.PARAM_IN_WS]
+        long_refs = [self._full_ref(wsname, params[p]) for p in ('pacbio_reads', 'nanopore_reads')
+                     if params.get(p, None)]
+        short_refs = [r for r in self._input_refs(params) if r not in long_refs]
+        metadata = dict(zip(short_refs + long_refs,
+                            self._get_inputs_metadata(short_refs + long_refs)))
+
+        def bases_of(ref):
+            return self._input_bases(metadata[ref])
+
+        reads_bytes = 0
+        if not staged:
+            for ref in short_refs + long_refs:
+                if ref in self.object_infos and self.reads_cache.contains(
+                        ReadsCache.key_for(self.object_infos[ref])):
+                    continue
+                reads_bytes += metadata[ref]['file_bytes'] or 0
+        genome_size = None
+        if staged and self.reads_estimate:
+            total_bases = self.reads_estimate['total_bases']
+            genome_size = self.reads_estimate['genome_size']
+        else:
+            total_bases = sum(bases_of(r) for r in short_refs)
+        if not total_bases:
+            log('The size of the inputs is unknown, skipping the scratch space check')
+            return None
+        jf_size = params.get(self.PARAM_IN_JF_SIZE, None) or estimate_jf_size(
+            {'total_bases': total_bases, 'genome_size': genome_size})[0]
+        long_bases = sum(bases_of(r) for r in long_refs)
+        soap = params.get('soap_assembly', None) == 1
+
+        forecast = forecast_scratch(total_bases, jf_size, reads_bytes, long_bases, soap)
+        available = free_bytes(self.proj_dir)
+        log('Scratch forecast {:.1f} GB ({}), {:.1f} GB available'.format(
+            forecast['total'] / float(1024 ** 3), format_forecast(forecast),
+            available / float(1024 ** 3)))
+        if forecast['total'] > available:
+            suggestions = scratch_suggestions(total_bases, jf_size, available, reads_bytes,
+                                              long_bases, soap, genome_size)
+            raise ValueError(
+                'Not enough scratch space for this assembly: about {:.1f} GB are needed ({}) '
+                'but only {:.1f} GB are available. {}'.format(
+                    forecast['total'] / float(1024 ** 3), format_forecast(forecast),
+                    available / float(1024 ** 3),
+                    ('Settings that would fit: ' + '; '.join(suggestions) + '.')
+                    if suggestions else 'Use a node with more scratch space.'))
+        return forecast
+
+    def _download_reads_lib(self, ref):
+        """
+        _download_reads_lib: fetch a single reads library as deinterleaved fastq files, from
+        the reads cache when the same object version was downloaded before, and return the
+        ReadsUtils record for it
+        """
+        cache_key = None
+        if ref in self.object_infos:
+            cache_key = ReadsCache.key_for(self.object_infos[ref])
+            cached = self.reads_cache.get(cache_key,
+                                          os.path.join(self.proj_dir, 'reads', cache_key))
+            if cached is not None:
+                log('Reads object {} served from the reads cache'.format(ref))
+                return cached
 
         typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
                    'KBaseFile.PairedEndLibrary ' +
@@ -384,7 +704,7 @@ class masurca_utils:
                    'KBaseAssembly.PairedEndLibrary')
         try:
             reads = self.ru.download_reads({
-                        'read_libraries': reads_params,
+                        'read_libraries': [ref],
                         'interleaved': 'false'
                         })['files']
         except ServerError as se:
@@ -400,19 +720,141 @@ class masurca_utils:
                     'and KBaseFile.PairedEndLibrary are supported')
             else:
                 raise
+        if cache_key is not None:
+            self.reads_cache.put(cache_key, reads[ref])
+        return reads[ref]
+
+    def _stage_one(self, task):
+        """
+        _stage_one: worker body of the staging pool; task is a (kind, ref) tuple with kind
+        being either 'reads' or 'assembly'. Returns (kind, ref, staged_data, seconds).
+        """
+        kind, ref = task
+        start = time.time()
+        if kind == 'assembly':
+            staged = self._get_fasta_from_assembly(ref)
+        else:
+            staged = self._download_reads_lib(ref)
+        elapsed = time.time() - start
+        log('Staged {} input {} in {:.2f} seconds'.format(kind, ref, elapsed))
+        return kind, ref, staged, elapsed
+
+    def _run_staging_tasks(self, tasks):
+        """
+        _run_staging_tasks: fan the given (kind, ref) staging tasks out over a bounded pool of
+        worker threads and memoize the results in self.staged_reads/self.staged_fasta
+        """
+        tasks = [t for t in tasks if t[1] not in self.staged_reads and
+                 t[1] not in self.staged_fasta]
+        if not tasks:
+            return
+        # resolve the object versions up front so that the workers can consult the cache
+        self._get_object_infos([t[1] for t in tasks if t[0] == 'reads'])
+
+        n_workers = max(1, min(self.staging_workers, len(tasks)))
+        log('Staging {} input(s) with {} worker(s)'.format(len(tasks), n_workers))
+        start = time.time()
+        pool = ThreadPool(n_workers)
+        try:
+            # map keeps the results in task order and re-raises the first worker error
+            results = pool.map(self._stage_one, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        for kind, ref, staged, elapsed in results:
+            if kind == 'assembly':
+                self.staged_fasta[ref] = staged
+            else:
+                self.staged_reads[ref] = staged
+            self.staging_times[ref] = elapsed
+        log('Staged {} input(s) in {:.2f} seconds'.format(len(tasks), time.time() - start))
+
+    def _input_refs(self, params):
+        """
+        _input_refs: the full workspace refs of all PE, JUMP, PacBio and Nanopore inputs
+        """
+        wsname = params[self.PARAM_IN_WS]
+        refs = []
+        for pe_lib in params.get(self.PARAM_IN_READS_LIBS, None) or []:
+            if pe_lib.get('pe_id', None):
+                refs.append(self._full_ref(wsname, pe_lib['pe_id']))
+        for jp_lib in params.get(self.PARAM_IN_JUMP_LIBS, None) or []:
+            if jp_lib.get('jp_id', None):
+                refs.append(self._full_ref(wsname, jp_lib['jp_id']))
+        for lr_param in ['pacbio_reads', 'nanopore_reads']:
+            if params.get(lr_param, None):
+                refs.append(self._full_ref(wsname, params[lr_param]))
+        return refs
+
+    def _stage_inputs(self, params):
+        """
+        _stage_inputs: download every PE, JUMP, PacBio and Nanopore input of the run
+        concurrently, so that the later per-section lookups are served from memory
+        """
+        wsname = params[self.PARAM_IN_WS]
+        tasks = []
+        for pe_lib in params.get(self.PARAM_IN_READS_LIBS, None) or []:
+            if pe_lib.get('pe_id', None):
+                tasks.append(('reads', self._full_ref(wsname, pe_lib['pe_id'])))
+        for jp_lib in params.get(self.PARAM_IN_JUMP_LIBS, None) or []:
+            if jp_lib.get('jp_id', None):
+                tasks.append(('reads', self._full_ref(wsname, jp_lib['jp_id'])))
+        for lr_param in ['pacbio_reads', 'nanopore_reads']:
+            lr_ref = params.get(lr_param, None)
+            if lr_ref:
+                full_ref = self._full_ref(wsname, lr_ref)
+                if self._check_ref_type(full_ref, self.ASSEMBLY_TYPES):
+                    tasks.append(('assembly', lr_ref))
+                elif self._check_ref_type(full_ref, self.READS_TYPES):
+                    tasks.append(('reads', full_ref))
+        self._run_staging_tasks(tasks)
+
+    def _get_kbreads_info(self, wsname, reads_refs):
+        """
+        _get_kbreads_info--from a set of given KBase reads refs, fetches the corresponding
+         reads info with as deinterleaved fastq files and returns a list of reads data in
+         the following structure:
+        reads_data = {
+                'fwd_file': path_to_fastq_file,
+                'type': reads_type, #('interleaved', 'paired', or 'single'
+                'seq_tech': sequencing_tech,
+                'reads_ref': KBase object ref for downstream convenience,
+                'reads_name': KBase object name for downstream convenience,
+                'rev_file': path_to_fastq_file, #only if paired end
+                'stage_seconds': time taken to stage the reads library,
+        }
+        Libraries not yet staged by _stage_inputs are downloaded concurrently here.
+        """
+        reads_refs = [r for r in reads_refs if r]
+        obj_ids = [{'ref': self._full_ref(wsname, r)} for r in reads_refs]
+
+        if not obj_ids:
+            return []
+
+        ws_info = self._get_object_infos([oid['ref'] for oid in obj_ids])
+
+        reftoname = {}
+        for wsi, oid in zip(ws_info, obj_ids):
+            obj_name = wsi[1]
+            reftoname[oid['ref']] = wsi[7] + '/' + obj_name
+
+        self._run_staging_tasks([('reads', oid['ref']) for oid in obj_ids])
 
         # log('Downloaded reads data from KBase:\n' + pformat(reads))
         reads_data = []
-        for ref in reads_refs:
-            reads_name = reftoname[ref]
-            f = reads[ref]['files']
-            seq_tech = reads[ref]['sequencing_tech']
+        for ref, oid in zip(reads_refs, obj_ids):
+            full_ref = oid['ref']
+            reads_name = reftoname[full_ref]
+            f = self.staged_reads[full_ref]['files']
+            seq_tech = self.staged_reads[full_ref]['sequencing_tech']
             rds_info = {
                 'fwd_file': f['fwd'],
                 'reads_ref': ref,
                 'type': f['type'],
                 'seq_tech': seq_tech,
-                'reads_name': reads_name
+                'reads_name': reads_name,
+                'stage_seconds': self.staging_times.get(full_ref, 0)
             }
             if f.get('rev', None) is not None:
                 rds_info['rev_file'] = f['rev']
@@ -420,18 +862,255 @@ class masurca_utils:
 
         return reads_data
 
-    def _generate_output_file_list(self, out_dir):
+    def _estimate_reads(self, reads_data):
         """
-        _generate_output_file_list: zip result files and generate file_links for report
+        _estimate_reads: estimate the total bases, read lengths and genome size of the staged
+        reads files
         """
-        log('start packing result files')
+        reads_files = []
+        for rds in reads_data:
+            reads_files.append(rds['fwd_file'])
+            if rds.get('rev_file', None):
+                reads_files.append(rds['rev_file'])
+        self.reads_estimate = ReadStatsEstimator().estimate(reads_files)
+        return self.reads_estimate
+
+    def _reduce_reads(self, params, pe_reads_data, jp_reads_data):
+        """
+        _reduce_reads: subsample or digitally normalize the paired-end libraries into
+        proj_dir/reduced_reads, pointing their reads data at the reduced files. The jump
+        libraries are left as they are, their coverage being set by limit_jump_coverage.
+        """
+        mode = params.get('reduce_reads', 'none')
+        if mode == 'none' or not pe_reads_data:
+            return
+        if self.reads_estimate is None:
+            self._estimate_reads(pe_reads_data + jp_reads_data)
+        pe_bases = self.reads_estimate['total_bases']
+        if jp_reads_data:
+            pe_bases = ReadStatsEstimator(sketch_bases=0).estimate(
+                [f for rds in pe_reads_data
+                 for f in (rds['fwd_file'], rds.get('rev_file', None)) if f])['total_bases']
+        if mode == 'normalize' and pe_bases > self.normalize_max_bases:
+            log('Normalizing {} bases of PE reads would take about {:.1f} hours, subsampling '
+                'them instead'.format(pe_bases, pe_bases / NORMALIZE_BASES_PER_SECOND / 3600))
+            mode = 'subsample'
+            params = dict(params, target_coverage=None)
+        if mode == 'subsample' and not self.reads_estimate['genome_size']:
+            log('The genome size could not be estimated from the reads, not subsampling')
+            return
+
+        reduced_dir = os.path.join(self.proj_dir, 'reduced_reads')
+        bases_in = bases_kept = 0
+        # a single reducer over all the libraries, so normalization sees their joint coverage
+        reducer = ReadReducer(mode, params.get('target_coverage', None),
+                              self.reads_estimate['genome_size'], pe_bases)
+        for rds in pe_reads_data:
+            lib_dir = os.path.join(reduced_dir, rds['pe_prefix'])
+            mkdir_p(lib_dir)
+            start = time.time()
+            result = reducer.reduce(rds['fwd_file'], lib_dir, rds.get('rev_file', None),
+                                    rds.get('type', None) == 'interleaved')
+            log('Reduced reads library {} ({}) from {} to {} reads in {:.1f} s'.format(
+                rds['reads_name'], mode, result['reads_in'], result['reads_kept'],
+                time.time() - start))
+            rds['fwd_file'] = result['fwd']
+            if result.get('rev', None):
+                rds['rev_file'] = result['rev']
+            bases_in += result['bases_in']
+            bases_kept += result['bases_kept']
+            self.reads_estimate['total_reads'] -= result['reads_in'] - result['reads_kept']
+        self.reads_estimate['total_bases'] -= bases_in - bases_kept
+        self.reads_estimate['reduction'] = {'mode': mode, 'bases_in': bases_in,
+                                            'bases_kept': bases_kept}
+
+    def _normalize_reads_format(self, reads_data, needed_bytes=0):
+        """
+        _normalize_reads_format: decompress the gzipped reads files, or compress the plain
+        ones when scratch space is tight, into proj_dir/reads/normalized and point the reads
+        data at the results. needed_bytes, the scratch space the rest of the run needs, is
+        kept free on top of scratch_reserve_bytes.
+        """
+        normalizer = ReadsFormatNormalizer(workers=self.staging_workers)
+        for rds in reads_data:
+            prefix = rds.get('pe_prefix', None) or rds.get('jp_prefix', None)
+            out_dir = os.path.join(self.proj_dir, 'reads', 'normalized', prefix)
+            mkdir_p(out_dir)
+            paths = [rds['fwd_file']] + ([rds['rev_file']] if rds.get('rev_file', None) else [])
+            normalized = normalizer.normalize(paths, out_dir,
+                                              needed_bytes + self.scratch_reserve_bytes)
+            rds['fwd_file'] = normalized[rds['fwd_file']]
+            if rds.get('rev_file', None):
+                rds['rev_file'] = normalized[rds['rev_file']]
+
+    def _estimate_jf_size(self, reads_data):
+        """
+        _estimate_jf_size: estimate the JF_SIZE from the statistics of the staged reads files,
+        with the genome size of the reads profile when there is one
+        """
+        if self.reads_estimate is None:
+            self._estimate_reads(reads_data)
+        read_stats = dict(self.reads_estimate)
+        if self.reads_profile and self.reads_profile.get('genome_size', None):
+            read_stats['genome_size'] = self.reads_profile['genome_size']
+        jf_size, jf_hash_bytes = estimate_jf_size(read_stats)
+        self.reads_estimate['jf_size'] = jf_size
+        self.reads_estimate['jf_hash_bytes'] = jf_hash_bytes
+        log('Estimated {} bases in {} reads, genome size {}; using JF_SIZE={} '
+            '(jellyfish hash about {:.2f} GB)'.format(
+                read_stats['total_bases'], read_stats['total_reads'],
+                read_stats['genome_size'] or 'unknown', jf_size,
+                jf_hash_bytes / float(1024 ** 3)))
+        return jf_size
+
+    def _estimate_pe_reads(self, pe_reads_data, jp_reads_data):
+        """
+        _estimate_pe_reads: the statistics of the paired-end reads alone, those of all the
+        reads when there are no jump libraries
+        """
+        if self.reads_estimate is None:
+            self._estimate_reads(pe_reads_data + jp_reads_data)
+        if not jp_reads_data:
+            return self.reads_estimate
+        return ReadStatsEstimator().estimate(
+            [f for rds in pe_reads_data for f in (rds['fwd_file'], rds.get('rev_file', None))
+             if f])
+
+    def _profile_reads(self, params, reads_data, estimate):
+        """
+        _profile_reads: estimate the genome size, coverage, repeat fraction and
+        heterozygosity of the staged reads, of statistics estimate, from their k-mer
+        histogram, counted with num_threads processes, and save the profile as
+        proj_dir/reads_profile.json
+        """
+        if self.profile_bases == 0 or not reads_data:
+            return None
+        reads_files = [f for rds in reads_data
+                       for f in (rds['fwd_file'], rds.get('rev_file', None)) if f]
+        start = time.time()
+        profiler = ReadsProfiler(k=params.get('kmer_size', None) or 31,
+                                 workers=params.get(self.PARAM_IN_THREADN, None) or 1,
+                                 max_bases=self.profile_bases)
+        self.reads_profile = profiler.profile(
+            reads_files, estimate['total_bases'], estimate['read_length']['median'],
+            (estimate['distinct_kmers'] / float(estimate['sample_kmers'])
+             if estimate['sample_kmers'] else None))
+        log('Profiled {} bases in {:.1f} s: genome size {}, coverage {}, repeat fraction {}, '
+            'heterozygosity {} ({})'.format(
+                self.reads_profile['sampled_bases'], time.time() - start,
+                self.reads_profile['genome_size'] or 'unknown',
+                '{:.1f}x'.format(self.reads_profile['coverage'])
+                if self.reads_profile['coverage'] else 'unknown',
+                self.reads_profile['repeat_fraction'], self.reads_profile['heterozygosity'],
+                self.reads_profile['verdict']))
+        with open(os.path.join(self.proj_dir, 'reads_profile.json'), 'w') as profile_file:
+            json.dump(self.reads_profile, profile_file)
+        return self.reads_profile
+
+    def profile_reads(self, params):
+        """
+        profile_reads: stage the PE reads libraries of params and return their profile, see
+        _profile_reads, without assembling them
+        """
+        if params.get(self.PARAM_IN_WS, None) is None:
+            raise ValueError(self.PARAM_IN_WS + ' parameter is mandatory')
+        if not params.get(self.PARAM_IN_READS_LIBS, None):
+            raise ValueError(self.PARAM_IN_READS_LIBS + ' parameter is mandatory')
+        if not params.get(self.PARAM_IN_THREADN, None):
+            params[self.PARAM_IN_THREADN] = available_cpus()
+        self.resolve_input_refs(params)
+        reads_data = self._get_kbreads_info(
+            params[self.PARAM_IN_WS],
+            [lib.get('pe_id', None) for lib in params[self.PARAM_IN_READS_LIBS]])
+        if self.profile_bases == 0:
+            self.profile_bases = self.DEFAULT_READS_PROFILE_MAX_BASES
+        return self._profile_reads(params, reads_data, self._estimate_reads(reads_data))
+
+    def _tune_graph_kmer_size(self, params, reads_data, estimate):
+        """
+        _tune_graph_kmer_size: unless graph_kmer_size is given, choose it from the prefix
+        sampled k-mer spectra of the PE reads, of statistics estimate, and save the spectra,
+        their plot and analysis in proj_dir/kmer_spectrum. Leaves GRAPH_KMER_SIZE to MaSuRCA
+        ('auto') when the spectra are inconclusive.
+        """
+        if type(params.get('graph_kmer_size', None)) == int or self.kmer_prepass_bases == 0:
+            return
+        if not reads_data:
+            return
+        reads_files = [f for rds in reads_data
+                       for f in (rds['fwd_file'], rds.get('rev_file', None)) if f]
+        start = time.time()
+        tuning = KmerSpectrumTuner(max_bases=self.kmer_prepass_bases,
+                                   workers=params.get(self.PARAM_IN_THREADN, None) or 1).tune(
+            reads_files, estimate['read_length']['median'], estimate['total_bases'],
+            (estimate['distinct_kmers'] / float(estimate['sample_kmers'])
+             if estimate['sample_kmers'] else None))
+        chosen_k = tuning['chosen_k']
+        log('K-mer spectra of {} sampled bases computed in {:.1f} s, {}'.format(
+            tuning['sampled_bases'], time.time() - start,
+            'chose GRAPH_KMER_SIZE={}'.format(chosen_k) if chosen_k
+            else 'no conclusive spectrum, keeping GRAPH_KMER_SIZE=auto'))
+
+        spectrum_dir = os.path.join(self.proj_dir, 'kmer_spectrum')
+        mkdir_p(spectrum_dir)
+        svg = spectrum_svg(tuning['spectra'], chosen_k)
+        with open(os.path.join(spectrum_dir, 'kmer_spectrum.svg'), 'w') as svg_file:
+            svg_file.write(svg)
+        rows = ''.join(
+            '<tr><td>{}</td><td>{}</td><td>{:.1f}</td><td>{:.3f}</td><td>{:.3f}</td>'
+            '<td>{:.4f}</td><td>{}</td></tr>'.format(
+                k, '<b>chosen</b>' if k == chosen_k else '', a['peak_depth'],
+                a['solid_fraction'], a['error_mass'], a['heterozygosity'], kmer_score(a))
+            if a else '<tr><td>{}</td><td colspan="6">no distinct peak</td></tr>'.format(k)
+            for k, a in sorted(tuning['analyses'].items()))
+        with open(os.path.join(spectrum_dir, 'kmer_spectrum.html'), 'w') as html_file:
+            html_file.write(
+                '<html><body><h3>K-mer spectra of {} sampled bases</h3>{}<table border="1">'
+                '<tr><th>k</th><th></th><th>Peak depth</th><th>Solid k-mers</th>'
+                '<th>Error k-mer mass</th><th>Heterozygosity</th><th>Score</th></tr>{}'
+                '</table></body></html>'.format(tuning['sampled_bases'], svg, rows))
+        with open(os.path.join(spectrum_dir, 'kmer_spectrum.json'), 'w') as json_file:
+            json.dump({'chosen_k': chosen_k, 'sampled_bases': tuning['sampled_bases'],
+                       'analyses': tuning['analyses'], 'spectra': tuning['spectra']},
+                      json_file)
+
+        self.kmer_tuning = {'chosen_k': chosen_k, 'sampled_bases': tuning['sampled_bases'],
+                            'analyses': tuning['analyses'], 'dir': spectrum_dir}
+        if chosen_k:
+            params['graph_kmer_size'] = chosen_k
+
+    def _get_long_reads_file(self, wsname, lr_ref):
+        """
+        _get_long_reads_file: return the staged file path(s) of a PacBio/Nanopore input, which
+        can be either an assembly or a reads library
+        """
+        if lr_ref in self.staged_fasta:
+            return self.staged_fasta[lr_ref].get('path', '')
+        full_ref = self._full_ref(wsname, lr_ref)
+        if self._check_ref_type(full_ref, self.ASSEMBLY_TYPES):
+            self._run_staging_tasks([('assembly', lr_ref)])
+            return self.staged_fasta[lr_ref].get('path', '')
+        if self._check_ref_type(full_ref, self.READS_TYPES):
+            lr_rd = self._get_kbreads_info(wsname, [lr_ref])
+            lr_reads_file = lr_rd[0]['fwd_file']
+            if lr_rd[0].get('rev_file', None):
+                lr_reads_file += ' ' + lr_rd[0]['rev_file']
+            return lr_reads_file
+        return ''
+
+    def _generate_output_file_list(self, profile=None):
+        """
+        _generate_output_file_list: zip result files selected by the packaging profile and
+        generate file_links for report
+        """
+        profile = profile or self.DEFAULT_PACKAGING_PROFILE
+        log('start packing result files with the {} packaging profile'.format(profile))
 
         output_files = list()
 
-        output_directory = os.path.join(self.proj_dir, str(uuid.uuid4()))
-        mkdir_p(output_directory)
-        masurca_output = os.path.join(output_directory, 'masurca_output.zip')
-        self._zip_folder(out_dir, masurca_output)
+        masurca_output = os.path.join(self._packaging_dir(), 'masurca_output.zip')
+        members = self._select_output_files(self.proj_dir, profile)
+        self._zip_folder(members, masurca_output)
 
         output_files.append({'path': masurca_output,
                              'name': os.path.basename(masurca_output),
@@ -440,62 +1119,93 @@ class masurca_utils:
 
         return output_files
 
-    def _zip_folder(self, folder_path, output_path):
+    def _generate_quast_file_list(self, profile=None, quast_dir=None):
         """
-        _zip_folder: Zip the contents of an entire folder (with that folder included
-        in the archive). Empty subfolders could be included in the archive as well
-        if the commented portion is used.
+        _generate_quast_file_list: zip the QUAST output files selected by the packaging
+        profile and generate file_links for report
+        """
+        profile = profile or self.DEFAULT_PACKAGING_PROFILE
+        if not quast_dir or not os.path.isdir(quast_dir):
+            return []
+        members = self._select_output_files(quast_dir, profile, arc_dir='quast',
+                                            rule_prefix='quast/')
+        if not members:
+            return []
+        quast_output = os.path.join(self._packaging_dir(), 'quast_output.zip')
+        self._zip_folder(members, quast_output)
+        return [{'path': quast_output,
+                 'name': os.path.basename(quast_output),
+                 'label': os.path.basename(quast_output),
+                 'description': 'QUAST output file(s)'}]
+
+    def _packaging_dir(self):
         """
-        with zipfile.ZipFile(output_path, 'w',
-                             zipfile.ZIP_DEFLATED,
-                             allowZip64=True) as ziph:
-            for root, folders, files in os.walk(folder_path):
-                for f in files:
-                    absolute_path = os.path.join(root, f)
-                    relative_path = os.path.join(os.path.basename(root), f)
-                    # print "Adding {} to archive.".format(absolute_path)
-                    ziph.write(absolute_path, relative_path)
+        _packaging_dir: a new dir for a zip file of the report, next to the project dir
+        rather than in it, since the packaging of the project dir walks it while the zip
+        files, and the chunks the ZipPackager writes beside them, are being written
+        """
+        output_directory = os.path.join(os.path.dirname(os.path.normpath(self.proj_dir)),
+                                        'packaging_' + str(uuid.uuid4()))
+        mkdir_p(output_directory)
+        return output_directory
 
-        print("{} created successfully.".format(output_path))
-        # with zipfile.ZipFile(output_path, "r") as f:
-        #    print 'Checking the zipped file......\n'
-        #    for info in f.infolist():
-        #        print info.filename, info.date_time, info.file_size, info.compress_size
+    def _select_output_files(self, folder_path, profile, arc_dir=None, rule_prefix=''):
+        """
+        _select_output_files: walk folder_path and return the (file_path, archive_name)
+        members whose path relative to folder_path (prefixed with rule_prefix) matches one
+        of the profile's include globs and none of its exclude globs. A '*' in a glob also
+        matches across '/'.
+        """
+        if profile not in self.PACKAGING_PROFILES:
+            raise ValueError('Unknown packaging profile {}, must be one of {}'.format(
+                profile, ', '.join(sorted(self.PACKAGING_PROFILES))))
+        includes = self.PACKAGING_PROFILES[profile]['include']
+        excludes = self.PACKAGING_PROFILES[profile]['exclude']
+        if arc_dir is None:
+            arc_dir = os.path.basename(os.path.normpath(folder_path))
+
+        members = []
+        selected_bytes = 0
+        total_bytes = 0
+        for root, folders, files in os.walk(folder_path):
+            for f in files:
+                absolute_path = os.path.join(root, f)
+                if not os.path.isfile(absolute_path):
+                    continue
+                rel_path = os.path.relpath(absolute_path, folder_path).replace(os.sep, '/')
+                rule_path = rule_prefix + rel_path
+                f_size = os.path.getsize(absolute_path)
+                total_bytes += f_size
+                if (any(fnmatch.fnmatchcase(rule_path, p) for p in includes) and
+                        not any(fnmatch.fnmatchcase(rule_path, p) for p in excludes)):
+                    members.append((absolute_path, arc_dir + '/' + rel_path))
+                    selected_bytes += f_size
+        log('Selected {} file(s), {} of {} bytes under {}'.format(
+            len(members), selected_bytes, total_bytes, folder_path))
+        return members
+
+    def _zip_folder(self, members, output_path):
+        """
+        _zip_folder: Zip the given (file_path, archive_name) members. The members are
+        compressed in parallel by a ZipPackager with the configured compression level;
+        already compressed files are stored.
+        """
+        start = time.time()
+        ZipPackager(compression_level=self.zip_compression_level,
+                    workers=self.zip_workers).write(members, output_path)
+        print("{} created successfully in {:.2f} seconds.".format(output_path,
+                                                                   time.time() - start))
 
     def _load_stats(self, input_file_name):
+        """
+        _load_stats: scan the FASTA file in one pass and return a FastaStats instance, which
+        holds the per-contig lengths and the N50/L50/N90, GC and gap metrics
+        """
         log('Starting conversion of FASTA to KBaseGenomeAnnotations.Assembly')
         log('Building Object.')
         if not os.path.isfile(input_file_name):
             raise Exception('The input file name {0} is not a file!'.format(input_file_name))
-        with open(input_file_name, 'r') as input_file_handle:
-            contig_id = None
-            sequence_len = 0
-            fasta_dict = dict()
-            first_header_found = False
-            # Pattern for replacing white space
-            pattern = re.compile(r'\s+')
-            for current_line in input_file_handle:
-                if (current_line[0] == '>'):
-                    # found a header line
-                    # Wrap up previous fasta sequence
-                    if not first_header_found:
-                        first_header_found = True
-                    else:
-                        fasta_dict[contig_id] = sequence_len
-                        sequence_len = 0
-                    fasta_header = current_line.replace('>', '').strip()
-                    try:
-                        contig_id = fasta_header.strip().split(' ', 1)[0]
-                    except (IndexError, KeyError, ValueError):
-                        contig_id = fasta_header.strip()
-                else:
-                    sequence_len += len(re.sub(pattern, '', current_line))
-        # wrap up last fasta sequence
-        if not first_header_found:
-            raise Exception("There are no contigs in this file")
-        else:
-            fasta_dict[contig_id] = sequence_len
-        return fasta_dict
+        return FastaScanner().scan(input_file_name)
 
     def _check_reference(self, ref):
         """
@@ -532,40 +1242,32 @@ class masurca_utils:
 
     def _get_object_type(self, ref):
         """
-        Fetches and returns the typed object name of ref from the given workspace url.
-        If that object doesn't exist, or there's another Workspace error, this raises a
-        RuntimeError exception.
+        Fetches and returns the typed object name of ref from the given workspace url, through
+        the object info memo. If that object doesn't exist, or there's another Workspace error,
+        this raises a RuntimeError exception.
         """
-        info = self.ws_client.get_object_info3({'objects': [{'ref': ref}]})
-        obj_info = info.get('infos', [[]])[0]
-        if len(obj_info) == 0:
-            raise RuntimeError("An error occurred while fetching type info from the Workspace. "
-                               "No information returned for reference {}".format(ref))
-        return obj_info[2]
+        return self._get_object_infos([ref])[0][2]
 
     def _get_fasta_from_assembly(self, assembly_ref):
         """
         From an assembly or contigset, this uses a data file to build a FASTA file
         and return the path to it.
         """
-        allowed_types = ['KBaseFile.Assembly',
-                         'KBaseGenomeAnnotations.Assembly',
-                         'KBaseGenomes.ContigSet']
-        if not self._check_ref_type(assembly_ref, allowed_types):
+        if not self._check_ref_type(assembly_ref, self.ASSEMBLY_TYPES):
             raise ValueError(
                 "The reference {} cannot be used to fetch a FASTA file".format(assembly_ref))
-        au = AssemblyUtil(self.callback_url)
-        return au.get_assembly_as_fasta({'ref': assembly_ref})
+        return self.au.get_assembly_as_fasta({'ref': assembly_ref})
 
-    def generate_report(self, contig_file_name, params, out_dir, wsname):
+    def run_quast(self, contig_file_with_path, label):
+        print('Running QUAST')
+        return self.kbq.run_QUAST({'files': [{'path': contig_file_with_path, 'label': label}]})
+
+    def _report_text(self, fasta_stats, params, out_dir, wsname):
         """
-        generate_report: reporting results
+        _report_text: the report message, from the stats of the assembly and of the run
         """
-        log('Generating and saving report')
-
-        contig_file_with_path = os.path.join(out_dir, contig_file_name)
-        fasta_stats = self._load_stats(contig_file_with_path)
-        lengths = [fasta_stats[contig_id] for contig_id in fasta_stats]
+        lengths = fasta_stats.lengths
+        asmbl_metrics = fasta_stats.summary()
 
         assembly_ref = params[self.PARAM_IN_WS] + '/' + params[self.PARAM_IN_CS_NAME]
 
@@ -574,6 +1276,58 @@ class masurca_utils:
         report_text += 'Assembly saved to: ' + assembly_ref + '\n'
         report_text += 'Assembled into ' + str(len(lengths)) + ' contigs.\n'
         report_text += 'Avg Length: ' + str(sum(lengths) / float(len(lengths))) + ' bp.\n'
+        report_text += 'Total Length: {} bp, N50: {} bp (L50: {}), N90: {} bp (L90: {}).\n'.format(
+            asmbl_metrics['total_length'], asmbl_metrics['n50'], asmbl_metrics['l50'],
+            asmbl_metrics['n90'], asmbl_metrics['l90'])
+        report_text += 'GC Content: {:.2f}%, Ns: {} bp in {} gap(s), longest gap: {} bp.\n'.format(
+            100 * asmbl_metrics['gc_content'], asmbl_metrics['n_count'],
+            asmbl_metrics['gap_count'], asmbl_metrics['longest_gap'])
+
+        if self.reads_estimate:
+            report_text += ('Input reads: about {} bases, median read length {} bp, '
+                            'estimated genome size {}, JF_SIZE {}.\n').format(
+                self.reads_estimate['total_bases'],
+                self.reads_estimate['read_length']['median'],
+                self.reads_estimate['genome_size'] or 'unknown',
+                params[self.PARAM_IN_JF_SIZE])
+            if self.reads_estimate.get('reduction', None):
+                reduction = self.reads_estimate['reduction']
+                report_text += 'Paired-end reads reduced ({}) from {} to {} bases.\n'.format(
+                    reduction['mode'], reduction['bases_in'], reduction['bases_kept'])
+
+        if self.reads_profile and self.reads_profile['genome_size']:
+            report_text += ('Reads profile (k={}): genome size {}, coverage {:.1f}x, '
+                            'repeat fraction {:.3f}, heterozygosity {:.4f}, {}.\n').format(
+                self.reads_profile['kmer_size'], self.reads_profile['genome_size'],
+                self.reads_profile['coverage'], self.reads_profile['repeat_fraction'],
+                self.reads_profile['heterozygosity'], self.reads_profile['verdict'])
+
+        if self.kmer_tuning:
+            if self.kmer_tuning['chosen_k']:
+                chosen = self.kmer_tuning['analyses'][self.kmer_tuning['chosen_k']]
+                report_text += ('Graph k-mer size {} chosen from the k-mer spectra of {} '
+                                'sampled bases (peak depth {:.1f}, error k-mer mass {:.3f}, '
+                                'heterozygosity {:.4f}).\n').format(
+                    self.kmer_tuning['chosen_k'], self.kmer_tuning['sampled_bases'],
+                    chosen['peak_depth'], chosen['error_mass'], chosen['heterozygosity'])
+            else:
+                report_text += ('No conclusive k-mer spectrum in {} sampled bases, graph '
+                                'k-mer size left to MaSuRCA.\n').format(
+                    self.kmer_tuning['sampled_bases'])
+
+        if self.assemble_resources:
+            report_text += ('MaSuRCA run: {:.2f} wall hours, {:.2f} CPU hours, '
+                            'peak summed RSS {:.2f} GB').format(
+                self.assemble_resources['wall_seconds'] / 3600.0,
+                self.assemble_resources['cpu_seconds'] / 3600.0,
+                self.assemble_resources['peak_rss_bytes'] / float(1024 ** 3))
+            if self.assemble_resources.get('peak_pss_bytes', None):
+                report_text += ', peak PSS {:.2f} GB'.format(
+                    self.assemble_resources['peak_pss_bytes'] / float(1024 ** 3))
+            report_text += '.\n'
+
+        if self.stage_tracker and self.stage_tracker.table():
+            report_text += 'MaSuRCA stage timings:\n' + self.stage_tracker.format_table() + '\n'
 
         # compute a simple contig length distribution
         bins = 10
@@ -582,31 +1336,99 @@ class masurca_utils:
         for c in range(bins):
             report_text += ('   ' + str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' +
                             str(edges[c + 1]) + ' bp\n')
-        print('Running QUAST')
-        quastret = self.kbq.run_QUAST(
-            {'files': [{'path': contig_file_with_path, 'label': params[self.PARAM_IN_CS_NAME]}]})
-
-        output_files = self._generate_output_file_list(out_dir)
+        return report_text
 
+    def _save_report(self, report_text, params, quastret, output_files):
+        assembly_ref = params[self.PARAM_IN_WS] + '/' + params[self.PARAM_IN_CS_NAME]
+        html_links = [{'shock_id': quastret['shock_id'],
+                       'name': 'report.html',
+                       'label': 'QUAST report'}]
+        if self.kmer_tuning:
+            html_links.append({'path': self.kmer_tuning['dir'],
+                               'name': 'kmer_spectrum.html',
+                               'label': 'K-mer spectra'})
         print('Saving report')
         report_output = self.kbr.create_extended_report(
             {'message': report_text,
              'objects_created': [{'ref': assembly_ref, 'description': 'Assembled contigs'}],
              'direct_html_link_index': 0,
              'file_links': output_files,
-             'html_links': [{'shock_id': quastret['shock_id'],
-                             'name': 'report.html',
-                             'label': 'QUAST report'}
-                            ],
+             'html_links': html_links,
              'report_object_name': 'kb_masurca_report_' + str(uuid.uuid4()),
              'workspace_name': params[self.PARAM_IN_WS]})
         report_name = report_output['name']
         report_ref = report_output['ref']
         return report_name, report_ref
 
-    def validate_params(self, params):
+    def add_report_tasks(self, graph, contig_file_with_path, params, out_dir, wsname,
+                         deps=()):
+        """
+        add_report_tasks: add the tasks reporting the results to a TaskGraph. The assembly
+        stats, QUAST and the packaging of the outputs run concurrently; the 'report' task,
+        saving the report, waits for them and for the tasks named in deps.
+        """
+        profile = params.get('packaging_profile', None)
+        graph.add('stats', lambda r: self._report_text(
+            self._load_stats(contig_file_with_path), params, out_dir, wsname))
+        graph.add('quast', lambda r: self.run_quast(contig_file_with_path,
+                                                    params[self.PARAM_IN_CS_NAME]))
+        graph.add('packaging', lambda r: self._generate_output_file_list(profile))
+        graph.add('quast_packaging', lambda r: self._generate_quast_file_list(
+            profile, r['quast'].get('quast_path', None)), deps=['quast'])
+        graph.add('report', lambda r: self._save_report(
+            r['stats'], params, r['quast'], r['packaging'] + r['quast_packaging']),
+            deps=['stats', 'quast', 'packaging', 'quast_packaging'] + list(deps))
+
+    def save_sweep_report(self, records, params):
+        """
+        save_sweep_report: one report comparing the assemblies of the variants of a sweep,
+        with their stats, run resources and a QUAST report over all of them
+        """
+        assembled = [r for r in records if r.get('assembly_ref', None)]
+        report_text = 'MaSuRCA parameter sweep of {} variant(s), {} assembled.\n'.format(
+            len(records), len(assembled))
+        report_text += format_comparison(records) + '\n'
+        for record in records:
+            report_text += '{}: {}{}\n'.format(
+                record['name'], ', '.join('{}={}'.format(k, v)
+                                          for k, v in sorted(record['overrides'].items())),
+                ' (reused the error corrected reads of {})'.format(record['shared_from'])
+                if record.get('shared_from', None) else '')
+        html_links = []
+        if assembled:
+            print('Running QUAST')
+            quastret = self.kbq.run_QUAST({'files': [{'path': r['path'], 'label': r['name']}
+                                                     for r in assembled]})
+            html_links.append({'shock_id': quastret['shock_id'],
+                               'name': 'report.html',
+                               'label': 'QUAST report'})
+        report_params = {'message': report_text,
+                         'objects_created': [{'ref': r['assembly_ref'],
+                                              'description': 'Assembled contigs of ' + r['name']}
+                                             for r in assembled],
+                         'html_links': html_links,
+                         'report_object_name': 'kb_masurca_report_' + str(uuid.uuid4()),
+                         'workspace_name': params[self.PARAM_IN_WS]}
+        if html_links:
+            report_params['direct_html_link_index'] = 0
+        print('Saving report')
+        report_output = self.kbr.create_extended_report(report_params)
+        return report_output['name'], report_output['ref']
+
+    def generate_report(self, contig_file_name, params, out_dir, wsname):
+        """
+        generate_report: reporting results
+        """
+        log('Generating and saving report')
+        graph = TaskGraph()
+        self.add_report_tasks(graph, os.path.join(out_dir, contig_file_name), params,
+                              out_dir, wsname)
+        return graph.run()['report']
+
+    def validate_params(self, params, reads_profile=None):
         """
-        validate_params: checks params passed to run_masurca_app method and set default values
+        validate_params: checks params passed to run_masurca_app method and set default values;
+        with the reads_profile of the staged reads, also those depending on the genome
         """
         # log('Start validating run_masurca_app parameters:\n{}'.format(
         # json.dumps(params, indent=1)))
@@ -614,11 +1436,6 @@ class masurca_utils:
         # check for mandatory parameters
         if params.get(self.PARAM_IN_WS, None) is None:
             raise ValueError(self.PARAM_IN_WS + ' parameter is mandatory')
-        if self.PARAM_IN_THREADN not in params:
-            raise ValueError(self.PARAM_IN_THREADN + ' parameter is mandatory')
-
-        if params.get(self.PARAM_IN_JF_SIZE, None) is None:
-            raise ValueError(self.PARAM_IN_JF_SIZE + ' parameter is mandatory')
         if params.get(self.PARAM_IN_READS_LIBS, None) is None:
             raise ValueError(self.PARAM_IN_READS_LIBS + ' parameter is mandatory')
         if type(params[self.PARAM_IN_READS_LIBS]) != list:
@@ -630,7 +1447,7 @@ class masurca_utils:
             raise ValueError('Invalid workspace object name: {}.'.format(
                              params[self.PARAM_IN_CS_NAME]))
 
-        if ('dna_source' in params):
+        if params.get('dna_source', None):
             dna_src = params.get('dna_source')
             if dna_src == 'bacteria':
                 params['limit_jump_coverage'] = 60
@@ -639,17 +1456,59 @@ class masurca_utils:
                 params['limit_jump_coverage'] = 300
                 params['cgwErrorRate'] = 0.15
 
+        if reads_profile and reads_profile.get('genome_size', None):
+            if not params.get('dna_source', None):
+                genome_size = reads_profile['genome_size']
+                bacteria = genome_size <= self.BACTERIA_MAX_GENOME_SIZE
+                params['limit_jump_coverage'] = 60 if bacteria else 300
+                params['cgwErrorRate'] = 0.25 if bacteria else 0.15
+            if reads_profile['verdict'] == 'over-sequenced' and params.get(
+                    'reduce_reads', 'none') == 'none':
+                log('The reads cover the genome {:.0f}x, consider reduce_reads'.format(
+                    reads_profile['coverage']))
+
+        # jf_size is estimated from the staged reads when omitted, see _estimate_jf_size
+        if not params.get(self.PARAM_IN_THREADN, None):
+            params[self.PARAM_IN_THREADN] = available_cpus()
+
         if params.get('create_report', None) is None:
             params['create_report'] = 0
 
+        if params.get('resume', None) is None:
+            params['resume'] = 0
+
+        if params.get('plan_only', None) is None:
+            params['plan_only'] = 0
+
+        if not params.get('reduce_reads', None):
+            params['reduce_reads'] = 'none'
+        elif params['reduce_reads'] not in REDUCTION_MODES:
+            raise ValueError('reduce_reads must be one of {}'.format(', '.join(REDUCTION_MODES)))
+
+        if not params.get('packaging_profile', None):
+            params['packaging_profile'] = self.DEFAULT_PACKAGING_PROFILE
+        elif params['packaging_profile'] not in self.PACKAGING_PROFILES:
+            raise ValueError('packaging_profile must be one of {}'.format(
+                             ', '.join(sorted(self.PACKAGING_PROFILES))))
+
         return params
 
     def construct_masurca_assembler_cfg(self, params):
-        # STEP 1: get the working folder housing the config.txt file and the masurca results
-        wsname = params[self.PARAM_IN_WS]
-        config_file_path = os.path.join(self.proj_dir, 'config.txt')
+        # STEP 1: the config.txt file and the masurca results go in the project folder,
+        # see _write_config
+        pe_reads_data, jp_reads_data = self.prepare_inputs(params)
+        return self._write_config(params, pe_reads_data, jp_reads_data)
 
-        # STEP 2.1: retrieve the reads data from input parameter
+    def prepare_inputs(self, params):
+        """
+        prepare_inputs: stage, reduce, profile and normalize the reads inputs of the run and
+        fill the parameters depending on them, the jf_size and num_threads fitted to the
+        memory limit. Returns (pe_reads_data, jp_reads_data).
+        """
+        # STEP 2.1: stage all reads inputs concurrently, then retrieve the reads data
+        self.resolve_input_refs(params)
+        self.check_scratch_space(params)
+        self._stage_inputs(params)
         pe_reads_data = self._get_pereads_info(params)
         jp_reads_data = []
         if params.get(self.PARAM_IN_JUMP_LIBS, None):
@@ -659,39 +1518,43 @@ class masurca_utils:
             if ('jp_stdev' not in params or type(params['jp_stdev']) != int):
                 params['jp_stdev'] = 200
 
+        # STEP 2.1.1: optionally reduce the coverage of deep paired-end libraries
+        self._reduce_reads(params, pe_reads_data, jp_reads_data)
+        # STEP 2.1.2: profile the PE reads and fill the defaults depending on the genome, the
+        # JF_SIZE from the bases of all the reads
+        pe_estimate = self._estimate_pe_reads(pe_reads_data, jp_reads_data)
+        if self._profile_reads(params, pe_reads_data, pe_estimate):
+            self.validate_params(params, self.reads_profile)
+        if not params.get(self.PARAM_IN_JF_SIZE, None):
+            params[self.PARAM_IN_JF_SIZE] = self._estimate_jf_size(pe_reads_data + jp_reads_data)
+        self._tune_graph_kmer_size(params, pe_reads_data, pe_estimate)
+        # STEP 2.1.3: fit JF_SIZE and NUM_THREADS to the memory limit, once for the run
+        self._fit_memory(params)
+        # recheck with the staged reads, then keep the rest of the forecast free when
+        # choosing the reads format
+        forecast = self.check_scratch_space(params, staged=True)
+        self._normalize_reads_format(pe_reads_data + jp_reads_data,
+                                     forecast['total'] if forecast else 0)
+        return pe_reads_data, jp_reads_data
+
+    def _write_config(self, params, pe_reads_data, jp_reads_data):
+        """
+        _write_config: save the config.txt file of the run for the given reads data and
+        return its path, or '' when there is nothing to assemble
+        """
+        wsname = params[self.PARAM_IN_WS]
+        config_file_path = os.path.join(self.proj_dir, 'config.txt')
+
         # STEP 2.2: PACBIO reads must be in a single FASTA file and supplied as PACBIO=reads.fa;
-        assbl_types = ['KBaseFile.Assembly',
-                       'KBaseGenomeAnnotations.Assembly',
-                       'KBaseGenomes.ContigSet']
-        reads_types = ['KBaseAssembly.SingleEndLibrary',
-                       'KBaseFile.SingleEndLibrary',
-                       'KBaseAssembly.PairedEndLibrary',
-                       'KBaseFile.PairedEndLibrary']
         pb_reads_file = ''
         if params.get('pacbio_reads', None):
-            pb_ref = params['pacbio_reads']
-            if self._check_ref_type(pb_ref, assbl_types):
-                pb_reads_file = (self._get_fasta_from_assembly(pb_ref)).get('path', '')
-            else:
-                if self._check_ref_type(pb_ref, reads_types):
-                    pb_rd = self._get_kbreads_info(wsname, [pb_ref])
-                    pb_reads_file = pb_rd[0]['fwd_file']
-                    if pb_rd[0].get('rev_file', None):
-                        pb_reads_file += ' ' + pb_rd[0]['rev_file']
+            pb_reads_file = self._get_long_reads_file(wsname, params['pacbio_reads'])
 
         # STEP 2.3: NANOPORE reads must be in a single FASTA/FASTQ file and supplied
         # as NANOPORE=reads.fa
         np_reads_file = ''
         if params.get('nanopore_reads', None):
-            np_ref = params['nanopore_reads']
-            if self._check_ref_type(np_ref, assbl_types):
-                np_reads_file = (self._get_fasta_from_assembly(np_ref)).get('path', '')
-            else:
-                if self._check_ref_type(np_ref, reads_types):
-                    np_rd = self._get_kbreads_info(wsname, [np_ref])
-                    np_reads_file = np_rd[0]['fwd_file']
-                    if np_rd[0].get('rev_file', None):
-                        np_reads_file += ' ' + np_rd[0]['rev_file']
+            np_reads_file = self._get_long_reads_file(wsname, params['nanopore_reads'])
 
         # STEP 2.4: any OTHER sequence data (454, Sanger, Ion torrent, etc) must be first
         # converted into Celera Assembler compatible .frg files
@@ -749,6 +1612,99 @@ class masurca_utils:
         else:
             return config_file_path
 
+    def _stage_placeholders(self, params):
+        """
+        _stage_placeholders: stand empty files in for the staged inputs of the run, typed from
+        their workspace info, so that config.txt can be rendered without downloading them
+        """
+        wsname = params[self.PARAM_IN_WS]
+        placeholder_dir = os.path.join(self.proj_dir, 'placeholders')
+        mkdir_p(placeholder_dir)
+
+        def placeholder(name):
+            path = os.path.join(placeholder_dir, name)
+            open(path, 'a').close()
+            return path
+
+        for lr_param in ['pacbio_reads', 'nanopore_reads']:
+            lr_ref = params.get(lr_param, None)
+            if not lr_ref:
+                continue
+            full_ref = self._full_ref(wsname, lr_ref)
+            if self._check_ref_type(full_ref, self.ASSEMBLY_TYPES):
+                key = ReadsCache.key_for(self._get_object_infos([full_ref])[0])
+                self.staged_fasta[lr_ref] = {'path': placeholder(key + '.fa')}
+        for ref in self._input_refs(params):
+            if ref in self.staged_reads or not self._check_ref_type(ref, self.READS_TYPES):
+                continue
+            key = ReadsCache.key_for(self._get_object_infos([ref])[0])
+            files = {'fwd': placeholder(key + '.fwd.fastq'), 'type': 'single'}
+            if 'pairedend' in self._get_object_type(ref).lower():
+                files.update({'rev': placeholder(key + '.rev.fastq'), 'type': 'paired'})
+            self.staged_reads[ref] = {'files': files, 'sequencing_tech': 'Unknown'}
+
+    def plan_masurca_assembler(self, params):
+        """
+        plan_masurca_assembler: render config.txt and assemble.sh for the run from the
+        workspace metadata of its inputs alone, and forecast the memory and scratch space it
+        needs, with a rough estimate of its CPU time. Returns the plan dict.
+        """
+        wsname = params[self.PARAM_IN_WS]
+        self.resolve_input_refs(params)
+        long_refs = [self._full_ref(wsname, params[p]) for p in ('pacbio_reads', 'nanopore_reads')
+                     if params.get(p, None)]
+        short_refs = [r for r in self._input_refs(params) if r not in long_refs]
+        metadata = dict(zip(short_refs + long_refs,
+                            self._get_inputs_metadata(short_refs + long_refs)))
+        total_bases = sum(self._input_bases(metadata[r]) for r in short_refs)
+        long_bases = sum(self._input_bases(metadata[r]) for r in long_refs)
+        # a plan is made for another node, where none of the reads are cached yet
+        reads_bytes = sum(meta['file_bytes'] or 0 for meta in metadata.values())
+        if not params.get(self.PARAM_IN_JF_SIZE, None):
+            params[self.PARAM_IN_JF_SIZE] = estimate_jf_size({'total_bases': total_bases})[0]
+
+        self._stage_placeholders(params)
+        pe_reads_data = self._get_pereads_info(params)
+        jp_reads_data = self._get_jpreads_info(params)
+        config_file = self._write_config(params, pe_reads_data, jp_reads_data)
+        if not config_file:
+            raise ValueError('Failed to create the config.txt file of the plan')
+        assemble_file = self.generate_assemble_script(config_file)
+
+        jf_size = params[self.PARAM_IN_JF_SIZE]
+        num_threads = params[self.PARAM_IN_THREADN]
+        soap = params.get('soap_assembly', None) == 1
+        cpu = forecast_cpu(total_bases, long_bases, soap)
+        memory = forecast_memory(jf_size, num_threads, total_bases, long_bases, soap)
+        disk = forecast_scratch(total_bases, jf_size, reads_bytes, long_bases, soap)
+        with codecs.open(config_file, mode='r', encoding='utf-8') as config_txt:
+            config = config_txt.read()
+        assemble_script = ''
+        if assemble_file and os.path.isfile(assemble_file):
+            with codecs.open(assemble_file, mode='r', encoding='utf-8') as assemble_sh:
+                assemble_script = assemble_sh.read()
+
+        plan = {
+            'total_bases': total_bases,
+            'long_reads_bases': long_bases,
+            'num_threads': num_threads,
+            'jf_size': jf_size,
+            'cpu_hours': round(cpu['total'] / 3600.0, 2),
+            'wall_hours': round(cpu['total'] / 3600.0 / (num_threads * PARALLEL_EFFICIENCY), 2),
+            'memory_bytes': memory['peak'],
+            'disk_bytes': disk['total'],
+            'cpu_seconds': cpu,
+            'memory': memory,
+            'disk': disk,
+            'config': config,
+            'assemble_script': assemble_script
+        }
+        log('Assembly plan: roughly {:.1f} CPU-hours ({:.1f} h on {} threads), {:.1f} GB of '
+            'memory, {:.1f} GB of scratch'.format(plan['cpu_hours'], plan['wall_hours'], num_threads,
+                                          memory['peak'] / float(1024 ** 3),
+                                          disk['total'] / float(1024 ** 3)))
+        return plan
+
     def generate_assemble_script(self, config_file):
         if os.path.isfile(config_file):
             f_dir, f_nm = os.path.split(config_file)
@@ -768,7 +1724,7 @@ class masurca_utils:
             log('NO assemble.sh file created.\n')
         return ''
 
-    def run_assemble(self, asmbl_file):
+    def run_assemble(self, asmbl_file, output_handlers=()):
         exit_code = 1
         if os.path.isfile(asmbl_file):
             log("The assemble.sh file exists at {}\n".format(asmbl_file))
@@ -777,18 +1733,44 @@ class masurca_utils:
             a_cmd.append(asmbl_file)
             log("The working directory is {}\n".format(f_dir))
             log("The assembling command is {}\n".format(' '.join(a_cmd)))
+            self.stage_tracker = StageTracker(checkpoint_dir=f_dir)
+            # a snapshot per project dir, where the status method finds it
+            progress_log = ProgressLog(os.path.join(f_dir, PROGRESS_LOG_FILE),
+                                       os.path.join(f_dir, PROGRESS_SNAPSHOT_FILE))
+            watchdog = Watchdog(self.assemble_timeout, self.stage_timeouts, self.stall_timeout)
             try:
-                exit_code = self.prog_runner.run(a_cmd, f_dir)
+                exit_code, summary = self.prog_runner.run_with_summary(
+                    a_cmd, f_dir, new_session=True,
+                    output_handlers=[self.stage_tracker, progress_log, watchdog] +
+                    list(output_handlers))
             except ValueError as ve:
                 log('Error running assemble: \n{}'.format(ve))
+            self._save_resource_summary(f_dir)
+            self.stage_tracker.save(os.path.join(f_dir, 'stage_timings.json'))
+            log('MaSuRCA stage timings:\n{}'.format(self.stage_tracker.format_table()))
+            if watchdog.failure:
+                raise ValueError(watchdog.failure)
         else:
             log("The assemble.sh file {} is not found.".format(asmbl_file))
         return exit_code
 
+    def _save_resource_summary(self, f_dir):
+        """
+        _save_resource_summary: log and save the resource usage of the last assemble run
+        as resource_summary.json for sizing the nodes of future jobs
+        """
+        self.assemble_resources = self.prog_runner.last_run_summary
+        if not self.assemble_resources:
+            return
+        log('assemble.sh resource usage:\n{}'.format(
+            json.dumps(self.assemble_resources, indent=1)))
+        with open(os.path.join(f_dir, 'resource_summary.json'), 'w') as summary_file:
+            json.dump(self.assemble_resources, summary_file, indent=1)
+
     def save_assembly(self, contig_fa, wsname, a_name):
         if os.path.isfile(contig_fa):
             log('Uploading FASTA file to Assembly...')
-            self.au.save_assembly_from_fasta(
+            return self.au.save_assembly_from_fasta(
                             {'file': {'path': contig_fa},
                              'workspace_name': wsname,
                              'assembly_name': a_name})
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import glob
+import json
+import time
+import threading
+
+from MaSuRCA.core.assemble_stages import detect_stage, STAGE_NAMES, STARTUP_STAGE
+
+PROGRESS_LOG_FILE = 'masurca_progress.jsonl'
+PROGRESS_SNAPSHOT_FILE = 'masurca_progress.json'
+
+# counts printed by the MaSuRCA tools, e.g. '45%', 'processed 1200 of 5000', '[12/40]'
+_PERCENT_RE = re.compile(r'(\d+(?:\.\d+)?)\s*%')
+_COUNT_RE = re.compile(r'\b(\d+)\s*(?:/|of|out of)\s*(\d+)\b')
+
+
+def parse_percent(line):
+    """
+    parse_percent: the completion percentage an output line reports, or None
+    """
+    match = _PERCENT_RE.search(line)
+    if match:
+        percent = float(match.group(1))
+        return percent if percent <= 100 else None
+    match = _COUNT_RE.search(line)
+    if match and 0 < int(match.group(2)) and int(match.group(1)) <= int(match.group(2)):
+        return 100.0 * int(match.group(1)) / int(match.group(2))
+    return None
+
+
+def load_progress(snapshot_path):
+    """
+    load_progress: the last progress snapshot saved at snapshot_path, or None
+    """
+    try:
+        with open(snapshot_path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def find_running_progress(scratch_dir, max_depth=3):
+    """
+    find_running_progress: the snapshots of the runs still going on in the project dirs under
+    scratch_dir, one per job or sweep variant, the most recently updated first. Each carries
+    the project_dir it was found in; the snapshots left running by a killed job are skipped.
+    """
+    running = []
+    for depth in range(1, max_depth + 1):
+        pattern = os.path.join(scratch_dir, *(['*'] * depth + [PROGRESS_SNAPSHOT_FILE]))
+        for snapshot_path in glob.glob(pattern):
+            progress = load_progress(snapshot_path)
+            if not progress or progress.get('state', None) not in ('starting', 'running'):
+                continue
+            if progress.get('pid', None) and not _is_alive(progress['pid']):
+                continue
+            progress['project_dir'] = os.path.dirname(snapshot_path)
+            running.append(progress)
+    return sorted(running, key=lambda p: p.get('updated', None) or 0, reverse=True)
+
+
+class ProgressLog(object):
+    """
+    ProgressLog: an output handler for Program_Runner that tees the assemble.sh output into
+    a structured progress log, one JSON object per line carrying the time, the stage, the
+    line and the completion percentage when the line reports counts.
+    A snapshot of the progress (current stage, its percentage, the last line) is rewritten
+    atomically at most every snapshot_interval seconds, so that it can be read at any time
+    while the run goes on, e.g. by the status method.
+    """
+
+    def __init__(self, log_path, snapshot_path=None, snapshot_interval=5):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.log_file = None
+        self.last_snapshot = 0
+        self.progress = {'state': 'starting', 'pid': None, 'started': None, 'updated': None,
+                         'stage': None, 'stage_started': None, 'stage_index': None,
+                         'stage_count': len(STAGE_NAMES), 'stage_percent': None,
+                         'lines': 0, 'last_line': '', 'exit_code': None,
+                         'log_path': log_path}
+
+    def _write(self, record):
+        self.log_file.write(json.dumps(record) + '\n')
+        self.log_file.flush()
+
+    def _save_snapshot(self, now, force=False):
+        if not self.snapshot_path:
+            return
+        if not force and now - self.last_snapshot < self.snapshot_interval:
+            return
+        self.last_snapshot = now
+        tmp_path = '{}.{}.tmp'.format(self.snapshot_path, os.getpid())
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(self.progress, snapshot_file)
+        os.rename(tmp_path, self.snapshot_path)
+
+    def on_start(self, pid):
+        now = time.time()
+        with self.lock:
+            self.log_file = open(self.log_path, 'a')
+            self.progress.update({'state': 'running', 'pid': pid, 'started': now,
+                                  'updated': now, 'stage': STARTUP_STAGE,
+                                  'stage_started': now})
+            self._write({'time': now, 'stage': STARTUP_STAGE, 'event': 'start', 'pid': pid})
+            self._save_snapshot(now, force=True)
+
+    def on_line(self, line):
+        now = time.time()
+        with self.lock:
+            stage = detect_stage(line)
+            new_stage = stage is not None and stage != self.progress['stage']
+            if new_stage:
+                self.progress.update({'stage': stage, 'stage_started': now,
+                                      'stage_index': STAGE_NAMES.index(stage),
+                                      'stage_percent': None})
+            percent = parse_percent(line)
+            if percent is not None:
+                self.progress['stage_percent'] = percent
+            self.progress.update({'updated': now, 'last_line': line[:500]})
+            self.progress['lines'] += 1
+            record = {'time': now, 'stage': self.progress['stage'], 'line': line}
+            if percent is not None:
+                record['percent'] = percent
+            self._write(record)
+            self._save_snapshot(now, force=new_stage)
+
+    def on_exit(self, exit_code, summary):
+        now = time.time()
+        with self.lock:
+            self.progress.update({'state': 'finished' if exit_code == 0 else 'failed',
+                                  'updated': now, 'exit_code': exit_code})
+            self._write({'time': now, 'stage': self.progress['stage'], 'event': 'exit',
+                         'exit_code': exit_code,
+                         'wall_seconds': summary.get('wall_seconds', None)})
+            self.log_file.close()
+            self._save_snapshot(now, force=True)
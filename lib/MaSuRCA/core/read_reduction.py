@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+
+import numpy as np
+
+from MaSuRCA.core.read_stats import CountMinSketch, kmer_hash_array, iter_records, open_reads
+
+REDUCTION_MODES = ['none', 'subsample', 'normalize']
+# default targets: the base coverage kept by subsampling and the median k-mer coverage above
+# which digital normalization drops a read pair
+DEFAULT_SUBSAMPLE_COVERAGE = 100
+DEFAULT_NORMALIZE_COVERAGE = 20
+# the read pairs whose k-mers are hashed together
+BATCH_PAIRS = 20000
+# the throughput of normalize, measured on 100 bp pairs at 10x (2.5 to 3.3 Mb/s)
+NORMALIZE_BASES_PER_SECOND = 3000000
+
+
+def _write_record(out, record):
+    header, seq, qual = record
+    if qual is None:
+        out.write(b'>' + header[1:] + b'\n' + seq + b'\n')
+    else:
+        out.write(header + b'\n' + seq + b'\n+\n' + qual + b'\n')
+
+
+def _iter_pairs(fwd_file, rev_file=None, interleaved=False):
+    """
+    _iter_pairs: yield the reads of a library as tuples of one (single end) or two (mates)
+    records, from a pair of files or a single interleaved file
+    """
+    fwd_records = iter_records(fwd_file)
+    if rev_file is not None:
+        rev_records = iter_records(rev_file)
+        for fwd in fwd_records:
+            rev = next(rev_records, None)
+            if rev is None:
+                raise ValueError('The reverse reads file has fewer reads than the forward one')
+            yield fwd, rev
+        if next(rev_records, None) is not None:
+            raise ValueError('The forward reads file has fewer reads than the reverse one')
+    elif interleaved:
+        for fwd in fwd_records:
+            rev = next(fwd_records, None)
+            if rev is None:
+                raise ValueError('The interleaved reads file has an odd number of reads')
+            yield fwd, rev
+    else:
+        for fwd in fwd_records:
+            yield (fwd,)
+
+
+class ReadReducer(object):
+    """
+    ReadReducer: streams a reads library and writes the reduced copy of it, keeping or
+    dropping the mates of a pair together.
+
+    mode 'subsample' keeps each pair with the probability that brings the library down to
+    target_coverage times genome_size bases.
+    mode 'normalize' is digital normalization (Brown et al. 2012): a pair is kept only while
+    the median count of its k-mers among the kept reads is below target_coverage, the counts
+    being held in a count-min sketch of fixed size, so the memory stays bounded whatever
+    the depth. Only the k-mers whose hash falls in the lowest 1/kmer_stride of the hash range
+    are counted; being chosen by value rather than by position, the same k-mers are counted
+    in every read covering them, and they are plenty for the median. The k-mers of
+    BATCH_PAIRS pairs are hashed at once, the pairs are then decided one by one, at
+    NORMALIZE_BASES_PER_SECOND, so that the deepest datasets take hours: the callers bound
+    the bases they normalize (normalize_max_bases of masurca_utils).
+    """
+
+    def __init__(self, mode, target_coverage=None, genome_size=None, total_bases=None, k=20,
+                 kmer_stride=4, seed=1, sketch_width=1 << 24):
+        if mode not in ('subsample', 'normalize'):
+            raise ValueError('Unknown reads reduction mode: {}'.format(mode))
+        self.mode = mode
+        self.k = k
+        self.kmer_stride = kmer_stride
+        self.random = random.Random(seed)
+        if mode == 'subsample':
+            self.target_coverage = target_coverage or DEFAULT_SUBSAMPLE_COVERAGE
+            if not genome_size or not total_bases:
+                raise ValueError('Subsampling needs the genome size and the total bases')
+            self.keep_fraction = min(1.0, self.target_coverage * genome_size /
+                                     float(total_bases))
+        else:
+            self.target_coverage = target_coverage or DEFAULT_NORMALIZE_COVERAGE
+            self.sketch = CountMinSketch(width=sketch_width)
+            self.max_hash = np.uint64((1 << 64) // kmer_stride - 1)
+
+    def _keep(self, pairs):
+        """
+        _keep: whether to keep each of the pairs, in order
+        """
+        if self.mode == 'subsample':
+            return [self.random.random() < self.keep_fraction for _ in pairs]
+        hashes, index = kmer_hash_array([record[1] for pair in pairs for record in pair],
+                                        self.k, return_index=True)
+        counted = hashes <= self.max_hash
+        indexes = self.sketch.indexes(hashes[counted])
+        # the k-mers of pair i are those between bounds[i] and bounds[i + 1]
+        bounds = np.searchsorted(index[counted] // len(pairs[0]), np.arange(len(pairs) + 1))
+        keep = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            if lo == hi:
+                keep.append(False)
+                continue
+            pair_indexes = indexes[:, lo:hi]
+            counts = self.sketch.counts(pair_indexes)
+            if np.partition(counts, len(counts) // 2)[len(counts) // 2] >= self.target_coverage:
+                keep.append(False)
+                continue
+            self.sketch.add(pair_indexes)
+            keep.append(True)
+        return keep
+
+    def _write_batch(self, pairs, out_files, result):
+        for pair, keep in zip(pairs, self._keep(pairs)):
+            bases = sum(len(record[1]) for record in pair)
+            result['pairs_in'] += 1
+            result['reads_in'] += len(pair)
+            result['bases_in'] += bases
+            if not keep:
+                continue
+            result['pairs_kept'] += 1
+            result['reads_kept'] += len(pair)
+            result['bases_kept'] += bases
+            if len(out_files) > 1:
+                _write_record(out_files[0], pair[0])
+                _write_record(out_files[1], pair[1])
+            else:
+                for record in pair:
+                    _write_record(out_files[0], record)
+
+    def reduce(self, fwd_path, out_dir, rev_path=None, interleaved=False):
+        """
+        reduce: write the reduced library into out_dir and return a dict with the output
+        'fwd' (and 'rev') paths plus the read pairs, reads and bases seen and kept
+        """
+        result = {'pairs_in': 0, 'pairs_kept': 0, 'reads_in': 0, 'reads_kept': 0,
+                  'bases_in': 0, 'bases_kept': 0}
+        in_files = [open_reads(fwd_path)]
+        out_paths = [os.path.join(out_dir, _reduced_name(fwd_path))]
+        if rev_path:
+            in_files.append(open_reads(rev_path))
+            out_paths.append(os.path.join(out_dir, _reduced_name(rev_path)))
+        out_files = [open(p, 'wb') for p in out_paths]
+        try:
+            batch = []
+            for pair in _iter_pairs(in_files[0], in_files[1] if rev_path else None,
+                                    interleaved):
+                batch.append(pair)
+                if len(batch) >= BATCH_PAIRS:
+                    self._write_batch(batch, out_files, result)
+                    batch = []
+            if batch:
+                self._write_batch(batch, out_files, result)
+        finally:
+            for f in in_files + out_files:
+                f.close()
+        result['fwd'] = out_paths[0]
+        if rev_path:
+            result['rev'] = out_paths[1]
+        return result
+
+
+def _reduced_name(path):
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    base, ext = os.path.splitext(name)
+    return base + '.reduced' + (ext or '.fastq')
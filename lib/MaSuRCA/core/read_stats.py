@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+from array import array
+
+import numpy as np
+
+_REVCOMP = bytes.maketrans(b'ACGTacgt', b'TGCAtgca')
+_HASH_MASK = 0xFFFFFFFFFFFFFFFF
+GZIP_MAGIC = b'\x1f\x8b'
+# 2 bit codes of the bases, 4 for anything else (N, the separators between reads)
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _i, _base in enumerate(b'ACGT'):
+    _BASE_CODES[_base] = _BASE_CODES[ord(chr(_base).lower())] = _i
+# multiplier of the polynomial k-mer hash (mod 2**64), odd so that it is invertible
+_POLY_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def open_reads(path):
+    """
+    open_reads: open a reads file for binary reading, transparently gunzipping it
+    """
+    if is_gzipped(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def is_gzipped(path):
+    with open(path, 'rb') as probe:
+        return probe.read(2) == GZIP_MAGIC
+
+
+def iter_records(reads_file):
+    """
+    iter_records: yield the (header, sequence, quality) records of an opened FASTQ or FASTA
+    file; quality is None for FASTA. Multi-line FASTA sequences are joined.
+    """
+    first = reads_file.readline()
+    if not first:
+        return
+    if first.startswith(b'@'):
+        header = first
+        while header:
+            if header.strip():
+                seq = reads_file.readline().rstrip()
+                reads_file.readline()
+                qual = reads_file.readline().rstrip()
+                yield header.rstrip(), seq, qual
+            header = reads_file.readline()
+    else:
+        header = first.rstrip()
+        seq_lines = []
+        for line in reads_file:
+            if line.startswith(b'>'):
+                yield header, b''.join(seq_lines), None
+                header = line.rstrip()
+                seq_lines = []
+            else:
+                seq_lines.append(line.rstrip())
+        yield header, b''.join(seq_lines), None
+
+
+def reverse_complement(seq):
+    return seq.translate(_REVCOMP)[::-1]
+
+
+def _mix64(h):
+    """
+    _mix64: the splitmix64 finalizer over a uint64 array, in place, spreading the bits of
+    the polynomial hashes so that their order is uniform
+    """
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def _window_hashes(codes, k):
+    """
+    _window_hashes: the polynomial hashes of all the windows of length k of the uint64
+    codes, combined from those of the windows of the powers of two lengths making up k,
+    the hash of a window of length a + b being that of its first a codes times
+    _POLY_BASE ** b plus that of its last b, so in about 2 log2(k) vectorized passes
+    """
+    window = codes
+    window_len = 1
+    result = None
+    result_len = 0
+    remaining = k
+    while True:
+        if remaining & 1:
+            if result is None:
+                result = window.copy()
+            else:
+                n = len(codes) - result_len - window_len + 1
+                result = result[:n] * np.uint64(pow(int(_POLY_BASE), window_len, 1 << 64))
+                result += window[result_len:result_len + n]
+            result_len += window_len
+        remaining >>= 1
+        if not remaining:
+            return result
+        window = (window[:-window_len] * np.uint64(pow(int(_POLY_BASE), window_len, 1 << 64)) +
+                  window[window_len:])
+        window_len *= 2
+
+
+def kmer_hash_array(seqs, k, return_index=False, mask=None):
+    """
+    kmer_hash_array: a uint64 array of a 64 bit hash of each canonical k-mer of the
+    sequences seqs, skipping the k-mers with an N. The hash of a k-mer and of its reverse
+    complement are the same, the lesser of their polynomial hashes, mixed. Vectorized over
+    the concatenated sequences, which hashes some 10 million bases a second where slicing
+    and hashing the k-mers one by one in Python did 0.15. With return_index, also the
+    array of the index in seqs of the sequence of each k-mer. mask, a boolean array over
+    the k-mers of the sequences joined by an N, selects the k-mers hashed.
+    """
+    codes = _BASE_CODES[np.frombuffer(b'N'.join(seqs), dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        empty = np.zeros(0, dtype=np.uint64)
+        return (empty, np.zeros(0, dtype=np.int64)) if return_index else empty
+    invalid = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = invalid[k:] == invalid[:n]
+    if mask is not None:
+        valid &= mask
+    fwd_codes = codes.astype(np.uint64)
+    fwd = _window_hashes(fwd_codes, k)
+    # the reverse complement of the k-mer at i is the k-mer at len - k - i of the reversed
+    # complemented codes
+    rev = _window_hashes(np.uint64(3) - fwd_codes[::-1], k)[::-1]
+    np.minimum(fwd, rev, out=fwd)
+    hashes = _mix64(fwd[valid])
+    if not return_index:
+        return hashes
+    # each sequence is followed by its separator in the joined codes
+    ends = np.cumsum(np.fromiter((len(seq) + 1 for seq in seqs), dtype=np.int64,
+                                 count=len(seqs)))
+    return hashes, np.searchsorted(ends, np.flatnonzero(valid), side='right')
+
+
+class CountMinSketch(object):
+    """
+    CountMinSketch: approximate counts of 64 bit hashes in depth rows of width saturating
+    16 bit counters, updated conservatively (only the minimal counters are raised). The
+    hashes are given as their indexes(), an array of depth rows of counter indexes, so
+    that those of many hashes are computed in one go.
+    """
+    MAX_COUNT = 0xFFFF
+
+    def __init__(self, width=1 << 22, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = np.zeros((depth, width), dtype=np.uint16)
+        self._row_ids = np.arange(depth)[:, None]
+
+    def indexes(self, hashes):
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        return np.array([(h1 + np.uint64(i) * h2) % np.uint64(self.width)
+                         for i in range(self.depth)], dtype=np.int64).reshape(
+            self.depth, len(hashes))
+
+    def counts(self, indexes):
+        return self.rows[self._row_ids, indexes].min(axis=0)
+
+    def add(self, indexes):
+        """
+        add: count the hashes of indexes once more (a hash given several times counts once)
+        and return their new estimated counts
+        """
+        new_counts = np.minimum(self.counts(indexes).astype(np.int64) + 1, self.MAX_COUNT)
+        for row, row_indexes in zip(self.rows, indexes):
+            np.maximum.at(row, row_indexes, new_counts.astype(np.uint16))
+        return new_counts
+
+
+class ReadStatsEstimator(object):
+    """
+    ReadStatsEstimator: streams a sample of the reads files to estimate the total bases, the
+    read length distribution and, from their k-mers, the genome size.
+
+    The first sample_reads records of each file are parsed; for files longer than that the
+    totals are extrapolated from the share of the (possibly compressed) file consumed.
+    The k-mers of the first sketch_bases of the sample (all of it by default) are hashed and
+    those whose hash falls under a threshold counted exactly, the threshold being halved
+    whenever more than max_kmers distinct k-mers are held, so that the sketch follows the
+    size of the genome and not a fixed share of it. The hashing being the same for every
+    occurrence of a k-mer, the distinct, solid (seen at least twice) and solid k-mer
+    instances scale from the sketch to the sample. When the solid k-mers are covered deeply
+    enough, their number estimates the genome size; otherwise the sample is too thin, e.g.
+    for genomes of more than a third of the sampled bases, and no genome size is given: the
+    reads profile of ReadsProfiler gives it from all the reads.
+    """
+    MIN_SAMPLE_KMER_COVERAGE = 3.0
+    BATCH_BASES = 4000000
+
+    def __init__(self, k=25, sample_reads=1000000, sketch_bases=None, max_kmers=2000000):
+        self.k = k
+        self.sample_reads = sample_reads
+        # None for all the sampled reads, 0 to skip the genome size
+        self.sketch_bases = sketch_bases
+        self.max_kmers = max_kmers
+
+    def estimate(self, reads_files):
+        lengths = array('L')
+        total_reads = 0.0
+        total_bases = 0.0
+        sketch = _KmerSketch(self.k, self.max_kmers)
+        batch = []
+        batch_bases = 0
+
+        for reads_path in reads_files:
+            file_size = os.path.getsize(reads_path)
+            raw = open(reads_path, 'rb')
+            reads_file = gzip.GzipFile(fileobj=raw) if is_gzipped(reads_path) else raw
+            n_reads = 0
+            n_bases = 0
+            exhausted = True
+            try:
+                for _, seq, _ in iter_records(reads_file):
+                    n_reads += 1
+                    n_bases += len(seq)
+                    lengths.append(len(seq))
+                    if self.sketch_bases is None or sketch.bases + batch_bases < \
+                            self.sketch_bases:
+                        batch.append(seq)
+                        batch_bases += len(seq)
+                        if batch_bases >= self.BATCH_BASES:
+                            sketch.add(batch, batch_bases)
+                            batch = []
+                            batch_bases = 0
+                    if n_reads >= self.sample_reads:
+                        exhausted = False
+                        break
+                consumed = raw.tell()
+            finally:
+                reads_file.close()
+                raw.close()
+            scale = 1.0 if exhausted or not consumed else file_size / float(consumed)
+            total_reads += n_reads * scale
+            total_bases += n_bases * scale
+        if batch:
+            sketch.add(batch, batch_bases)
+
+        return self._summarize(lengths, total_reads, total_bases, sketch.summary())
+
+    def _summarize(self, lengths, total_reads, total_bases, kmers):
+        sorted_lengths = sorted(lengths)
+
+        def percentile(q):
+            if not sorted_lengths:
+                return 0
+            return sorted_lengths[min(len(sorted_lengths) - 1, int(q * len(sorted_lengths)))]
+
+        distinct_solid = kmers['distinct_solid']
+        sample_kmer_coverage = (kmers['solid_instances'] / float(distinct_solid)
+                                if distinct_solid else 0)
+        genome_size = None
+        if sample_kmer_coverage >= self.MIN_SAMPLE_KMER_COVERAGE:
+            genome_size = distinct_solid
+        return {'total_reads': int(total_reads),
+                'total_bases': int(total_bases),
+                'read_length': {'min': sorted_lengths[0] if sorted_lengths else 0,
+                                'p10': percentile(0.1),
+                                'median': percentile(0.5),
+                                'p90': percentile(0.9),
+                                'max': sorted_lengths[-1] if sorted_lengths else 0,
+                                'mean': (sum(sorted_lengths) / float(len(sorted_lengths))
+                                         if sorted_lengths else 0)},
+                'kmer_size': self.k,
+                'sample_kmers': kmers['instances'],
+                'sketch_rate': kmers['rate'],
+                'distinct_kmers': kmers['distinct'],
+                'distinct_solid_kmers': distinct_solid,
+                'sample_kmer_coverage': sample_kmer_coverage,
+                'genome_size': genome_size,
+                'coverage': total_bases / float(genome_size) if genome_size else None}
+
+
+class _KmerSketch(object):
+    """
+    _KmerSketch: the exact counts of the k-mers whose hash is at most max_hash, halved as
+    needed to hold at most max_kmers of them
+    """
+
+    def __init__(self, k, max_kmers):
+        self.k = k
+        self.max_kmers = max_kmers
+        self.max_hash = _HASH_MASK
+        self.bases = 0
+        self.instances = 0
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, seqs, bases):
+        self.bases += bases
+        hashes = kmer_hash_array(seqs, self.k)
+        self.instances += len(hashes)
+        if self.max_hash != _HASH_MASK:
+            hashes = hashes[hashes <= np.uint64(self.max_hash)]
+        merged, index = np.unique(np.concatenate((self.hashes, hashes)), return_inverse=True)
+        weights = np.concatenate((self.counts, np.ones(len(hashes), dtype=np.int64)))
+        self.hashes = merged
+        self.counts = np.bincount(index, weights=weights, minlength=len(merged)).astype(
+            np.int64)
+        while len(self.hashes) > self.max_kmers:
+            self.max_hash >>= 1
+            kept = self.hashes <= np.uint64(self.max_hash)
+            self.hashes = self.hashes[kept]
+            self.counts = self.counts[kept]
+
+    def summary(self):
+        """
+        summary: the k-mer 'instances' hashed, the 'rate' of the distinct k-mers kept, and
+        the 'distinct', 'distinct_solid' and 'solid_instances' k-mers scaled from it
+        """
+        rate = (self.max_hash + 1) / float(_HASH_MASK + 1)
+        solid = self.counts[self.counts >= 2]
+        return {'instances': self.instances,
+                'rate': rate,
+                'distinct': int(len(self.counts) / rate),
+                'distinct_solid': int(len(solid) / rate),
+                'solid_instances': int(solid.sum() / rate)}
+
+
+# JF_SIZE as recommended by MaSuRCA: 20 times the genome size, and never more than the
+# total bases of the reads; kept above a floor so that tiny inputs do not make jellyfish
+# grow its hash repeatedly
+JF_SIZE_GENOME_FACTOR = 20
+MIN_JF_SIZE = 100000000
+# bytes per jellyfish hash entry (k-mer bits plus the counter bits, with some slack)
+JF_BYTES_PER_ENTRY = 8
+
+
+def estimate_jf_size(read_stats):
+    """
+    estimate_jf_size: return (jf_size, jf_hash_bytes), the JF_SIZE for the reads summarized
+    by ReadStatsEstimator.estimate and the forecast memory of a jellyfish hash of that size
+    """
+    jf_size = read_stats['total_bases']
+    if read_stats.get('genome_size'):
+        jf_size = min(jf_size, JF_SIZE_GENOME_FACTOR * read_stats['genome_size'])
+    jf_size = max(MIN_JF_SIZE, int(jf_size))
+    return jf_size, jf_size * JF_BYTES_PER_ENTRY
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import errno
+import fcntl
+import shutil
+import tempfile
+import threading
+
+
+def link_or_copy(src, dst):
+    """
+    link_or_copy: hardlink src to dst, falling back to a copy when src and dst are on
+    different file systems. Never a symlink, which would break once the cache evicts src.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ReadsCache(object):
+    """
+    ReadsCache: a persistent store of downloaded reads files keyed by the resolved
+    wsid/objid/ver of the reads object. Since a versioned workspace object never changes,
+    the key addresses the file content. Entries are evicted in least-recently-used order
+    once the cached files exceed max_bytes.
+
+    The files are copied in and out of the cache outside of its lock, which is only held to
+    rename an entry into place, hard link its files and update the index, so that a copy
+    across file systems never blocks the other threads and jobs sharing the cache.
+
+    Layout:
+        <cache_dir>/cache_index.json
+        <cache_dir>/<wsid>_<objid>_<ver>/<cached files>
+        <cache_dir>/.tmp*/, the entries being copied in or out
+    """
+    INDEX_FILE = 'cache_index.json'
+    LOCK_FILE = '.cache_lock'
+    FILE_KEYS = ['fwd', 'rev']
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        if self.enabled():
+            try:
+                os.makedirs(cache_dir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key_for(obj_info):
+        """
+        key_for: build the cache key from a workspace object_info tuple
+        """
+        return '{}_{}_{}'.format(obj_info[6], obj_info[0], obj_info[4])
+
+    def _locked(self):
+        """
+        _locked: serialize index updates across threads and across processes sharing the cache
+        """
+        cache = self
+
+        class _Lock(object):
+            def __enter__(self):
+                cache._lock.acquire()
+                self.fh = open(os.path.join(cache.cache_dir, cache.LOCK_FILE), 'a')
+                fcntl.flock(self.fh, fcntl.LOCK_EX)
+
+            def __exit__(self, *args):
+                fcntl.flock(self.fh, fcntl.LOCK_UN)
+                self.fh.close()
+                cache._lock.release()
+
+        return _Lock()
+
+    def _read_index(self):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.isfile(index_path):
+            return {}
+        try:
+            with open(index_path) as index_file:
+                return json.load(index_file)
+        except ValueError:
+            # a torn index only costs us the cached entries, never correctness
+            return {}
+
+    def _write_index(self, index):
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename(tmp_path, index_path)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _evict(self, index, keep_key=None):
+        """
+        _evict: drop least recently used entries until the cache fits into max_bytes
+        """
+        total = sum(e['size'] for e in index.values())
+        lru_keys = sorted(index, key=lambda k: index[k]['last_used'])
+        for key in lru_keys:
+            if total <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            total -= index[key]['size']
+            del index[key]
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            print('Evicted {} from the reads cache'.format(key))
+
+    def _record_files(self, record):
+        files = record['files']
+        for fkey in self.FILE_KEYS:
+            if files.get(fkey, None):
+                yield fkey, files[fkey]
+
+    def contains(self, key):
+        if not self.enabled():
+            return False
+        with self._locked():
+            return key in self._read_index()
+
+    def _tmp_dir(self):
+        return tempfile.mkdtemp(prefix='.tmp', dir=self.cache_dir)
+
+    def get(self, key, dest_dir):
+        """
+        get: link the cached files of key into dest_dir and return a download_reads style
+        record pointing at them, or None on a cache miss. The files are copied when dest_dir
+        is on another file system, so that evicting the entry, possibly from another job
+        sharing the cache, never pulls them from under the run.
+        """
+        if not self.enabled():
+            return None
+        tmp_dir = self._tmp_dir()
+        try:
+            with self._locked():
+                index = self._read_index()
+                entry = index.get(key, None)
+                if entry is None:
+                    return None
+                entry_dir = self._entry_dir(key)
+                record = json.loads(json.dumps(entry['record']))
+                # hard links within the cache dir, which keep the files should the entry be
+                # evicted while they are copied out
+                for fkey, fname in self._record_files(entry['record']):
+                    cached_file = os.path.join(entry_dir, fname)
+                    if not os.path.isfile(cached_file):
+                        # the entry was damaged behind our back, treat as a miss
+                        del index[key]
+                        self._write_index(index)
+                        shutil.rmtree(entry_dir, ignore_errors=True)
+                        return None
+                    os.link(cached_file, os.path.join(tmp_dir, fname))
+                entry['last_used'] = time.time()
+                self._write_index(index)
+            try:
+                os.makedirs(dest_dir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            for fkey, fname in self._record_files(entry['record']):
+                run_file = os.path.join(dest_dir, fname)
+                link_or_copy(os.path.join(tmp_dir, fname), run_file)
+                record['files'][fkey] = run_file
+            return record
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def put(self, key, record):
+        """
+        put: add the files of a download_reads record to the cache under key. The record
+        itself is left untouched and keeps pointing at the downloaded files.
+        """
+        if not self.enabled():
+            return
+        size = sum(os.path.getsize(path) for _, path in self._record_files(record))
+        if size > self.max_bytes:
+            print('Reads object {} ({} bytes) exceeds the cache budget, not cached'.format(
+                  key, size))
+            return
+        if self.contains(key):
+            return
+        # copied into a tmp dir of the cache first, then renamed into place under the lock
+        tmp_dir = self._tmp_dir()
+        try:
+            cached = json.loads(json.dumps(record))
+            for fkey, path in self._record_files(record):
+                fname = fkey + '_' + os.path.basename(path)
+                link_or_copy(path, os.path.join(tmp_dir, fname))
+                cached['files'][fkey] = fname
+            with self._locked():
+                index = self._read_index()
+                if key in index:
+                    # cached by another job in the meantime
+                    return
+                entry_dir = self._entry_dir(key)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.rename(tmp_dir, entry_dir)
+                index[key] = {'record': cached, 'size': size, 'last_used': time.time()}
+                self._evict(index, keep_key=key)
+                self._write_index(index)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import zlib
+import time
+import shutil
+import struct
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from MaSuRCA.core.read_stats import is_gzipped
+
+# BGZF: a series of gzip members of at most 64 KiB each, every member carrying its compressed
+# size in a 'BC' extra field, ended by an empty member (SAM/BAM specification, section 4.1).
+# Plain gzip readers (zcat, jellyfish through zcat) read it as one gzip file.
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes(bytearray([0x1f, 0x8b, 8, 4, 0, 0, 0, 0, 0, 0xff, 6, 0, 0x42, 0x43, 2, 0,
+                            0x1b, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0]))
+READ_BUF_SIZE = 1024 * 1024
+# compressed bytes read to sample the compression ratio of a gzipped file
+RATIO_SAMPLE_BYTES = 16 * 1024 * 1024
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def bgzf_block(data, level=6):
+    """
+    bgzf_block: one BGZF member holding data (at most BGZF_BLOCK_SIZE bytes)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<BBBBIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6,
+                         0x42, 0x43, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                        len(data))
+
+
+def gzip_ratio(path):
+    """
+    gzip_ratio: the uncompressed to compressed size ratio of a gzipped file, sampled from its
+    first RATIO_SAMPLE_BYTES
+    """
+    with open(path, 'rb') as raw:
+        reader = gzip.GzipFile(fileobj=raw)
+        out = 0
+        while raw.tell() < RATIO_SAMPLE_BYTES:
+            buf = reader.read(READ_BUF_SIZE)
+            if not buf:
+                break
+            out += len(buf)
+        consumed = raw.tell()
+    return out / float(consumed) if consumed else 1.0
+
+
+class ReadsFormatNormalizer(object):
+    """
+    ReadsFormatNormalizer: brings the staged reads files to the format read fastest by
+    jellyfish and the error corrector given the scratch space left. Gzipped reads are read
+    through a single threaded zcat on every pass, so when the disk holds the uncompressed
+    reads with reserve_bytes to spare they are decompressed once, the files in parallel.
+    A gzip stream only inflates on one core, so each file takes one core either way: pigz,
+    installed in the image, moves its reading, writing and check sums to other threads, the
+    gzip module used in its absence does all of it on the one thread. When the disk does
+    not hold them, the plain files are instead recompressed to BGZF, the blocks compressed
+    in parallel, to free space.
+    """
+
+    def __init__(self, workers=4, compression_level=6, batch_blocks=64):
+        self.workers = max(1, workers)
+        self.compression_level = compression_level
+        self.batch_blocks = batch_blocks
+        self.pigz = shutil.which('pigz')
+
+    def plan(self, paths, out_dir, reserve_bytes=0):
+        """
+        plan: return ('decompress', extra_bytes) when decompressing the gzipped files leaves
+        at least reserve_bytes free in out_dir, else ('compress', freed_bytes) with the
+        estimated space freed by recompressing the plain files, or ('keep', 0) when there is
+        nothing to do
+        """
+        st = os.statvfs(out_dir)
+        free_bytes = st.f_bavail * st.f_frsize
+        gzipped = [p for p in paths if is_gzipped(p)]
+        plain = [p for p in paths if p not in gzipped]
+        if gzipped:
+            extra = sum(int(os.path.getsize(p) * gzip_ratio(p)) for p in gzipped)
+            if free_bytes - extra >= reserve_bytes:
+                return 'decompress', extra
+        if plain and free_bytes < reserve_bytes:
+            # FASTQ compresses about 4x
+            return 'compress', sum(os.path.getsize(p) for p in plain) * 3 // 4
+        return 'keep', 0
+
+    def normalize(self, paths, out_dir, reserve_bytes=0):
+        """
+        normalize: write the normalized files into out_dir and return the dict mapping each
+        input path to its normalized path (the input itself when left as it is)
+        """
+        action, size = self.plan(paths, out_dir, reserve_bytes)
+        log('Reads format: {} ({:.2f} GB)'.format(action, size / float(1024 ** 3)))
+        result = dict((p, p) for p in paths)
+        if action == 'keep':
+            return result
+        start = time.time()
+        if action == 'decompress':
+            todo = [p for p in paths if is_gzipped(p)]
+            pool = ThreadPool(min(self.workers, len(todo)))
+            try:
+                outputs = pool.map(lambda p: self._decompress(p, out_dir), todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            todo = [p for p in paths if not is_gzipped(p)]
+            # the blocks of each file are compressed in parallel instead
+            outputs = [self._compress(p, out_dir) for p in todo]
+        for src, dst in zip(todo, outputs):
+            result[src] = dst
+            self._release(src)
+        log('Normalized {} reads file(s) in {:.1f} s'.format(len(todo), time.time() - start))
+        return result
+
+    def _release(self, path):
+        """
+        _release: remove a staged input that has been replaced, unless it is also linked from
+        elsewhere (e.g. the reads cache), in which case removing it frees nothing
+        """
+        if os.stat(path).st_nlink == 1 and not os.path.islink(path):
+            os.remove(path)
+
+    def _decompress(self, path, out_dir):
+        name = os.path.basename(path)
+        out_path = os.path.join(out_dir, name[:-3] if name.endswith('.gz') else name + '.fq')
+        with open(out_path, 'wb') as out:
+            if self.pigz:
+                subprocess.check_call([self.pigz, '-dc', '-p', '2', path], stdout=out)
+            else:
+                with gzip.open(path, 'rb') as src:
+                    shutil.copyfileobj(src, out, READ_BUF_SIZE)
+        return out_path
+
+    def _compress(self, path, out_dir):
+        out_path = os.path.join(out_dir, os.path.basename(path) + '.gz')
+        pool = ThreadPool(self.workers)
+        try:
+            with open(path, 'rb') as src, open(out_path, 'wb') as out:
+                while True:
+                    # a bounded batch of blocks at a time keeps the memory use flat
+                    blocks = []
+                    for _ in range(self.batch_blocks * self.workers):
+                        data = src.read(BGZF_BLOCK_SIZE)
+                        if not data:
+                            break
+                        blocks.append(data)
+                    if not blocks:
+                        break
+                    for block in pool.map(
+                            lambda d: bgzf_block(d, self.compression_level), blocks):
+                        out.write(block)
+                out.write(BGZF_EOF)
+        finally:
+            pool.close()
+            pool.join()
+        return out_path
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+import os
+import multiprocessing
+
+from MaSuRCA.core.read_stats import JF_BYTES_PER_ENTRY
+
+# Rough disk footprints of the MaSuRCA intermediates, per base of (Illumina) input unless
+# noted. assemble.sh keeps all of them until the end of the run, so the peak is their sum.
+SCRATCH_MODEL = {
+    # pe.cor.fa, the error corrected reads as FASTA
+    'error_corrected_reads': 1.2,
+    # work1/, the super reads and the read placements in them
+    'super_reads': 1.0,
+    # CA/, the gatekeeper, overlap and tig stores of the Celera Assembler
+    'ca_stores': 3.0,
+    # the SOAPdenovo work files replacing CA with soap_assembly
+    'soap_files': 1.0,
+    # mega-reads files, per base of long reads
+    'mega_reads': 2.0,
+}
+# the hashes saved by jellyfish (quorum_mer_db.jf and the k-unitig hash), in JF_SIZE entries;
+# conservative, as a hash is only as large as JF_SIZE when it is full
+JF_DB_FACTOR = 1.0
+# bytes per base of gzipped FASTQ, to size the downloads from the metadata alone
+GZIP_FASTQ_BYTES_PER_BASE = 0.6
+
+
+def available_cpus():
+    """
+    available_cpus: the number of CPUs this process may run on
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def free_bytes(path):
+    """
+    free_bytes: the space available to unprivileged users on the file system of path
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def forecast_scratch(total_bases, jf_size, reads_bytes=0, long_reads_bases=0,
+                     soap_assembly=False):
+    """
+    forecast_scratch: predict the peak scratch usage of a MaSuRCA run. reads_bytes is the
+    size of the input files still to be written to scratch (0 once staged).
+    Returns the dict of the components plus their 'total'.
+    """
+    forecast = {
+        'reads': int(reads_bytes),
+        'jellyfish': int(jf_size * JF_BYTES_PER_ENTRY * JF_DB_FACTOR),
+        'error_corrected_reads': int(total_bases * SCRATCH_MODEL['error_corrected_reads']),
+        'super_reads': int(total_bases * SCRATCH_MODEL['super_reads']),
+        'mega_reads': int(long_reads_bases * SCRATCH_MODEL['mega_reads']),
+    }
+    if soap_assembly:
+        forecast['soap'] = int(total_bases * SCRATCH_MODEL['soap_files'])
+    else:
+        forecast['ca_stores'] = int(total_bases * SCRATCH_MODEL['ca_stores'])
+    forecast['total'] = sum(forecast.values())
+    return forecast
+
+
+def format_forecast(forecast):
+    return ', '.join('{} {:.1f} GB'.format(k, v / float(1024 ** 3))
+                     for k, v in sorted(forecast.items()) if k != 'total' and v)
+
+
+def scratch_suggestions(total_bases, jf_size, available, reads_bytes=0, long_reads_bases=0,
+                        soap_assembly=False, genome_size=None):
+    """
+    scratch_suggestions: settings that would bring the forecast within available bytes
+    """
+    suggestions = []
+    if not soap_assembly:
+        soap = forecast_scratch(total_bases, jf_size, reads_bytes, long_reads_bases, True)
+        if soap['total'] <= available:
+            suggestions.append('soap_assembly=1 (forecast {:.1f} GB)'.format(
+                soap['total'] / float(1024 ** 3)))
+    # every component but the downloads and the long reads scales with the Illumina bases
+    fixed = reads_bytes + long_reads_bases * SCRATCH_MODEL['mega_reads']
+    full = forecast_scratch(total_bases, jf_size, 0, 0, soap_assembly)['total']
+    if available > fixed and full:
+        fraction = (available - fixed) / float(full)
+        if fraction < 1:
+            if genome_size:
+                suggestions.append("reduce_reads='subsample' with target_coverage={}".format(
+                    max(1, int(fraction * total_bases / genome_size))))
+            else:
+                suggestions.append("reduce_reads='subsample' or 'normalize' keeping under "
+                                   "{:.0f}% of the reads".format(100 * fraction))
+    return suggestions
+
+
+# Rough resident memory of the MaSuRCA stages. The stages run one after the other, so the
+# peak is that of the largest one plus the fixed overhead of the pipeline.
+MEMORY_MODEL = {
+    # the shell, perl and the resident parts of the pipeline tools
+    'base': 1024 ** 3,
+    # read and output buffers of each worker thread of jellyfish, quorum and the super reads
+    'per_thread': 256 * 1024 ** 2,
+    # the Celera Assembler stores, overlapper hash tables and scaffolder, per Illumina base
+    'ca_per_base': 0.3,
+    # SOAPdenovo with soap_assembly, per Illumina base
+    'soap_per_base': 0.5,
+    # the mega-reads alignments, per base of long reads
+    'mega_reads_per_base': 1.0,
+}
+# share of the memory limit the forecast peak may use
+MEMORY_HEADROOM = 0.9
+# smallest JF_SIZE fit_memory lowers to; jellyfish spills to disk and merges beyond it
+MIN_FIT_JF_SIZE = 10000000
+CGROUP_MEMORY_LIMIT_FILES = ['/sys/fs/cgroup/memory.max',
+                             '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+
+
+def memory_limit_bytes():
+    """
+    memory_limit_bytes: the memory this process may use, the lesser of the cgroup (v2 or v1)
+    limit and the memory available on the node; None when neither can be read
+    """
+    limits = []
+    for path in CGROUP_MEMORY_LIMIT_FILES:
+        try:
+            with open(path) as limit_file:
+                value = limit_file.read().strip()
+        except (IOError, OSError):
+            continue
+        # 'max' (v2) or a page rounded 2**63 (v1) when unlimited
+        if value.isdigit() and int(value) < 1 << 60:
+            limits.append(int(value))
+    try:
+        with open('/proc/meminfo') as meminfo:
+            fields = dict(line.split(':', 1) for line in meminfo if ':' in line)
+        key = 'MemAvailable' if 'MemAvailable' in fields else 'MemTotal'
+        limits.append(int(fields[key].split()[0]) * 1024)
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    return min(limits) if limits else None
+
+
+def forecast_memory(jf_size, num_threads, total_bases=0, long_reads_bases=0,
+                    soap_assembly=False):
+    """
+    forecast_memory: predict the peak resident memory of a MaSuRCA run.
+    Returns the dict of the per stage forecasts plus their 'peak'.
+    """
+    threads = num_threads * MEMORY_MODEL['per_thread']
+    assembler = 'soap_per_base' if soap_assembly else 'ca_per_base'
+    forecast = {
+        'jellyfish': int(jf_size * JF_BYTES_PER_ENTRY) + threads,
+        'assembly': int(total_bases * MEMORY_MODEL[assembler]) + threads,
+        'mega_reads': (int(long_reads_bases * MEMORY_MODEL['mega_reads_per_base']) + threads
+                       if long_reads_bases else 0),
+    }
+    forecast['peak'] = MEMORY_MODEL['base'] + max(forecast.values())
+    return forecast
+
+
+def fit_memory(jf_size, num_threads, limit, total_bases=0, long_reads_bases=0,
+               soap_assembly=False):
+    """
+    fit_memory: lower the thread count to what half of the memory budget allows, then
+    JF_SIZE, then the thread count again, until the forecast peak stays within
+    MEMORY_HEADROOM of limit. Returns (jf_size, num_threads, forecast); the forecast may still
+    exceed the limit when even the smallest settings do not fit.
+    """
+    budget = int(limit * MEMORY_HEADROOM)
+
+    def forecast_for(size, threads):
+        return forecast_memory(size, threads, total_bases, long_reads_bases, soap_assembly)
+
+    forecast = forecast_for(jf_size, num_threads)
+    if forecast['peak'] > budget:
+        # the thread buffers are given at most half of the budget before the hash shrinks
+        num_threads = max(1, min(num_threads, budget // 2 // MEMORY_MODEL['per_thread']))
+        forecast = forecast_for(jf_size, num_threads)
+    if forecast['peak'] > budget and jf_size > MIN_FIT_JF_SIZE:
+        # a smaller hash only makes jellyfish spill to disk, so it goes first
+        room = budget - MEMORY_MODEL['base'] - num_threads * MEMORY_MODEL['per_thread']
+        jf_size = max(MIN_FIT_JF_SIZE, min(jf_size, room // JF_BYTES_PER_ENTRY))
+        forecast = forecast_for(jf_size, num_threads)
+    while forecast['peak'] > budget and num_threads > 1:
+        num_threads -= 1
+        forecast = forecast_for(jf_size, num_threads)
+    return jf_size, num_threads, forecast
+
+
+# CPU time of the MaSuRCA stages in CPU-seconds per base of input. These are placeholder
+# orders of magnitude, not calibrated against measured runs: the forecasts made from them
+# are rough and only meant to compare settings or flag a run far beyond a node. The per
+# stage CPU times StageTracker records are what to calibrate them against. The Illumina
+# stages scale with the Illumina bases and the mega-reads with the long reads bases.
+CPU_MODEL = {
+    # jellyfish, the quorum error correction and the super reads
+    'super_reads': 1e-5,
+    # the Celera Assembler overlaps, unitigs and scaffolds
+    'ca': 4e-5,
+    # SOAPdenovo with soap_assembly
+    'soap': 1e-5,
+    # the mega-reads alignments, per base of long reads
+    'mega_reads': 2e-4,
+}
+# share of the wall time the stages keep all of the NUM_THREADS busy
+PARALLEL_EFFICIENCY = 0.7
+
+
+def forecast_cpu(total_bases, long_reads_bases=0, soap_assembly=False):
+    """
+    forecast_cpu: a rough, uncalibrated estimate of the CPU time of a MaSuRCA run, see
+    CPU_MODEL.
+    Returns the dict of the per stage CPU-seconds plus their 'total'.
+    """
+    forecast = {
+        'super_reads': int(total_bases * CPU_MODEL['super_reads']),
+        'mega_reads': int(long_reads_bases * CPU_MODEL['mega_reads']),
+    }
+    if soap_assembly:
+        forecast['soap'] = int(total_bases * CPU_MODEL['soap'])
+    else:
+        forecast['ca'] = int(total_bases * CPU_MODEL['ca'])
+    forecast['total'] = sum(forecast.values())
+    return forecast
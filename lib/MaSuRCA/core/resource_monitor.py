@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import threading
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+SERIES_COLUMNS = ['time', 'elapsed', 'processes', 'cpu_seconds', 'rss_bytes', 'pss_bytes',
+                  'read_bytes', 'write_bytes', 'open_files']
+
+
+def _read_proc_stat(pid):
+    """
+    _read_proc_stat: return (ppid, cpu_seconds, rss_bytes) from /proc/<pid>/stat, where
+    cpu_seconds includes the time of the children the process has already reaped
+    """
+    with open('/proc/{}/stat'.format(pid)) as stat_file:
+        stat = stat_file.read()
+    # the command name may contain spaces and parentheses, the fields follow the last ')'
+    fields = stat[stat.rindex(')') + 2:].split()
+    ppid = int(fields[1])
+    ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    return ppid, ticks / float(CLK_TCK), int(fields[21]) * PAGE_SIZE
+
+
+def _read_proc_pss(pid):
+    """
+    _read_proc_pss: the proportional set size of the process from /proc/<pid>/smaps_rollup,
+    where each shared page counts for its share only, or None where the kernel (before 4.14)
+    or the permissions do not give it
+    """
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as smaps_file:
+            for line in smaps_file:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _read_proc_io(pid):
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/{}/io'.format(pid)) as io_file:
+            for line in io_file:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return read_bytes, write_bytes
+
+
+def _count_open_files(pid):
+    try:
+        return len(os.listdir('/proc/{}/fd'.format(pid)))
+    except (IOError, OSError):
+        return 0
+
+
+def process_tree(root_pid):
+    """
+    process_tree: the pids of root_pid and all of its live descendants
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid = _read_proc_stat(entry)[0]
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree = []
+    todo = [root_pid]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, []))
+    return tree
+
+
+def sample_process_tree(root_pid):
+    """
+    sample_process_tree: one resource sample of the process tree rooted at root_pid.
+    rss_bytes is the sum of the RSS of the processes, an upper bound of their memory as the
+    pages they share (libraries, the jellyfish hashes mapped by several programs) are counted
+    once per process; pss_bytes shares them out and falls back to the RSS of the processes
+    whose PSS cannot be read.
+    """
+    sample = {'time': time.time(), 'processes': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0,
+              'pss_bytes': 0, 'read_bytes': 0, 'write_bytes': 0, 'open_files': 0}
+    for pid in process_tree(root_pid):
+        try:
+            _, cpu_seconds, rss_bytes = _read_proc_stat(pid)
+        except (IOError, OSError, ValueError, IndexError):
+            # the process exited between listing and reading
+            continue
+        read_bytes, write_bytes = _read_proc_io(pid)
+        pss_bytes = _read_proc_pss(pid)
+        sample['processes'] += 1
+        sample['cpu_seconds'] += cpu_seconds
+        sample['rss_bytes'] += rss_bytes
+        sample['pss_bytes'] += rss_bytes if pss_bytes is None else pss_bytes
+        sample['read_bytes'] += read_bytes
+        sample['write_bytes'] += write_bytes
+        sample['open_files'] += _count_open_files(pid)
+    return sample
+
+
+class ResourceMonitor(threading.Thread):
+    """
+    ResourceMonitor: samples CPU, RSS, PSS, I/O bytes and open files of a process tree from /proc
+    every interval seconds, appending each sample as a tab separated line to series_file,
+    and keeps the peak values for the run summary.
+    """
+
+    def __init__(self, root_pid, interval, series_file=None):
+        super(ResourceMonitor, self).__init__()
+        self.daemon = True
+        self.root_pid = root_pid
+        self.interval = interval
+        self.series_file = series_file
+        self.start_time = time.time()
+        self.samples = 0
+        self.last_sample = None
+        self.peaks = {'processes': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0, 'pss_bytes': 0,
+                      'read_bytes': 0, 'write_bytes': 0, 'open_files': 0}
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        series = None
+        if self.series_file:
+            series = open(self.series_file, 'w')
+            series.write('\t'.join(SERIES_COLUMNS) + '\n')
+            series.flush()
+        try:
+            while True:
+                self._take_sample(series)
+                if self._stop_event.wait(self.interval):
+                    break
+        finally:
+            if series:
+                series.close()
+
+    def _take_sample(self, series):
+        sample = sample_process_tree(self.root_pid)
+        if not sample['processes']:
+            return
+        sample['elapsed'] = sample['time'] - self.start_time
+        with self._lock:
+            self.samples += 1
+            self.last_sample = sample
+            for key in self.peaks:
+                self.peaks[key] = max(self.peaks[key], sample[key])
+        if series:
+            series.write('\t'.join('{:.2f}'.format(sample[c]) if isinstance(sample[c], float)
+                                   else str(sample[c]) for c in SERIES_COLUMNS) + '\n')
+            series.flush()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def peak_values(self):
+        with self._lock:
+            return dict(self.peaks)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import random
+import threading
+import traceback
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3.exceptions import ProtocolError
+
+from installed_clients.baseclient import BaseClient, ServerError, _JSONObjectEncoder
+
+# connections kept open to each service host, per client
+DEFAULT_POOL_MAXSIZE = 10
+# consecutive failed job state checks after which run_job gives up
+CHECK_JOB_RETRIES = 3
+
+
+class ServiceClient(BaseClient):
+    """
+    ServiceClient: the BaseClient the generated service clients of this module are built
+    with, see build_client; the generated baseclient.py is left as kb-sdk writes it.
+    The JSON-RPC calls go through a pooled requests session, created on first use and
+    shared by all the threads calling through the client (its connection pool is thread
+    safe), so that the many small metadata calls of the staging reuse their connections
+    instead of opening one each. At most pool_maxsize connections are kept per host, calls
+    from more threads than that at once wait for a free one; keep_alive False closes the
+    connection after every call.
+    run_job polls the state of its job on the exponential backoff of BaseClient (from
+    async_job_check_time_ms, growing by async_job_check_time_scale_percent up to
+    async_job_check_max_time_ms), each wait shortened at random by up to jitter_percent so
+    that the jobs submitted together are not checked in lockstep. on_poll, when given, is
+    called as on_poll(job_id, job_state) after every check (job_state None when the check
+    failed), e.g. to report progress or do other work while waiting.
+    """
+
+    def __init__(self, url=None, pool_maxsize=DEFAULT_POOL_MAXSIZE, keep_alive=True,
+                 jitter_percent=50, on_poll=None, **kwargs):
+        super(ServiceClient, self).__init__(url, **kwargs)
+        self.pool_maxsize = int(pool_maxsize)
+        self.keep_alive = keep_alive
+        self.jitter = jitter_percent / 100.0
+        self.on_poll = on_poll
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize, pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """
+        close: close the pooled connections of the client
+        """
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _call(self, url, method, params, context=None):
+        """
+        _call: BaseClient._call, posting through the pooled session
+        """
+        arg_hash = {'method': method,
+                    'params': params,
+                    'version': '1.1',
+                    'id': str(random.random())[2:]}
+        if context:
+            if type(context) is not dict:
+                raise ValueError('context is not type dict as required.')
+            arg_hash['context'] = context
+
+        body = json.dumps(arg_hash, cls=_JSONObjectEncoder)
+        ret = self._get_session().post(url, data=body, headers=self._headers,
+                                       timeout=self.timeout,
+                                       verify=not self.trust_all_ssl_certificates)
+        ret.encoding = 'utf-8'
+        if ret.status_code == 500:
+            if ret.headers.get('content-type') == 'application/json':
+                err = ret.json()
+                if 'error' in err:
+                    raise ServerError(**err['error'])
+            raise ServerError('Unknown', 0, ret.text)
+        if not ret.ok:
+            ret.raise_for_status()
+        resp = ret.json()
+        if 'result' not in resp:
+            raise ServerError('Unknown', 0, 'An unknown server error occurred')
+        if not resp['result']:
+            return
+        if len(resp['result']) == 1:
+            return resp['result'][0]
+        return resp['result']
+
+    def _job_check_waits(self):
+        """
+        _job_check_waits: generate the waits before each job state check
+        """
+        wait = self.async_job_check_time
+        while True:
+            yield wait * (1 - random.uniform(0, self.jitter))
+            wait = min(wait * self.async_job_check_time_scale_percent / 100.0,
+                       self.async_job_check_max_time)
+
+    def run_job(self, service_method, args, service_ver=None, context=None):
+        """
+        run_job: BaseClient.run_job, polling with jitter and on_poll. Only consecutive
+        failed checks count towards CHECK_JOB_RETRIES, so that a job running for hours
+        does not fail on transient errors spread over its run.
+        """
+        mod, _ = service_method.split('.')
+        job_id = self._submit_job(service_method, args, service_ver, context)
+        failures = 0
+        for wait in self._job_check_waits():
+            time.sleep(wait)
+            try:
+                job_state = self._check_job(mod, job_id)
+            except (ConnectionError, ProtocolError):
+                traceback.print_exc()
+                if self.on_poll:
+                    self.on_poll(job_id, None)
+                failures += 1
+                if failures >= CHECK_JOB_RETRIES:
+                    raise RuntimeError('_check_job failed {} times and exceeded limit'.format(
+                        failures))
+                continue
+            failures = 0
+            if self.on_poll:
+                self.on_poll(job_id, job_state)
+            if job_state['finished']:
+                if not job_state['result']:
+                    return
+                if len(job_state['result']) == 1:
+                    return job_state['result'][0]
+                return job_state['result']
+
+
+def build_client(client_class, url, token=None, **options):
+    """
+    build_client: an instance of the generated client_class (e.g. Workspace, ReadsUtils) for
+    url whose calls go through a ServiceClient with the given options
+    """
+    client = client_class(url, token=token)
+    client._client = ServiceClient(url, token=token, **options)
+    return client
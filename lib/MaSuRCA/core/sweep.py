@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import threading
+
+from MaSuRCA.core.assemble_stages import (detect_stage, stage_outputs, STAGE_NAMES,
+                                           STAGE_OUTPUTS)
+from MaSuRCA.core.reads_cache import link_or_copy
+
+# the parameters a variant of a sweep may override
+SWEEP_PARAMS = ['graph_kmer_size', 'kmer_count_threshold', 'close_gaps', 'soap_assembly']
+# the assemble.sh stages whose outputs the variants can share, and the parameters they
+# depend on besides the reads
+SHARED_STAGES = ['jellyfish', 'error_correction']
+SHARED_STAGE_PARAMS = ['jf_size', 'kmer_count_threshold', 'do_homopolymer_trim']
+# the tags naming a variant after its parameters, e.g. k41_t2
+VARIANT_NAME_TAGS = {'graph_kmer_size': 'k', 'kmer_count_threshold': 't',
+                     'close_gaps': 'gaps', 'soap_assembly': 'soap'}
+VARIANT_NAME_RE = re.compile(r'^[\w.-]+$')
+
+
+def validate_variants(variants):
+    """
+    validate_variants: check the variants of a sweep and return them as (name, overrides)
+    tuples, naming the unnamed ones after their overrides
+    """
+    if not variants or type(variants) != list:
+        raise ValueError('variants must be a non-empty list')
+    named = []
+    for i, variant in enumerate(variants):
+        overrides = dict((k, v) for k, v in variant.items() if k != 'name' and v is not None)
+        unknown = [k for k in overrides if k not in SWEEP_PARAMS]
+        if unknown:
+            raise ValueError('Variant parameters must be among {}, got {}'.format(
+                ', '.join(SWEEP_PARAMS), ', '.join(sorted(unknown))))
+        if str(overrides.get('graph_kmer_size', 'auto')).isdigit():
+            overrides['graph_kmer_size'] = int(overrides['graph_kmer_size'])
+        name = variant.get('name', None) or '_'.join(
+            '{}{}'.format(VARIANT_NAME_TAGS[k], overrides[k])
+            for k in SWEEP_PARAMS if k in overrides) or \
+            'variant{}'.format(i + 1)
+        if not VARIANT_NAME_RE.match(name):
+            raise ValueError('Invalid variant name: {}.'.format(name))
+        if name in [n for n, _ in named]:
+            raise ValueError('Variant name {} is used twice'.format(name))
+        named.append((name, overrides))
+    return named
+
+
+def share_groups(variant_params):
+    """
+    share_groups: the lists of the variant names whose shared stages have the same
+    parameters, given the dict of the params of each variant, in the order of the names
+    """
+    groups = {}
+    order = []
+    for name in sorted(variant_params):
+        params = variant_params[name]
+        key = tuple(params.get(p, None) for p in SHARED_STAGE_PARAMS)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(name)
+    return [groups[key] for key in order]
+
+
+def link_shared_outputs(src_dir, dst_dir):
+    """
+    link_shared_outputs: hard link (or copy, across file systems) the outputs of the shared
+    stages of the run in src_dir into dst_dir, where assemble.sh then skips those stages
+    """
+    linked = []
+    for stage in SHARED_STAGES:
+        for pattern in STAGE_OUTPUTS[stage]:
+            src = os.path.join(src_dir, pattern)
+            dst = os.path.join(dst_dir, pattern)
+            if not os.path.isfile(src) or os.path.exists(dst):
+                continue
+            link_or_copy(src, dst)
+            linked.append(pattern)
+    return linked
+
+
+class SharedStagesDone(object):
+    """
+    SharedStagesDone: an output handler for Program_Runner telling when the run has gone past
+    the shared stages, so that the variants waiting on them can reuse their outputs.
+    wait() blocks until then or until the run exits, and returns whether they completed.
+    The stages are followed from the output lines; should a MaSuRCA release word them
+    differently, the outputs of the stages after the shared ones, or of the shared stages
+    once the run exited cleanly, found in proj_dir tell the same every poll_interval seconds.
+    """
+
+    def __init__(self, proj_dir=None, poll_interval=30):
+        self.last_shared = max(STAGE_NAMES.index(stage) for stage in SHARED_STAGES)
+        self.proj_dir = proj_dir
+        self.poll_interval = poll_interval
+        self.completed = False
+        self._event = threading.Event()
+
+    def _outputs_past_shared(self):
+        return self.proj_dir is not None and any(
+            stage_outputs(self.proj_dir, stage)
+            for stage in STAGE_NAMES[self.last_shared + 1:] if STAGE_OUTPUTS.get(stage))
+
+    def _shared_outputs(self):
+        return self.proj_dir is not None and all(
+            stage_outputs(self.proj_dir, stage) for stage in SHARED_STAGES)
+
+    def on_start(self, pid):
+        pass
+
+    def on_line(self, line):
+        stage = detect_stage(line)
+        if stage is not None and STAGE_NAMES.index(stage) > self.last_shared:
+            self.completed = True
+            self._event.set()
+
+    def on_exit(self, exit_code, summary):
+        if exit_code == 0 and self._shared_outputs():
+            self.completed = True
+        self._event.set()
+
+    def wait(self):
+        while not self._event.wait(self.poll_interval):
+            if self._outputs_past_shared():
+                self.completed = True
+                break
+        return self.completed
+
+
+def format_comparison(records):
+    """
+    format_comparison: a text table comparing the assemblies of the variants of a sweep
+    """
+    lines = ['{:<24}{:>10}{:>14}{:>12}{:>10}{:>10}{:>10}  {}'.format(
+        'variant', 'contigs', 'total bp', 'N50', 'wall h', 'CPU h', 'PSS GB', 'status')]
+    for record in records:
+        stats = record.get('stats', None) or {}
+        resources = record.get('resources', None) or {}
+        lines.append('{:<24}{:>10}{:>14}{:>12}{:>10.2f}{:>10.2f}{:>10.2f}  {}'.format(
+            record['name'], stats.get('contig_count', '-'), stats.get('total_length', '-'),
+            stats.get('n50', '-'), resources.get('wall_seconds', 0) / 3600.0,
+            resources.get('cpu_seconds', 0) / 3600.0,
+            resources.get('peak_pss_bytes', resources.get('peak_rss_bytes', 0)) /
+            float(1024 ** 3),
+            record.get('error', None) or 'ok'))
+    return '\n'.join(lines)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue  # py3
+except ImportError:
+    from Queue import Queue  # py2
+
+
+class TaskGraph(object):
+    """
+    TaskGraph: runs a small set of interdependent tasks on a thread pool, each task as soon
+    as the tasks it depends on have finished. A task is called with a dict of the results of
+    its dependencies, keyed by their names.
+    The first task raising an error stops the scheduling of new tasks; the running ones are
+    waited for and the error is raised from run().
+    Tasks calling SDK methods through the generated clients block in run_job, so a graph of
+    them is how the jobs of this module overlap one another.
+    A task may declare the resources it holds while running, e.g. {'cores': 4, 'memory': 8e9};
+    run() with a budget then only starts the ready tasks whose resources fit in what the
+    running ones leave, in the order they were added. A task needing more than the whole
+    budget runs alone.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.order = []
+        self.timings = {}
+
+    def add(self, name, func, deps=(), resources=None):
+        if name in self.tasks:
+            raise ValueError('Task {} is already defined'.format(name))
+        self.tasks[name] = (func, list(deps), dict(resources or {}))
+        self.order.append(name)
+
+    def _check(self):
+        for name in self.order:
+            for dep in self.tasks[name][1]:
+                if dep not in self.tasks:
+                    raise ValueError('Task {} depends on the unknown task {}'.format(name, dep))
+        # a graph with a cycle leaves tasks that can never become ready
+        done = set()
+        progress = True
+        while progress:
+            progress = False
+            for name in self.order:
+                if name not in done and all(d in done for d in self.tasks[name][1]):
+                    done.add(name)
+                    progress = True
+        if len(done) != len(self.order):
+            raise ValueError('The dependencies of tasks {} form a cycle'.format(
+                ', '.join(n for n in self.order if n not in done)))
+
+    def _run_task(self, name, dep_results):
+        start = time.time()
+        try:
+            return name, True, self.tasks[name][0](dep_results), start, time.time()
+        except BaseException as e:
+            # anything escaping here would never reach the finished queue run() waits on
+            return name, False, e, start, time.time()
+
+    def _fits(self, name, in_use, budget):
+        needed = self.tasks[name][2]
+        if not budget or not needed:
+            return True
+        if not any(in_use.values()):
+            return True
+        return all(in_use.get(k, 0) + v <= budget.get(k, v) for k, v in needed.items())
+
+    def run(self, workers=None, budget=None):
+        """
+        run: run all the tasks and return the dict of their results; budget is the dict of
+        the resources the running tasks may hold together, unlimited when omitted
+        """
+        self._check()
+        results = {}
+        pending = list(self.order)
+        running = set()
+        in_use = {}
+        finished = Queue()
+        error = None
+        pool = ThreadPool(workers or max(1, len(self.order)))
+        try:
+            while pending or running:
+                if error is None:
+                    for name in [n for n in pending
+                                 if all(d in results for d in self.tasks[n][1])]:
+                        if not self._fits(name, in_use, budget):
+                            continue
+                        for k, v in self.tasks[name][2].items():
+                            in_use[k] = in_use.get(k, 0) + v
+                        pending.remove(name)
+                        running.add(name)
+                        dep_results = dict((d, results[d]) for d in self.tasks[name][1])
+                        pool.apply_async(self._run_task, (name, dep_results),
+                                         callback=finished.put)
+                if not running:
+                    break
+                name, ok, value, start, end = finished.get()
+                running.remove(name)
+                for k, v in self.tasks[name][2].items():
+                    in_use[k] -= v
+                self.timings[name] = {'start': start, 'end': end, 'seconds': end - start}
+                if ok:
+                    results[name] = value
+                elif error is None:
+                    error = value
+        finally:
+            pool.close()
+            pool.join()
+        if error is not None:
+            raise error
+        return results
+
+    def format_timings(self):
+        if not self.timings:
+            return ''
+        origin = min(t['start'] for t in self.timings.values())
+        return '\n'.join('{:<18}{:>10.1f}{:>10.1f}'.format(
+            name, self.timings[name]['start'] - origin, self.timings[name]['seconds'])
+            for name in self.order if name in self.timings)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import signal
+import threading
+
+from MaSuRCA.core.assemble_stages import detect_stage, STARTUP_STAGE
+from MaSuRCA.core.resource_monitor import sample_process_tree
+
+# CPU-seconds or bytes written by the process tree that count as progress for stall detection
+STALL_CPU_SECONDS = 1.0
+STALL_WRITE_BYTES = 1024 * 1024
+
+
+def parse_stage_timeouts(spec):
+    """
+    parse_stage_timeouts: the {stage: seconds} dict of a 'stage:seconds,stage:seconds' string
+    """
+    timeouts = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        stage, _, seconds = item.partition(':')
+        if not seconds.strip():
+            raise ValueError('Invalid stage timeout "{}", expected stage:seconds'.format(item))
+        timeouts[stage.strip()] = float(seconds)
+    return timeouts
+
+
+class Watchdog(object):
+    """
+    Watchdog: an output handler for Program_Runner that enforces wall-clock limits on a run
+    started in its own session (process group): timeout for the whole run, stage_timeouts
+    ({stage: seconds}) for the stages recognized in the output, and stall_timeout for a run
+    showing neither output nor CPU or write progress for that long.
+    When a limit is hit the process group is sent SIGTERM, then SIGKILL after kill_grace
+    seconds, and failure describes the limit, the stage and its resource usage.
+    """
+
+    def __init__(self, timeout=None, stage_timeouts=None, stall_timeout=None,
+                 poll_interval=10, kill_grace=30):
+        self.timeout = timeout
+        self.stage_timeouts = stage_timeouts or {}
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.kill_grace = kill_grace
+        self.pid = None
+        self.start_time = None
+        self.stage = None
+        self.stage_start = None
+        self.stage_cpu_start = 0.0
+        self.last_activity = None
+        self.last_sample = None
+        self.failure = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def enabled(self):
+        return bool(self.timeout or self.stage_timeouts or self.stall_timeout)
+
+    def on_start(self, pid):
+        now = time.time()
+        self.pid = pid
+        self.start_time = self.last_activity = now
+        self.stage = STARTUP_STAGE
+        self.stage_start = now
+        if self.enabled():
+            self._thread = threading.Thread(target=self._watch)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def on_line(self, line):
+        stage = detect_stage(line)
+        with self._lock:
+            now = time.time()
+            self.last_activity = now
+            if stage is not None and stage != self.stage:
+                self.stage = stage
+                self.stage_start = now
+                self.stage_cpu_start = (self.last_sample or {}).get('cpu_seconds', 0.0)
+
+    def on_exit(self, exit_code, summary):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            sample = sample_process_tree(self.pid)
+            with self._lock:
+                now = time.time()
+                previous = self.last_sample
+                if previous is None or (
+                        sample['cpu_seconds'] - previous['cpu_seconds'] >= STALL_CPU_SECONDS or
+                        sample['write_bytes'] - previous['write_bytes'] >= STALL_WRITE_BYTES):
+                    self.last_activity = max(self.last_activity, now)
+                    self.last_sample = sample
+                reason = self._check(now)
+                if reason:
+                    self.failure = self._describe(reason, now, sample)
+            if reason:
+                self._kill()
+                return
+
+    def _check(self, now):
+        if self.timeout and now - self.start_time > self.timeout:
+            return 'the run exceeded its {:.0f} s limit'.format(self.timeout)
+        stage_timeout = self.stage_timeouts.get(self.stage, None)
+        if stage_timeout and now - self.stage_start > stage_timeout:
+            return 'the stage exceeded its {:.0f} s limit'.format(stage_timeout)
+        if self.stall_timeout and now - self.last_activity > self.stall_timeout:
+            return 'no output, CPU or write progress for {:.0f} s'.format(self.stall_timeout)
+        return None
+
+    def _describe(self, reason, now, sample):
+        return ('MaSuRCA stage {} was killed: {}. Stage wall time {:.0f} s, CPU {:.0f} s; '
+                'run wall time {:.0f} s, CPU {:.0f} s, PSS {:.2f} GB, {} processes, '
+                '{:.2f} GB written'.format(
+                    self.stage, reason, now - self.stage_start,
+                    max(0.0, sample['cpu_seconds'] - self.stage_cpu_start),
+                    now - self.start_time, sample['cpu_seconds'],
+                    sample['pss_bytes'] / float(1024 ** 3), sample['processes'],
+                    sample['write_bytes'] / float(1024 ** 3)))
+
+    def _kill(self):
+        print('Watchdog > ' + self.failure)
+        for sig, wait in ((signal.SIGTERM, self.kill_grace), (signal.SIGKILL, 0)):
+            try:
+                os.killpg(self.pid, sig)
+            except OSError:
+                return
+            deadline = time.time() + wait
+            while time.time() < deadline:
+                if self._stop_event.wait(1):
+                    # the run has exited and been reaped
+                    return
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import zlib
+import shutil
+import struct
+import tempfile
+import collections
+from multiprocessing.pool import ThreadPool
+
+from MaSuRCA.core.resource_forecast import available_cpus
+
+# files that are already compressed gain nothing from deflate and are stored as they are
+STORED_EXTENSIONS = ('.gz', '.bgz', '.bz2', '.xz', '.zip', '.zst', '.png', '.jpg', '.jpeg')
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+READ_BUF_SIZE = 1024 * 1024
+
+
+def _gf2_matrix_times(mat, vec):
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    crc32_combine: the CRC-32 of the concatenation of two blocks given their CRCs and the
+    length of the second block (a port of zlib's crc32_combine, which Python does not expose)
+    """
+    if len2 <= 0:
+        return crc1
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+def _process_chunk(task):
+    """
+    _process_chunk: pool worker body. Computes the CRC-32 of one chunk of a member and, for
+    deflated members, compresses it into a temporary file as a raw deflate segment. All but
+    the last segment of a member end with a sync flush, so that the segments concatenate
+    into a single valid deflate stream.
+    Returns (tmp_path or None, crc, uncompressed_size, compressed_size).
+    """
+    path, offset, length, level, is_last, tmp_dir = task
+    crc = 0
+    done = 0
+    tmp_path = None
+    compressor = None
+    out = None
+    if level > 0:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        out = os.fdopen(fd, 'wb')
+    try:
+        with open(path, 'rb') as src:
+            src.seek(offset)
+            while done < length:
+                buf = src.read(min(READ_BUF_SIZE, length - done))
+                if not buf:
+                    break
+                crc = zlib.crc32(buf, crc)
+                done += len(buf)
+                if compressor:
+                    out.write(compressor.compress(buf))
+        if compressor:
+            out.write(compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH))
+    finally:
+        if out:
+            out.close()
+    comp_size = os.path.getsize(tmp_path) if tmp_path else done
+    return tmp_path, crc & 0xFFFFFFFF, done, comp_size
+
+
+def _bounded_imap(pool, func, tasks, window):
+    """
+    _bounded_imap: the results of func over tasks, in order, with at most window tasks
+    submitted to the pool ahead of the consumer
+    """
+    pending = collections.deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def _copy_bytes(src, out, length):
+    while length > 0:
+        buf = src.read(min(READ_BUF_SIZE, length))
+        if not buf:
+            break
+        out.write(buf)
+        length -= len(buf)
+
+
+def _dos_date_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return (0 << 11), (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipPackager(object):
+    """
+    ZipPackager: builds a Zip64 capable archive with the members compressed in parallel
+    over a thread pool, zlib releasing the GIL while it deflates and checksums a buffer.
+    Threads rather than processes, since the packaging runs next to the TaskGraph threads
+    that are in the middle of service calls, which a forked worker would inherit.
+    Members are cut into chunk_size pieces, each compressed independently (pigz style),
+    then the archive is assembled sequentially in member order.
+    At most window chunks (2 x workers by default) are compressed ahead of the writer, which
+    bounds the deflated chunks waiting in the temporary directory to window x chunk_size.
+    compression_level 0 stores every member; members with a STORED_EXTENSIONS suffix are
+    always stored.
+    """
+
+    def __init__(self, compression_level=6, workers=None, chunk_size=64 * 1024 * 1024,
+                 stored_extensions=STORED_EXTENSIONS, window=None):
+        if compression_level < 0 or compression_level > 9:
+            raise ValueError('compression level must be between 0 and 9')
+        self.compression_level = compression_level
+        self.workers = workers or available_cpus()
+        self.chunk_size = chunk_size
+        self.stored_extensions = tuple(e.lower() for e in stored_extensions)
+        self.window = window
+
+    def _member_level(self, path):
+        if path.lower().endswith(self.stored_extensions):
+            return 0
+        return self.compression_level
+
+    def _chunk_tasks(self, members, tmp_dir):
+        """
+        _chunk_tasks: the flat list of chunk tasks of all members, in archive order, and the
+        number of chunks of each member
+        """
+        tasks = []
+        chunk_counts = []
+        for path, _ in members:
+            size = os.path.getsize(path)
+            level = self._member_level(path)
+            offsets = list(range(0, size, self.chunk_size)) or [0]
+            for offset in offsets:
+                length = min(self.chunk_size, size - offset)
+                tasks.append((path, offset, length, level, offset == offsets[-1], tmp_dir))
+            chunk_counts.append(len(offsets))
+        return tasks, chunk_counts
+
+    def write(self, members, output_path):
+        """
+        write: create output_path from members, a list of (file_path, archive_name) tuples
+        """
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+        tasks, chunk_counts = self._chunk_tasks(members, tmp_dir)
+        n_workers = max(1, min(self.workers, len(tasks)))
+        pool = ThreadPool(n_workers)
+        try:
+            results = _bounded_imap(pool, _process_chunk, tasks, self.window or 2 * n_workers)
+            with open(output_path, 'wb') as out:
+                central_dir = []
+                for (path, arcname), n_chunks in zip(members, chunk_counts):
+                    central_dir.append(self._write_member(out, path, arcname, results,
+                                                          n_chunks))
+                self._write_central_dir(out, central_dir)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _write_member(self, out, path, arcname, results, n_chunks):
+        """
+        _write_member: write the local header and the data of one member, taking its n_chunks
+        chunks from results as they come, and return its central directory record. The CRC
+        and sizes are only known once the data is written, the local header is then rewritten
+        in place; whether it carries the Zip64 sizes is decided up front from the largest size
+        the data could take.
+        """
+        st = os.stat(path)
+        method = ZIP_DEFLATED if self._member_level(path) > 0 else ZIP_STORED
+        dos_time, dos_date = _dos_date_time(st.st_mtime)
+        try:
+            name = arcname.encode('ascii')
+            flags = 0
+        except UnicodeError:
+            name = arcname.encode('utf-8')
+            flags = 0x800
+        max_size = st.st_size
+        if method == ZIP_DEFLATED:
+            # deflate may expand incompressible data slightly, plus the flush of each chunk
+            max_size += (st.st_size >> 10) + 64 * n_chunks
+        zip64 = max_size >= ZIP64_LIMIT
+
+        header_offset = out.tell()
+        self._write_local_header(out, name, flags, method, dos_time, dos_date, 0, 0, 0, zip64)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        with open(path, 'rb') as src:
+            for _ in range(n_chunks):
+                tmp_path, chunk_crc, chunk_size, chunk_comp_size = next(results)
+                crc = crc32_combine(crc, chunk_crc, chunk_size)
+                file_size += chunk_size
+                compress_size += chunk_comp_size
+                if tmp_path is None:
+                    _copy_bytes(src, out, chunk_size)
+                else:
+                    with open(tmp_path, 'rb') as chunk:
+                        shutil.copyfileobj(chunk, out, READ_BUF_SIZE)
+                    os.remove(tmp_path)
+        data_end = out.tell()
+        out.seek(header_offset)
+        self._write_local_header(out, name, flags, method, dos_time, dos_date, crc,
+                                 file_size, compress_size, zip64)
+        out.seek(data_end)
+
+        return {'name': name, 'flags': flags, 'method': method, 'crc': crc,
+                'dos_time': dos_time, 'dos_date': dos_date, 'file_size': file_size,
+                'compress_size': compress_size, 'header_offset': header_offset,
+                'external_attr': (st.st_mode & 0xFFFF) << 16}
+
+    def _write_local_header(self, out, name, flags, method, dos_time, dos_date, crc,
+                            file_size, compress_size, zip64):
+        extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size) if zip64 else b''
+        version = 45 if zip64 else (20 if method == ZIP_DEFLATED else 10)
+        out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, version, flags, method,
+                              dos_time, dos_date, crc,
+                              ZIP64_LIMIT if zip64 else compress_size,
+                              ZIP64_LIMIT if zip64 else file_size,
+                              len(name), len(extra)))
+        out.write(name)
+        out.write(extra)
+
+    def _write_central_dir(self, out, central_dir):
+        cd_offset = out.tell()
+        for rec in central_dir:
+            zip64_fields = []
+            file_size = rec['file_size']
+            compress_size = rec['compress_size']
+            header_offset = rec['header_offset']
+            if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+                zip64_fields += [file_size, compress_size]
+                file_size = compress_size = ZIP64_LIMIT
+            if header_offset >= ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP64_LIMIT
+            extra = b''
+            if zip64_fields:
+                extra = struct.pack('<HH' + 'Q' * len(zip64_fields), 1,
+                                    8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields else (20 if rec['method'] == ZIP_DEFLATED else 10)
+            out.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version,
+                                  version, rec['flags'], rec['method'], rec['dos_time'],
+                                  rec['dos_date'], rec['crc'], compress_size, file_size,
+                                  len(rec['name']), len(extra), 0, 0, 0,
+                                  rec['external_attr'], header_offset))
+            out.write(rec['name'])
+            out.write(extra)
+        cd_size = out.tell() - cd_offset
+        n_entries = len(central_dir)
+
+        if (n_entries > ZIP_FILECOUNT_LIMIT or cd_offset >= ZIP64_LIMIT or
+                cd_size >= ZIP64_LIMIT):
+            zip64_eocd_offset = out.tell()
+            out.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                                  n_entries, n_entries, cd_size, cd_offset))
+            out.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_eocd_offset, 1))
+        out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                              min(n_entries, ZIP_FILECOUNT_LIMIT),
+                              min(n_entries, ZIP_FILECOUNT_LIMIT),
+                              min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0))
@@ -2,8 +2,14 @@
 import unittest
 import os  # noqa: F401
 import json  # noqa: F401
+import math
+import random
 import time
 import shutil
+import gzip
+import zipfile
+import tempfile
+import threading
 
 from os import environ
 try:
@@ -22,6 +28,29 @@ from installed_clients.AssemblyUtilClient import AssemblyUtil
 
 from MaSuRCA.core.masurca_assembler import MaSuRCA_Assembler
 from MaSuRCA.core.masurca_utils import masurca_utils
+from MaSuRCA.core.task_graph import TaskGraph
+from MaSuRCA.core.reads_cache import ReadsCache
+from MaSuRCA.core.read_stats import ReadStatsEstimator, kmer_hash_array
+from MaSuRCA.core.zip_packager import ZipPackager
+from MaSuRCA.core.reads_compression import ReadsFormatNormalizer, BGZF_EOF
+from MaSuRCA.core.resource_forecast import (forecast_scratch, scratch_suggestions, fit_memory,
+                                            memory_limit_bytes)
+from MaSuRCA.core.assemble_stages import (StageTracker, detect_stage, detect_checkpoints,
+                                           prepare_resume, save_checkpoints, load_checkpoints)
+from MaSuRCA.core.progress_log import (ProgressLog, parse_percent, load_progress,
+                                         find_running_progress, PROGRESS_SNAPSHOT_FILE)
+from MaSuRCA.core.watchdog import Watchdog, parse_stage_timeouts
+from MaSuRCA.core.kmer_spectrum import (analyze_spectrum, choose_k, KmerSpectrumTuner,
+                                         count_kmer_histogram)
+from MaSuRCA.core.Program_Runner import Program_Runner
+from MaSuRCA.core.sweep import (validate_variants, share_groups, link_shared_outputs,
+                                SharedStagesDone)
+from MaSuRCA.core.service_clients import build_client
+from local_services import LocalServices
+from installed_clients.WorkspaceClient import Workspace
+from installed_clients.KBaseReportClient import KBaseReport
+from installed_clients.kb_quastClient import kb_quast
+from installed_clients.baseclient import ServerError
 
 
 class MaSuRCATest(unittest.TestCase):
@@ -93,6 +122,12 @@ class MaSuRCATest(unittest.TestCase):
     def getContext(self):
         return self.__class__.ctx
 
+    def getMaSuRCAUtils(self, name):
+        # a project dir and utils of its own, so that a test leaves no state to the others and
+        # can run again on the same scratch
+        prj_dir = tempfile.mkdtemp(prefix=name + '_', dir=self.scratch)
+        return prj_dir, masurca_utils(prj_dir, self.cfg)
+
     # NOTE: According to Python unittest naming rules test method names should start from 'test'. # noqa
     def load_fasta_file(self, filename, obj_name, contents):
         f = open(filename, 'w')
@@ -287,6 +322,35 @@ class MaSuRCATest(unittest.TestCase):
             self.assertIn('Failed to generate assemble.sh file!',
                           str(errorContext.exception))
 
+    # @unittest.skip("skipped test_run_masurca_assembler_plan_only")
+    def test_run_masurca_assembler_plan_only(self):
+        pe_lib_ref = self.loadPairedEndReads(
+            '../test/testReads/small.forward.fq',
+            '../test/testReads/small.reverse.fq', 'small')
+        m_params = {
+            'workspace_name': self.getWsName(),
+            'reads_libraries': [{
+                "pe_id": pe_lib_ref,
+                "pe_prefix": "p1",
+                "pe_mean": 180,
+                "pe_stdev": 20
+            }],
+            "output_contigset_name": "masurca.contigs",
+            'num_threads': 4,
+            'plan_only': 1
+        }
+        output = self.getImpl().run_masurca_assembler(self.getContext(), m_params)[0]
+        self.assertIsNone(output['report_ref'])
+        plan = output['plan']
+        self.assertGreater(plan['total_bases'], 0)
+        self.assertEqual(plan['num_threads'], 4)
+        self.assertIn('PE= p1 180 20 ', plan['config'])
+        self.assertIn('JF_SIZE={}'.format(plan['jf_size']), plan['config'])
+        self.assertGreater(plan['cpu_hours'], 0)
+        self.assertLess(plan['wall_hours'], plan['cpu_hours'])
+        self.assertEqual(plan['memory_bytes'], plan['memory']['peak'])
+        self.assertEqual(plan['disk_bytes'], plan['disk']['total'])
+
     # @unittest.skip("skipped test_masurca_utils_validate_params")
     def test_masurca_utils_validate_params(self):
         with self.assertRaises(ValueError) as errorContext:
@@ -297,22 +361,13 @@ class MaSuRCATest(unittest.TestCase):
                  'output_contigset_name': 'masurca.contigs'})
         self.assertIn('reads_libraries parameter is mandatory',
                       str(errorContext.exception))
-        with self.assertRaises(ValueError) as errorContext:
-            self.masurca_utils.validate_params(
-                {'workspace_name': self.getWsName(),
-                 'reads_libraries': [{'pe_id': '1/fake/3'}],
-                 'jf_size': 100000000,
-                 'output_contigset_name': 'masurca.contigs'})
-        self.assertIn('num_threads parameter is mandatory',
-                      str(errorContext.exception))
-        with self.assertRaises(ValueError) as errorContext:
-            self.masurca_utils.validate_params(
-                {'workspace_name': self.getWsName(),
-                 'reads_libraries': [{'pe_id': '1/fake/3'}],
-                 'num_threads': 2,
-                 'output_contigset_name': 'masurca.contigs'})
-        self.assertIn('jf_size parameter is mandatory',
-                      str(errorContext.exception))
+        # num_threads defaults to the available CPUs, jf_size is estimated later from the reads
+        params = self.masurca_utils.validate_params(
+            {'workspace_name': self.getWsName(),
+             'reads_libraries': [{'pe_id': '1/fake/3'}],
+             'output_contigset_name': 'masurca.contigs'})
+        self.assertGreater(params['num_threads'], 0)
+        self.assertIsNone(params.get('jf_size'))
         with self.assertRaises(ValueError) as errorContext:
             self.masurca_utils.validate_params(
                 {'workspace_name': self.getWsName(),
@@ -331,3 +386,766 @@ class MaSuRCATest(unittest.TestCase):
                  'min_length': 100})
             self.assertIn('must be a list',
                           str(errorContext.exception))
+
+    # @unittest.skip("skipped test_masurca_utils_load_stats")
+    def test_masurca_utils_load_stats(self):
+        fa_file = os.path.join(self.scratch, 'load_stats_test.fa')
+        with open(fa_file, 'w') as fa:
+            fa.write('>contig_1 some description\nACGTACGTAC\nGGNNNNNCC\n' +
+                     '>contig_2\nAAAAA\n>contig_3\nGGGCCCNNAT\nNNT\n')
+        fasta_stats = self.masurca_utils._load_stats(fa_file)
+        self.assertEqual(list(fasta_stats), ['contig_1', 'contig_2', 'contig_3'])
+        self.assertEqual(list(fasta_stats.lengths), [19, 5, 13])
+        self.assertEqual(fasta_stats['contig_2'], 5)
+
+        metrics = fasta_stats.summary()
+        self.assertEqual(metrics['total_length'], 37)
+        self.assertEqual(metrics['n50'], 19)
+        self.assertEqual(metrics['l50'], 1)
+        self.assertEqual(metrics['n90'], 5)
+        self.assertEqual(metrics['l90'], 3)
+        self.assertEqual(metrics['n_count'], 9)
+        self.assertEqual(metrics['gap_count'], 3)
+        self.assertEqual(metrics['longest_gap'], 5)
+
+    # @unittest.skip("skipped test_masurca_utils_staging_pool")
+    def test_masurca_utils_staging_pool(self):
+        _, m_utils = self.getMaSuRCAUtils('staging_pool_test')
+        m_utils.staging_workers = 3
+        m_utils._get_object_infos = lambda refs: []
+        # the workers only get past the barrier when the three inputs are staged side by side
+        barrier = threading.Barrier(3, timeout=60)
+        downloaded = []
+
+        def download(ref):
+            barrier.wait()
+            downloaded.append(ref)
+            return {'files': {'fwd': ref + '.fq', 'type': 'single'}, 'sequencing_tech': 'x'}
+
+        def get_fasta(ref):
+            barrier.wait()
+            return {'path': ref + '.fa'}
+
+        m_utils._download_reads_lib = download
+        m_utils._get_fasta_from_assembly = get_fasta
+        m_utils._run_staging_tasks([('reads', '1/2/3'), ('reads', '1/3/1'), ('assembly', 'lr')])
+        self.assertEqual(m_utils.staged_reads['1/3/1']['files']['fwd'], '1/3/1.fq')
+        self.assertEqual(m_utils.staged_fasta['lr'], {'path': 'lr.fa'})
+        self.assertEqual(sorted(m_utils.staging_times), ['1/2/3', '1/3/1', 'lr'])
+        # the staged inputs are served from memory
+        m_utils._run_staging_tasks([('reads', '1/2/3')])
+        self.assertEqual(sorted(downloaded), ['1/2/3', '1/3/1'])
+
+        def fail(ref):
+            raise ValueError('No reads in ' + ref)
+
+        m_utils._download_reads_lib = fail
+        with self.assertRaisesRegex(ValueError, 'No reads in 1/4/1'):
+            m_utils._run_staging_tasks([('reads', '1/4/1')])
+        self.assertNotIn('1/4/1', m_utils.staged_reads)
+
+    # @unittest.skip("skipped test_reads_cache")
+    def test_reads_cache(self):
+        cache_dir = tempfile.mkdtemp(prefix='reads_cache_test_', dir=self.scratch)
+        download_dir = tempfile.mkdtemp(prefix='reads_download_test_', dir=self.scratch)
+
+        def downloaded(name, size):
+            path = os.path.join(download_dir, name + '.fq')
+            with open(path, 'w') as fq:
+                fq.write(name[0] * size)
+            return {'files': {'fwd': path, 'type': 'single'}, 'sequencing_tech': 'x'}
+
+        self.assertEqual(ReadsCache.key_for([7, 'reads', 'type', 'date', 3, 'u', 12]), '12_7_3')
+        cache = ReadsCache(cache_dir, 250)
+        cache.put('1_1_1', downloaded('a', 100))
+        time.sleep(0.01)
+        cache.put('1_2_1', downloaded('b', 100))
+        time.sleep(0.01)
+        # using a makes b the least recently used entry
+        run_dir = os.path.join(download_dir, 'run')
+        record = cache.get('1_1_1', run_dir)
+        self.assertEqual(os.path.dirname(record['files']['fwd']), run_dir)
+        self.assertFalse(os.path.islink(record['files']['fwd']))
+        time.sleep(0.01)
+        cache.put('1_3_1', downloaded('c', 100))
+        self.assertTrue(cache.contains('1_1_1'))
+        self.assertFalse(cache.contains('1_2_1'))
+        self.assertIsNone(cache.get('1_2_1', run_dir))
+        # over the whole budget on its own, not cached
+        cache.put('1_4_1', downloaded('d', 300))
+        self.assertFalse(cache.contains('1_4_1'))
+
+        # the index persists across instances, e.g. the jobs sharing the cache
+        other_job = ReadsCache(cache_dir, 250)
+        self.assertTrue(other_job.contains('1_3_1'))
+        time.sleep(0.01)
+        other_job.put('1_5_1', downloaded('e', 200))
+        self.assertFalse(cache.contains('1_1_1'))
+        # the files of a run outlive the eviction of their entry
+        with open(record['files']['fwd']) as fq:
+            self.assertEqual(fq.read(), 'a' * 100)
+        # the files are copied in and out through tmp dirs of the cache, none left behind
+        self.assertEqual([f for f in os.listdir(cache_dir) if f.startswith('.tmp')], [])
+
+    # @unittest.skip("skipped test_reads_format_normalizer")
+    def test_reads_format_normalizer(self):
+        work_dir = tempfile.mkdtemp(prefix='reads_format_test_', dir=self.scratch)
+        with open('../test/testReads/small.forward.fq', 'rb') as fq:
+            reads = fq.read()
+        gz_path = os.path.join(work_dir, 'fwd.fq.gz')
+        with gzip.open(gz_path, 'wb') as gz:
+            gz.write(reads)
+        # a second link to the staged file, as from the reads cache, keeps it in place
+        os.link(gz_path, os.path.join(work_dir, 'cached.fq.gz'))
+
+        normalizer = ReadsFormatNormalizer(workers=2, batch_blocks=1)
+        plain_dir = os.path.join(work_dir, 'plain')
+        os.makedirs(plain_dir)
+        self.assertEqual(normalizer.plan([gz_path], plain_dir)[0], 'decompress')
+        plain_path = normalizer.normalize([gz_path], plain_dir)[gz_path]
+        self.assertEqual(plain_path, os.path.join(plain_dir, 'fwd.fq'))
+        with open(plain_path, 'rb') as fq:
+            self.assertEqual(fq.read(), reads)
+        self.assertTrue(os.path.isfile(gz_path))
+
+        # short of space, the plain reads are recompressed to BGZF
+        bgzf_dir = os.path.join(work_dir, 'bgzf')
+        os.makedirs(bgzf_dir)
+        self.assertEqual(normalizer.plan([plain_path], bgzf_dir, 10 ** 18)[0], 'compress')
+        bgzf_path = normalizer.normalize([plain_path], bgzf_dir, 10 ** 18)[plain_path]
+        with gzip.open(bgzf_path, 'rb') as gz:
+            self.assertEqual(gz.read(), reads)
+        with open(bgzf_path, 'rb') as bgzf:
+            data = bgzf.read()
+        self.assertEqual(data[12:14], b'BC')
+        self.assertTrue(data.endswith(BGZF_EOF))
+        # the plain file only the run linked to is removed
+        self.assertFalse(os.path.exists(plain_path))
+        # gzipped reads that do not fit uncompressed are kept as they are
+        self.assertEqual(normalizer.normalize([bgzf_path], plain_dir, 10 ** 18),
+                         {bgzf_path: bgzf_path})
+
+    # @unittest.skip("skipped test_masurca_utils_estimate_jf_size")
+    def test_masurca_utils_estimate_jf_size(self):
+        reads_data = [{'fwd_file': '../test/testReads/small.forward.fq',
+                       'rev_file': '../test/testReads/small.reverse.fq'}]
+        _, m_utils = self.getMaSuRCAUtils('estimate_jf_size_test')
+        jf_size = m_utils._estimate_jf_size(reads_data)
+        reads_estimate = m_utils.reads_estimate
+        self.assertGreater(reads_estimate['total_reads'], 0)
+        self.assertGreater(reads_estimate['total_bases'], reads_estimate['total_reads'])
+        self.assertGreater(reads_estimate['read_length']['max'], 0)
+        self.assertEqual(jf_size, reads_estimate['jf_size'])
+        self.assertGreaterEqual(jf_size, 100000000)
+        # the test reads cover their ~230 kb reference about 10x
+        self.assertGreater(reads_estimate['genome_size'], 100000)
+        self.assertLess(reads_estimate['genome_size'], 400000)
+        # a sketch holding a fraction of the k-mers scales to about the same counts
+        sketched = ReadStatsEstimator(max_kmers=20000).estimate(
+            [reads_data[0]['fwd_file'], reads_data[0]['rev_file']])
+        self.assertLess(sketched['sketch_rate'], 0.1)
+        self.assertAlmostEqual(sketched['genome_size'] / float(reads_estimate['genome_size']),
+                               1.0, delta=0.1)
+        # a k-mer and its reverse complement hash the same, k-mers with an N are skipped
+        self.assertEqual(sorted(kmer_hash_array([b'ACGTTGCAAC'], 5).tolist()),
+                         sorted(kmer_hash_array([b'GTTGCAACGT'], 5).tolist()))
+        self.assertEqual(len(kmer_hash_array([b'ACGTNACGTACGT'], 5)), 4)
+
+    # @unittest.skip("skipped test_masurca_utils_profile_reads")
+    def test_masurca_utils_profile_reads(self):
+        prj_dir, m_utils = self.getMaSuRCAUtils('profile_reads_test')
+        reads_data = [{'fwd_file': '../test/testReads/small.forward.fq',
+                       'rev_file': '../test/testReads/small.reverse.fq'}]
+        profile = m_utils._profile_reads({'num_threads': 2}, reads_data,
+                                         m_utils._estimate_reads(reads_data))
+        self.assertTrue(os.path.isfile(os.path.join(prj_dir, 'reads_profile.json')))
+        self.assertGreater(sum(profile['histogram']), 0)
+        # the test reads cover their ~230 kb reference about 10x
+        self.assertGreater(profile['genome_size'], 100000)
+        self.assertLess(profile['genome_size'], 400000)
+        self.assertEqual(profile['verdict'], 'under-sequenced')
+
+        # the profile fills the defaults depending on the genome
+        params = m_utils.validate_params(
+            {'workspace_name': self.getWsName(),
+             'reads_libraries': [{'pe_id': '1/fake/3'}],
+             'output_contigset_name': 'masurca.contigs'},
+            {'genome_size': 5000000, 'total_bases': 500000000, 'verdict': 'ok'})
+        self.assertEqual(params['limit_jump_coverage'], 60)
+        self.assertEqual(params['cgwErrorRate'], 0.25)
+        # and the genome size the JF_SIZE of the bases of all the reads is bounded by
+        m_utils.reads_estimate['total_bases'] = 10 ** 10
+        m_utils.reads_profile = {'genome_size': 10000000}
+        self.assertEqual(m_utils._estimate_jf_size(reads_data), 200000000)
+
+    # @unittest.skip("skipped test_masurca_utils_reduce_reads")
+    def test_masurca_utils_reduce_reads(self):
+        prj_dir, m_utils = self.getMaSuRCAUtils('reduce_reads_test')
+        reads_data = [{'fwd_file': '../test/testReads/small.forward.fq',
+                       'rev_file': '../test/testReads/small.reverse.fq',
+                       'pe_prefix': 'p1', 'reads_name': 'small', 'type': 'paired'}]
+        m_utils._reduce_reads({'reduce_reads': 'normalize', 'target_coverage': 5},
+                              reads_data, [])
+        reduction = m_utils.reads_estimate['reduction']
+        self.assertLess(reduction['bases_kept'], reduction['bases_in'])
+        self.assertTrue(reads_data[0]['fwd_file'].startswith(
+            os.path.join(prj_dir, 'reduced_reads', 'p1')))
+        with open(reads_data[0]['fwd_file']) as fwd, open(reads_data[0]['rev_file']) as rev:
+            self.assertEqual(len(fwd.readlines()), len(rev.readlines()))
+
+        # above normalize_max_bases, the reads are subsampled instead
+        _, m_utils = self.getMaSuRCAUtils('reduce_reads_test')
+        m_utils.normalize_max_bases = 1000000
+        reads_data = [{'fwd_file': '../test/testReads/small.forward.fq',
+                       'rev_file': '../test/testReads/small.reverse.fq',
+                       'pe_prefix': 'p1', 'reads_name': 'small', 'type': 'paired'}]
+        m_utils._reduce_reads({'reduce_reads': 'normalize', 'target_coverage': 5},
+                              reads_data, [])
+        self.assertEqual(m_utils.reads_estimate['reduction']['mode'], 'subsample')
+
+    # @unittest.skip("skipped test_task_graph")
+    def test_task_graph(self):
+        # quast and upload only get past the barrier when they run side by side
+        barrier = threading.Barrier(2, timeout=60)
+
+        def meet(value):
+            barrier.wait()
+            return value
+
+        graph = TaskGraph()
+        graph.add('report', lambda r: r['stats'] + r['quast'], deps=['stats', 'quast'])
+        graph.add('stats', lambda r: 1)
+        graph.add('quast', lambda r: meet(2))
+        graph.add('upload', lambda r: meet(3))
+        self.assertEqual(graph.run(), {'report': 3, 'stats': 1, 'quast': 2, 'upload': 3})
+        self.assertGreaterEqual(graph.timings['report']['start'],
+                                max(graph.timings[t]['end'] for t in ('stats', 'quast')))
+
+        graph = TaskGraph()
+        graph.add('stats', lambda r: 1 / 0)
+        graph.add('report', lambda r: r['stats'], deps=['stats'])
+        with self.assertRaises(ZeroDivisionError):
+            graph.run()
+        self.assertNotIn('report', graph.timings)
+
+        def leave():
+            raise SystemExit(1)
+
+        graph = TaskGraph()
+        graph.add('stats', lambda r: leave())
+        with self.assertRaises(SystemExit):
+            graph.run()
+
+        graph = TaskGraph()
+        graph.add('report', lambda r: 1, deps=['stats'])
+        with self.assertRaises(ValueError) as errorContext:
+            graph.run()
+        self.assertIn('unknown task stats', str(errorContext.exception))
+
+        # two of the 2-core tasks fit in the 4-core budget at a time, the 8-core one runs alone
+        barrier = threading.Barrier(2, timeout=60)
+        graph = TaskGraph()
+        for name in ['a', 'b']:
+            graph.add(name, lambda r: meet(None), resources={'cores': 2})
+        graph.add('c', lambda r: None, resources={'cores': 2})
+        graph.add('big', lambda r: None, resources={'cores': 8})
+        graph.run(budget={'cores': 4})
+        timings = graph.timings
+        self.assertGreaterEqual(timings['c']['start'],
+                                min(timings['a']['end'], timings['b']['end']))
+        self.assertGreaterEqual(timings['big']['start'],
+                                max(timings[t]['end'] for t in ('a', 'b', 'c')))
+
+    # @unittest.skip("skipped test_sweep_variants")
+    def test_sweep_variants(self):
+        variants = validate_variants([{'graph_kmer_size': '41'},
+                                      {'graph_kmer_size': 'auto', 'close_gaps': 1},
+                                      {'name': 'soap', 'soap_assembly': 1}])
+        self.assertEqual(variants, [('k41', {'graph_kmer_size': 41}),
+                                    ('kauto_gaps1', {'graph_kmer_size': 'auto', 'close_gaps': 1}),
+                                    ('soap', {'soap_assembly': 1})])
+        with self.assertRaises(ValueError) as errorContext:
+            validate_variants([{'jf_size': 100000000}])
+        self.assertIn('got jf_size', str(errorContext.exception))
+        with self.assertRaises(ValueError) as errorContext:
+            validate_variants([{'graph_kmer_size': '41'}, {'graph_kmer_size': 41}])
+        self.assertIn('used twice', str(errorContext.exception))
+
+        # the error correction is shared by the variants with the same settings for it
+        self.assertEqual(share_groups({'k31': {'jf_size': 10 ** 8},
+                                       'k41': {'jf_size': 10 ** 8},
+                                       'k51_t2': {'jf_size': 10 ** 8,
+                                                  'kmer_count_threshold': 2}}),
+                         [['k31', 'k41'], ['k51_t2']])
+        done = SharedStagesDone()
+        done.on_line('[date] Creating mer database for Quorum')
+        done.on_line('[date] Error correct PE reads')
+        done.on_line('[date] Estimating genome size')
+        self.assertTrue(done.wait())
+        done = SharedStagesDone()
+        done.on_exit(1, {})
+        self.assertFalse(done.wait())
+
+        sweep_dir = tempfile.mkdtemp(prefix='sweep_test_', dir=self.scratch)
+        src_dir = os.path.join(sweep_dir, 'k31')
+        dst_dir = os.path.join(sweep_dir, 'k41')
+        os.makedirs(src_dir)
+        os.makedirs(dst_dir)
+        for name in ['quorum_mer_db.jf', 'pe.cor.fa']:
+            with open(os.path.join(src_dir, name), 'w') as f:
+                f.write('>r\nACGT\n')
+        # without a recognized output line, the outputs tell the shared stages are done:
+        # those of the shared stages once the run exited cleanly
+        done = SharedStagesDone(src_dir, poll_interval=0.1)
+        done.on_line('some other wording of the steps')
+        done.on_exit(0, {})
+        self.assertTrue(done.wait())
+        # and those of a later stage while it runs
+        done = SharedStagesDone(src_dir, poll_interval=0.1)
+        threading.Timer(0.3, lambda: open(os.path.join(src_dir, 'k_u_hash_0'), 'w').close()
+                        ).start()
+        self.assertTrue(done.wait())
+        os.remove(os.path.join(src_dir, 'k_u_hash_0'))
+        self.assertEqual(sorted(link_shared_outputs(src_dir, dst_dir)),
+                         ['pe.cor.fa', 'quorum_mer_db.jf'])
+        self.assertTrue(os.path.isfile(os.path.join(dst_dir, 'pe.cor.fa')))
+        # outputs already there are left alone
+        self.assertEqual(link_shared_outputs(src_dir, dst_dir), [])
+
+    # @unittest.skip("skipped test_local_services")
+    def test_local_services(self):
+        services = LocalServices(tempfile.mkdtemp(prefix='local_services_', dir=self.scratch))
+        url = services.start()
+        try:
+            reads_ref = ReadsUtils(url).upload_reads(
+                {'fwd_file': '../test/testReads/small.forward.fq',
+                 'rev_file': '../test/testReads/small.reverse.fq',
+                 'wsname': 'local', 'name': 'small'})['obj_ref']
+            info = Workspace(url).get_object_info3(
+                {'objects': [{'ref': 'local/small'}]})['infos'][0]
+            self.assertEqual(self.make_ref(info), reads_ref)
+            self.assertIn('PairedEndLibrary', info[2])
+            data = Workspace(url).get_objects2(
+                {'objects': [{'ref': reads_ref}]})['data'][0]['data']
+            self.assertEqual(data['lib1']['size'],
+                             os.path.getsize('../test/testReads/small.forward.fq'))
+
+            reads = ReadsUtils(url).download_reads(
+                {'read_libraries': [reads_ref], 'interleaved': 'false'})['files'][reads_ref]
+            self.assertEqual(reads['files']['type'], 'paired')
+            self.assertEqual(os.path.getsize(reads['files']['rev']),
+                             os.path.getsize('../test/testReads/small.reverse.fq'))
+            with self.assertRaises(ServerError) as errorContext:
+                ReadsUtils(url).download_reads({'read_libraries': ['local/missing']})
+            self.assertIn('No object with name or id missing', str(errorContext.exception))
+
+            assembly_ref = AssemblyUtil(url).save_assembly_from_fasta(
+                {'file': {'path': '../test/testReads/test_reference.fa'},
+                 'workspace_name': 'local', 'assembly_name': 'reference'})
+            fasta = AssemblyUtil(url).get_assembly_as_fasta({'ref': assembly_ref})
+            self.assertTrue(os.path.isfile(fasta['path']))
+            quastret = kb_quast(url).run_QUAST(
+                {'files': [{'path': fasta['path'], 'label': 'reference'}]})
+            self.assertTrue(os.path.isfile(os.path.join(quastret['quast_path'], 'report.html')))
+            report = KBaseReport(url).create_extended_report(
+                {'message': 'local run', 'workspace_name': 'local',
+                 'objects_created': [{'ref': assembly_ref, 'description': 'contigs'}]})
+            self.assertEqual(Workspace(url).get_objects2(
+                {'objects': [{'ref': report['ref']}]})['data'][0]['data']['message'],
+                'local run')
+
+            # the asynchronous jobs are dropped once reported finished
+            job_id = services.call('Workspace._get_object_info3_submit',
+                                   [{'objects': [{'ref': reads_ref}]}])[0]
+            while not services.call('Workspace._check_job', [job_id])[0]['finished']:
+                time.sleep(0.1)
+            self.assertNotIn(job_id, services.jobs)
+        finally:
+            services.stop()
+
+    # @unittest.skip("skipped test_service_clients")
+    def test_service_clients(self):
+        services = LocalServices(tempfile.mkdtemp(prefix='service_clients_', dir=self.scratch))
+        url = services.start()
+        try:
+            reads_ref = build_client(ReadsUtils, url).upload_reads(
+                {'fwd_file': '../test/testReads/small.forward.fq',
+                 'wsname': 'local', 'name': 'small'})['obj_ref']
+            ws = build_client(Workspace, url, pool_maxsize=2)
+            start_connections = services.connections
+
+            def get_info():
+                for _ in range(5):
+                    ws.get_object_info3({'objects': [{'ref': reads_ref}]})
+
+            workers = [threading.Thread(target=get_info) for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            # the 20 calls from 4 threads share the 2 pooled connections
+            self.assertLessEqual(services.connections - start_connections, 2)
+            with self.assertRaises(ServerError) as errorContext:
+                ws.get_object_info3({'objects': [{'ref': 'local/missing'}]})
+            self.assertIn('No object with name or id missing', str(errorContext.exception))
+            ws._client.close()
+
+            ws = build_client(Workspace, url, keep_alive=False)
+            start_connections = services.connections
+            get_info()
+            self.assertEqual(services.connections - start_connections, 5)
+
+            # the asynchronous jobs are polled on a jittered backoff, reported to on_poll
+            polls = []
+            ru = build_client(ReadsUtils, url, on_poll=lambda job_id, state: polls.append(
+                (job_id, state['finished'] if state else None)))
+            reads = ru.download_reads({'read_libraries': [reads_ref],
+                                       'interleaved': 'false'})['files'][reads_ref]
+            self.assertEqual(reads['files']['type'], 'single')
+            self.assertEqual(polls[-1][1], 1)
+            self.assertEqual(len(set(job_id for job_id, _ in polls)), 1)
+            self.assertNotIn(polls[-1][0], services.jobs)
+            waits = ru._client._job_check_waits()
+            bases = [0.1, 0.15, 0.225, 0.3375]
+            for base, wait in zip(bases, [next(waits) for _ in bases]):
+                self.assertGreater(wait, base * 0.5 - 1e-9)
+                self.assertLessEqual(wait, base)
+            capped = build_client(ReadsUtils, url, async_job_check_max_time_ms=200)
+            waits = capped._client._job_check_waits()
+            self.assertLessEqual(max(next(waits) for _ in range(10)), 0.2)
+        finally:
+            services.stop()
+
+    # @unittest.skip("skipped test_masurca_utils_resource_summary")
+    def test_masurca_utils_resource_summary(self):
+        prj_dir, m_utils = self.getMaSuRCAUtils('resource_summary_test')
+        m_utils.prog_runner.sample_interval = 0.1
+        assemble_file = os.path.join(prj_dir, 'assemble.sh')
+        with open(assemble_file, 'w') as assemble_sh:
+            assemble_sh.write("echo 'Creating mer database'\nsleep 0.5\n")
+        self.assertEqual(m_utils.run_assemble(assemble_file), 0)
+        with open(os.path.join(prj_dir, 'resource_summary.json')) as summary_file:
+            summary = json.load(summary_file)
+        self.assertEqual(summary, m_utils.assemble_resources)
+        self.assertEqual(summary['exit_code'], 0)
+        self.assertGreater(summary['wall_seconds'], 0)
+        self.assertGreater(summary['peak_rss_bytes'], 0)
+        self.assertGreater(summary['peak_pss_bytes'], 0)
+        self.assertLessEqual(summary['peak_pss_bytes'], summary['peak_rss_bytes'])
+        self.assertGreater(summary['samples'], 0)
+        with open(summary['series_file']) as series:
+            self.assertTrue(series.readline().startswith('time\telapsed\tprocesses'))
+
+        # a descendant outliving the command keeps its output open, which is not waited for
+        runner = Program_Runner('/bin/bash', self.scratch)
+        runner.output_drain_seconds = 1
+        lines = []
+
+        class _Collect(object):
+            def on_start(self, pid):
+                pass
+
+            def on_line(self, line):
+                lines.append(line)
+
+            def on_exit(self, exit_code, summary):
+                pass
+
+        start = time.time()
+        exit_code, _ = runner.run_with_summary(['/bin/bash', '-c', 'sleep 20 & echo started'],
+                                               self.scratch, output_handlers=[_Collect()])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(lines, ['started'])
+        self.assertLess(time.time() - start, 10)
+
+    # @unittest.skip("skipped test_stage_tracker")
+    def test_stage_tracker(self):
+        self.assertEqual(detect_stage('[Mon Jan 1] Creating mer database for Quorum.'),
+                         'jellyfish')
+        self.assertEqual(detect_stage('ctgcns -g genome.gkpStore -t genome.tigStore 1'),
+                         'ca_consensus')
+        self.assertIsNone(detect_stage('processed 1200 of 5000 reads'))
+
+        checkpoint_dir = tempfile.mkdtemp(prefix='stage_tracker_test_', dir=self.scratch)
+        tracker = StageTracker(checkpoint_dir=checkpoint_dir)
+        tracker.on_start(None)
+        for line in ['[date] Creating mer database for Quorum.', 'processed 50 of 200 reads',
+                     '[date] Error correct PE reads', 'overlapInCore -G --hashbits 22',
+                     'utgcns -g genome.gkpStore', 'cgw -j 1 -k 5', 'ctgcns -g genome.gkpStore']:
+            tracker.on_line(line)
+        # the stages left so far are checkpointed as the run goes
+        self.assertEqual(load_checkpoints(checkpoint_dir),
+                         ['jellyfish', 'error_correction', 'ca_overlap', 'ca_consensus'])
+        tracker.on_exit(0, {'cpu_seconds': 4.0})
+
+        table = tracker.table()
+        self.assertEqual([e['stage'] for e in table],
+                         ['startup', 'jellyfish', 'error_correction', 'ca_overlap',
+                          'ca_consensus', 'ca_scaffold'])
+        # consensus ran before and after scaffolding, its segments add up
+        consensus = table[4]
+        self.assertEqual(consensus['segments'], 2)
+        self.assertEqual(consensus['cpu_seconds'], 4.0)
+        self.assertTrue(all(e['wall_seconds'] >= 0 for e in table))
+        lines = tracker.format_table().split('\n')
+        self.assertEqual(lines[0].split(), ['Stage', 'Wall', '(s)', 'CPU', '(s)', 'Runs'])
+        self.assertEqual(lines[5].split()[0], 'ca_consensus')
+        self.assertEqual(lines[5].split()[-1], '2')
+        self.assertEqual(load_checkpoints(checkpoint_dir),
+                         ['jellyfish', 'error_correction', 'ca_overlap', 'ca_consensus',
+                          'ca_scaffold'])
+
+        # the stages of the output of an assemble.sh run with its runCA steps, in order
+        with open(os.path.join('../test/testLogs', 'assemble_sh.log')) as log_file:
+            stages = [detect_stage(line) for line in log_file]
+        seen = []
+        for stage in stages:
+            if stage is not None and (not seen or seen[-1] != stage):
+                seen.append(stage)
+        self.assertEqual(seen, ['read_stats', 'jellyfish', 'error_correction', 'genome_size',
+                                'k_unitigs', 'super_reads', 'ca_overlap', 'ca_unitig',
+                                'ca_consensus', 'ca_scaffold', 'ca_consensus', 'ca_scaffold',
+                                'gap_closing', 'done'])
+
+    # @unittest.skip("skipped test_resume_checkpoints")
+    def test_resume_checkpoints(self):
+        prj_dir = tempfile.mkdtemp(prefix='resume_test_', dir=self.scratch)
+
+        def touch(*paths):
+            for path in paths:
+                f_path = os.path.join(prj_dir, path)
+                if not os.path.isdir(os.path.dirname(f_path)):
+                    os.makedirs(os.path.dirname(f_path))
+                open(f_path, 'w').close()
+
+        self.assertEqual(detect_checkpoints(prj_dir), ([], 'read_stats'))
+        # a run stopped in CA consensus, having skipped mega_reads without long reads
+        touch('quorum_mer_db.jf', 'pe.cor.fa', 'k_u_hash_0',
+              'guillaumeKUnitigsAtLeast32bases_all.fasta', 'work1/superReadSequences.fasta',
+              'CA/genome.ovlStore/store', 'CA/4-unitigger/unitigger.success',
+              'CA/5-consensus/consensus.sh')
+        pre_ca = ['read_stats', 'jellyfish', 'error_correction', 'genome_size', 'k_unitigs',
+                  'super_reads']
+        save_checkpoints(prj_dir, pre_ca + ['ca_overlap', 'ca_unitig'])
+        self.assertEqual(detect_checkpoints(prj_dir),
+                         (pre_ca + ['ca_overlap', 'ca_unitig'], 'ca_consensus'))
+        # runCA resumes the CA stages itself, their partial outputs are left to it
+        self.assertEqual(prepare_resume(prj_dir)[1], 'ca_consensus')
+        self.assertTrue(os.path.isfile(os.path.join(prj_dir, 'CA/5-consensus/consensus.sh')))
+
+        # a checkpointed stage whose output is gone is redone, with the stages after it
+        os.remove(os.path.join(prj_dir, 'pe.cor.fa'))
+        self.assertEqual(prepare_resume(prj_dir), (['read_stats', 'jellyfish'],
+                                                   'error_correction'))
+        self.assertEqual(load_checkpoints(prj_dir), ['read_stats', 'jellyfish'])
+        for path in ['k_u_hash_0', 'guillaumeKUnitigsAtLeast32bases_all.fasta',
+                     'work1/superReadSequences.fasta']:
+            self.assertFalse(os.path.exists(os.path.join(prj_dir, path)))
+        for path in ['quorum_mer_db.jf', 'CA/genome.ovlStore/store',
+                     'CA/4-unitigger/unitigger.success']:
+            self.assertTrue(os.path.exists(os.path.join(prj_dir, path)))
+
+    # @unittest.skip("skipped test_scratch_forecast")
+    def test_scratch_forecast(self):
+        ca_run = forecast_scratch(10 ** 10, 10 ** 9, reads_bytes=6 * 10 ** 9)
+        soap_run = forecast_scratch(10 ** 10, 10 ** 9, reads_bytes=6 * 10 ** 9,
+                                    soap_assembly=True)
+        self.assertEqual(ca_run['reads'], 6 * 10 ** 9)
+        self.assertIn('ca_stores', ca_run)
+        self.assertNotIn('ca_stores', soap_run)
+        self.assertLess(soap_run['total'], ca_run['total'])
+        self.assertEqual(ca_run['total'], sum(v for k, v in ca_run.items() if k != 'total'))
+
+        suggestions = scratch_suggestions(10 ** 10, 10 ** 9, soap_run['total'],
+                                          reads_bytes=6 * 10 ** 9, genome_size=10 ** 8)
+        self.assertTrue(suggestions[0].startswith('soap_assembly=1'))
+        self.assertIn('target_coverage=', suggestions[1])
+
+    # @unittest.skip("skipped test_fit_memory")
+    def test_fit_memory(self):
+        self.assertGreater(memory_limit_bytes(), 0)
+        gib = 1024 ** 3
+        # fits as it is
+        self.assertEqual(fit_memory(10 ** 8, 4, 64 * gib, 10 ** 9)[:2], (10 ** 8, 4))
+        # a 16 GB jellyfish hash on a 8 GB node: JF_SIZE goes down first
+        jf_size, threads, forecast = fit_memory(2 * 10 ** 9, 8, 8 * gib, 10 ** 9)
+        self.assertLess(jf_size, 2 * 10 ** 9)
+        self.assertEqual(threads, 8)
+        self.assertLessEqual(forecast['peak'], 8 * gib)
+        # many threads on a small node: the threads go down too
+        jf_size, threads, forecast = fit_memory(10 ** 8, 64, 4 * gib)
+        self.assertLess(threads, 64)
+        self.assertLessEqual(forecast['peak'], 4 * gib)
+
+    # @unittest.skip("skipped test_progress_log")
+    def test_progress_log(self):
+        self.assertEqual(parse_percent('done 45%'), 45.0)
+        self.assertEqual(parse_percent('processed 50 of 200 reads'), 25.0)
+        self.assertIsNone(parse_percent('Creating mer database'))
+
+        log_path = os.path.join(self.scratch, 'test_progress.jsonl')
+        snapshot_path = os.path.join(self.scratch, 'test_progress.json')
+        progress_log = ProgressLog(log_path, snapshot_path)
+        progress_log.on_start(1234)
+        progress_log.on_line('[Mon Jan 1] Creating mer database for Quorum.')
+        progress_log.on_line('processed 50 of 200 reads')
+        snapshot = load_progress(snapshot_path)
+        self.assertEqual(snapshot['state'], 'running')
+        self.assertEqual(snapshot['stage'], 'jellyfish')
+        progress_log.on_exit(0, {'wall_seconds': 1.0})
+        snapshot = load_progress(snapshot_path)
+        self.assertEqual(snapshot['state'], 'finished')
+        self.assertEqual(snapshot['stage_percent'], 25.0)
+        with open(log_path) as log_file:
+            records = [json.loads(line) for line in log_file]
+        self.assertEqual(records[2]['percent'], 25.0)
+        self.assertEqual(records[-1]['event'], 'exit')
+
+        # a snapshot per project dir, a sweep variant's included; only the live runs show
+        scratch = tempfile.mkdtemp(prefix='progress_', dir=self.scratch)
+        runs = {}
+        for name, pid in [('job1', os.getpid()), ('job2/variant1', os.getpid()),
+                          ('job3', None)]:
+            prj_dir = os.path.join(scratch, name)
+            os.makedirs(prj_dir)
+            runs[name] = ProgressLog(os.path.join(prj_dir, 'progress.jsonl'),
+                                     os.path.join(prj_dir, PROGRESS_SNAPSHOT_FILE))
+            runs[name].on_start(pid)
+        runs['job3'].on_exit(1, {})
+        running = find_running_progress(scratch)
+        self.assertEqual(sorted(os.path.relpath(p['project_dir'], scratch) for p in running),
+                         ['job1', 'job2/variant1'])
+
+    # @unittest.skip("skipped test_watchdog")
+    def test_watchdog(self):
+        self.assertEqual(parse_stage_timeouts('ca_overlap:86400, ca_scaffold:600'),
+                         {'ca_overlap': 86400.0, 'ca_scaffold': 600.0})
+        with self.assertRaises(ValueError):
+            parse_stage_timeouts('ca_overlap')
+
+        runner = Program_Runner('/bin/bash', self.scratch)
+        watchdog = Watchdog(stage_timeouts={'jellyfish': 2}, poll_interval=0.5, kill_grace=1)
+        start = time.time()
+        with self.assertRaisesRegex(ValueError, 'stage jellyfish was killed'):
+            runner.run_with_summary(
+                ['/bin/bash', '-c', "echo 'Creating mer database'; trap '' TERM; sleep 60"],
+                self.scratch, output_handlers=[watchdog], new_session=True)
+        self.assertLess(time.time() - start, 30)
+
+    # @unittest.skip("skipped test_kmer_spectrum")
+    def test_kmer_spectrum(self):
+        def poisson(mean, c):
+            return math.exp(c * math.log(mean) - mean - math.lgamma(c + 1))
+
+        def spectrum(depth, genomic, errors, het=0):
+            # Poisson peaks of the genomic and het k-mers over an error tail
+            return [0] + [int(genomic * poisson(depth, c) + het * poisson(depth / 2.0, c) +
+                              errors * 0.5 ** c) for c in range(1, 3 * depth)]
+
+        analysis = analyze_spectrum(spectrum(40, 100000, 200000), 31)
+        self.assertIn(analysis['peak'], (39, 40))
+        self.assertLess(analysis['error_mass'], 0.1)
+        self.assertAlmostEqual(analysis['genome_size'], 100000, delta=5000)
+        self.assertLess(analysis['heterozygosity'], 0.0005)
+        # the half depth peak of a heterozygous genome outgrowing the main one
+        het_analysis = analyze_spectrum(spectrum(40, 50000, 200000, het=120000), 61)
+        self.assertIn(het_analysis['peak'], (39, 40))
+        self.assertGreater(het_analysis['heterozygosity'], 0.002)
+        # too shallow to show a peak
+        self.assertIsNone(analyze_spectrum(spectrum(3, 100000, 200000), 31))
+
+        deeper = analyze_spectrum(spectrum(40, 110000, 300000), 51)
+        self.assertEqual(choose_k([analysis, deeper, None]), 51)
+        self.assertEqual(choose_k([analysis, het_analysis]), 31)
+
+        # the spectra of the first third of the reads, scaled to the depth of all of them
+        rng = random.Random(7)
+        genome = ''.join(rng.choice('ACGT') for _ in range(20000))
+        reads_path = os.path.join(self.scratch, 'kmer_spectrum_reads.fq')
+        with open(reads_path, 'w') as reads_file:
+            for i in range(9000):
+                start = rng.randrange(len(genome) - 100)
+                reads_file.write('@r{}\n{}\n+\n{}\n'.format(
+                    i, genome[start:start + 100], 'I' * 100))
+        tuning = KmerSpectrumTuner(ks=[25, 31], max_bases=300000).tune(
+            [reads_path], 100, total_bases=900000)
+        self.assertEqual(tuning['sampled_bases'], 300000)
+        # about 45x base coverage, 34x k-mer depth at k=25
+        self.assertAlmostEqual(tuning['analyses'][25]['peak_depth'], 34, delta=5)
+
+        # the batches of reads split between 2 processes count all the k-mers once
+        reads_files = ['../test/testReads/small.forward.fq', '../test/testReads/small.reverse.fq']
+        histo, stats = count_kmer_histogram(reads_files, 31, workers=1)
+        self.assertEqual(count_kmer_histogram(reads_files, 31, workers=2), (histo, stats))
+        self.assertEqual(stats['bases'], 2500000)
+        self.assertEqual(sum(c * n for c, n in enumerate(histo)), stats['sampled'][31])
+        self.assertEqual(stats['sampled'][31], stats['positions'][31])
+
+    # @unittest.skip("skipped test_zip_packager")
+    def test_zip_packager(self):
+        src_dir = tempfile.mkdtemp(prefix='zip_packager_test_', dir=self.scratch)
+        contents = {'reads.fq': b'@r\nACGTTGCA\n+\nIIIIIIII\n' * 500,
+                    'reads.fq.gz': gzip.compress(b'@r\nACGT\n+\nIIII\n' * 100),
+                    'empty.txt': b'',
+                    'CA/config.txt': b'JF_SIZE=100000000\n'}
+        members = []
+        for arcname, data in sorted(contents.items()):
+            path = os.path.join(src_dir, arcname)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(data)
+            members.append((path, arcname))
+
+        for level in (6, 0):
+            zip_path = os.path.join(src_dir, 'output_{}.zip'.format(level))
+            # small chunks and window, so that the members span several chunks in flight
+            ZipPackager(compression_level=level, workers=2, chunk_size=1000,
+                        window=3).write(members, zip_path)
+            with zipfile.ZipFile(zip_path) as zip_file:
+                self.assertIsNone(zip_file.testzip())
+                self.assertEqual(sorted(zip_file.namelist()), sorted(contents))
+                for arcname, data in contents.items():
+                    self.assertEqual(zip_file.read(arcname), data)
+                methods = dict((i.filename, i.compress_type) for i in zip_file.infolist())
+            self.assertEqual(methods['reads.fq'],
+                             zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED)
+            self.assertEqual(methods['reads.fq.gz'], zipfile.ZIP_STORED)
+            # the chunk files went with their temporary dir
+            self.assertEqual([f for f in os.listdir(src_dir) if f.startswith('tmp')], [])
+
+    # @unittest.skip("skipped test_masurca_utils_packaging_profiles")
+    def test_masurca_utils_packaging_profiles(self):
+        prj_dir = os.path.join(self.scratch, 'packaging_profile_test')
+        for f in ['config.txt', 'quorum_mer_db.jf', 'CA/final.genome.scf.fasta',
+                  'CA/genome.gkpStore/info', 'CA/9-terminator/genome.scf.fasta']:
+            f_path = os.path.join(prj_dir, f)
+            if not os.path.exists(os.path.dirname(f_path)):
+                os.makedirs(os.path.dirname(f_path))
+            with open(f_path, 'w') as f_out:
+                f_out.write('>c1\nACGT\n')
+
+        def selected(profile):
+            return sorted(arc for _, arc in
+                          self.masurca_utils._select_output_files(prj_dir, profile))
+
+        self.assertEqual(selected('minimal'),
+                         ['packaging_profile_test/CA/final.genome.scf.fasta',
+                          'packaging_profile_test/config.txt'])
+        self.assertEqual(selected('standard'),
+                         ['packaging_profile_test/CA/9-terminator/genome.scf.fasta',
+                          'packaging_profile_test/CA/final.genome.scf.fasta',
+                          'packaging_profile_test/config.txt'])
+        self.assertEqual(len(selected('full')), 5)
+        with self.assertRaises(ValueError) as errorContext:
+            selected('everything')
+        self.assertIn('Unknown packaging profile', str(errorContext.exception))
+
+        # the zip file is written next to the project dir, out of the tree being packaged
+        m_utils = self.masurca_utils.for_project(prj_dir)
+        zip_path = m_utils._generate_output_file_list('minimal')[0]['path']
+        self.assertFalse(os.path.abspath(zip_path).startswith(os.path.abspath(prj_dir) + os.sep))
+        with zipfile.ZipFile(zip_path) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()),
+                             ['packaging_profile_test/CA/final.genome.scf.fasta',
+                              'packaging_profile_test/config.txt'])
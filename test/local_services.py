@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for the KBase services this module calls, backed by a directory of the local
+file system, so that the pipeline can run end to end (e.g. for benchmarks and profiling)
+without live services. Point both workspace-url and SDK_CALLBACK_URL at the server:
+
+    PYTHONPATH=../lib python local_services.py add-reads /tmp/kb ws reads r_1.fq r_2.fq
+    PYTHONPATH=../lib python local_services.py serve /tmp/kb --port 5000
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import gzip
+import shutil
+import argparse
+import threading
+import traceback
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler  # py3
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler  # py2
+    from SocketServer import ThreadingMixIn
+
+from MaSuRCA.core.reads_cache import link_or_copy
+from MaSuRCA.core.fasta_stats import FastaScanner
+
+PAIRED_READS_TYPE = 'KBaseFile.PairedEndLibrary-2.0'
+SINGLE_READS_TYPE = 'KBaseFile.SingleEndLibrary-2.0'
+ASSEMBLY_TYPE = 'KBaseGenomeAnnotations.Assembly-6.0'
+REPORT_TYPE = 'KBaseReport.Report-3.0'
+
+
+def _fastq_counts(path):
+    """
+    _fastq_counts: the (reads, bases) of a plain or gzipped FASTQ file
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    reads = bases = 0
+    with opener(path, 'rb') as fq:
+        for i, line in enumerate(fq):
+            if i % 4 == 1:
+                reads += 1
+                bases += len(line.rstrip())
+    return reads, bases
+
+
+def _export_fastq(src, dst):
+    """
+    _export_fastq: write the stored FASTQ file src as the plain FASTQ file dst
+    """
+    if not src.endswith('.gz'):
+        link_or_copy(src, dst)
+        return
+    with gzip.open(src, 'rb') as fq_in, open(dst, 'wb') as fq_out:
+        shutil.copyfileobj(fq_in, fq_out, 1024 * 1024)
+
+
+class LocalRegistry(object):
+    """
+    LocalRegistry: a minimal workspace kept under root: registry.json indexes the workspaces
+    and the versions of their objects, each with its object_info and data, and the files of
+    the objects are kept under root/files. The index is rewritten atomically on each save.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.index_path = os.path.join(self.root, 'registry.json')
+        self.lock = threading.RLock()
+        for sub in ('files', 'downloads'):
+            if not os.path.isdir(os.path.join(self.root, sub)):
+                os.makedirs(os.path.join(self.root, sub))
+
+    def _read(self):
+        if not os.path.isfile(self.index_path):
+            return {'workspaces': {}, 'objects': {}}
+        with open(self.index_path) as index_file:
+            return json.load(index_file)
+
+    def _write(self, index):
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.rename(tmp_path, self.index_path)
+
+    def create_workspace(self, wsname):
+        with self.lock:
+            index = self._read()
+            if wsname not in index['workspaces']:
+                index['workspaces'][wsname] = {'id': len(index['workspaces']) + 1,
+                                               'objects': {}}
+                self._write(index)
+            return index['workspaces'][wsname]['id']
+
+    def delete_workspace(self, wsname):
+        with self.lock:
+            index = self._read()
+            ws = index['workspaces'].pop(wsname, None)
+            if ws:
+                prefix = '{}/'.format(ws['id'])
+                for key in [k for k in index['objects'] if k.startswith(prefix)]:
+                    del index['objects'][key]
+                self._write(index)
+
+    def file_dir(self):
+        """
+        file_dir: a new directory for the files of an object
+        """
+        path = os.path.join(self.root, 'files', str(uuid.uuid4()))
+        os.makedirs(path)
+        return path
+
+    def save_object(self, wsname, name, obj_type, data, meta=None):
+        """
+        save_object: save data as a new version of the object name, returning its
+        object_info
+        """
+        self.create_workspace(wsname)
+        with self.lock:
+            index = self._read()
+            ws = index['workspaces'][wsname]
+            obj_id = ws['objects'].get(name, None) or len(ws['objects']) + 1
+            ws['objects'][name] = obj_id
+            version = 1 + max([int(k.split('/')[2]) for k in index['objects']
+                               if k.startswith('{}/{}/'.format(ws['id'], obj_id))] or [0])
+            info = [obj_id, name, obj_type, time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime()),
+                    version, 'local', ws['id'], wsname, uuid.uuid4().hex,
+                    len(json.dumps(data)), meta or {}]
+            index['objects']['{}/{}/{}'.format(ws['id'], obj_id, version)] = {
+                'info': info, 'data': data}
+            self._write(index)
+            return info
+
+    def get_object(self, ref):
+        """
+        get_object: the {'info', 'data'} of a 'ws/obj[/ver]' ref, by name or id; the last
+        version when none is given
+        """
+        parts = ref.split(';')[-1].strip().split('/')
+        if len(parts) not in (2, 3):
+            raise ValueError('Invalid object reference {}'.format(ref))
+        with self.lock:
+            index = self._read()
+        ws = index['workspaces'].get(parts[0], None)
+        if ws is None:
+            ws = ([w for w in index['workspaces'].values() if str(w['id']) == parts[0]] or
+                  [None])[0]
+        if ws is None:
+            raise ValueError('No workspace with name or id {}'.format(parts[0]))
+        obj_id = ws['objects'].get(parts[1], None) or (
+            int(parts[1]) if parts[1].isdigit() else None)
+        versions = sorted(int(k.split('/')[2]) for k in index['objects']
+                          if k.startswith('{}/{}/'.format(ws['id'], obj_id)))
+        if not versions:
+            raise ValueError('No object with name or id {} in workspace {}'.format(
+                parts[1], parts[0]))
+        version = int(parts[2]) if len(parts) == 3 else versions[-1]
+        key = '{}/{}/{}'.format(ws['id'], obj_id, version)
+        if key not in index['objects']:
+            raise ValueError('No version {} of object {}'.format(version, ref))
+        return index['objects'][key]
+
+    def add_reads(self, wsname, name, fwd_file, rev_file=None, sequencing_tech='Illumina'):
+        """
+        add_reads: save FASTQ files as a paired-end (with rev_file) or single-end reads
+        library, returning its object_info
+        """
+        obj_dir = self.file_dir()
+        data = {'sequencing_tech': sequencing_tech, 'single_genome': 1, 'interleaved': 0,
+                'read_count': 0, 'total_bases': 0}
+        libs = [('lib1', fwd_file), ('lib2', rev_file)] if rev_file else [('lib', fwd_file)]
+        for lib, path in libs:
+            stored = os.path.join(obj_dir, os.path.basename(path))
+            link_or_copy(os.path.abspath(path), stored)
+            reads, bases = _fastq_counts(stored)
+            data['read_count'] += reads
+            data['total_bases'] += bases
+            data[lib] = {'file': {'file_name': os.path.basename(path), 'path': stored},
+                         'size': os.path.getsize(stored), 'type': 'fq'}
+        return self.save_object(wsname, name, PAIRED_READS_TYPE if rev_file else
+                                SINGLE_READS_TYPE, data)
+
+    def add_assembly(self, wsname, name, fasta_file):
+        """
+        add_assembly: save a FASTA file as an assembly, returning its object_info
+        """
+        stored = os.path.join(self.file_dir(), os.path.basename(fasta_file))
+        link_or_copy(os.path.abspath(fasta_file), stored)
+        stats = FastaScanner().scan(stored).summary()
+        data = {'assembly_id': name, 'dna_size': stats['total_length'],
+                'num_contigs': stats['contig_count'], 'gc_content': stats['gc_content'],
+                'fasta_path': stored}
+        return self.save_object(wsname, name, ASSEMBLY_TYPE, data)
+
+
+def ref_of(info):
+    return '{}/{}/{}'.format(info[6], info[0], info[4])
+
+
+class LocalServices(object):
+    """
+    LocalServices: the subset of the Workspace, ReadsUtils, AssemblyUtil, KBaseReport and
+    kb_quast methods this module calls, served as JSON-RPC 1.1 over HTTP on top of a
+    LocalRegistry. The SDK methods are also served as the asynchronous jobs of a callback
+    server (_<method>_submit and _check_job), each job running on a thread of its own and
+    dropped once _check_job has reported it finished. The connections are kept alive
+    (HTTP/1.1), and counted in connections.
+    """
+
+    def __init__(self, root, host='127.0.0.1', port=0):
+        self.registry = LocalRegistry(root)
+        self.methods = {
+            'Workspace.create_workspace': self.create_workspace,
+            'Workspace.delete_workspace': self.delete_workspace,
+            'Workspace.get_object_info3': self.get_object_info3,
+            'Workspace.get_object_info_new': self.get_object_info_new,
+            'Workspace.get_objects2': self.get_objects2,
+            'ReadsUtils.download_reads': self.download_reads,
+            'ReadsUtils.upload_reads': self.upload_reads,
+            'AssemblyUtil.save_assembly_from_fasta': self.save_assembly_from_fasta,
+            'AssemblyUtil.get_assembly_as_fasta': self.get_assembly_as_fasta,
+            'KBaseReport.create_extended_report': self.create_extended_report,
+            'kb_quast.run_QUAST': self.run_QUAST,
+        }
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.connections = 0
+        self.server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self.server.services = self
+        self.url = 'http://{}:{}'.format(host, self.server.server_port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def call(self, method, params):
+        """
+        call: dispatch a JSON-RPC call and return its result list
+        """
+        if method.endswith('._check_job'):
+            return [self._check_job(params[0])]
+        service, _, name = method.partition('.')
+        if name.startswith('_') and name.endswith('_submit'):
+            return [self._submit('{}.{}'.format(service, name[1:-len('_submit')]), params)]
+        if method not in self.methods:
+            raise ValueError('No method {} in the local services'.format(method))
+        return [self.methods[method](*params)]
+
+    def _submit(self, method, params):
+        if method not in self.methods:
+            raise ValueError('No method {} in the local services'.format(method))
+        job_id = str(uuid.uuid4())
+        job = {'finished': False, 'result': None, 'error': None}
+        with self.jobs_lock:
+            self.jobs[job_id] = job
+
+        def run():
+            try:
+                job['result'] = [self.methods[method](*params)]
+            except Exception as e:
+                job['error'] = e
+            job['finished'] = True
+
+        worker = threading.Thread(target=run)
+        worker.daemon = True
+        worker.start()
+        return job_id
+
+    def _check_job(self, job_id):
+        with self.jobs_lock:
+            if job_id not in self.jobs:
+                raise ValueError('No job {} in the local services'.format(job_id))
+            job = self.jobs[job_id]
+            # the callers stop polling a finished job, so it is forgotten once reported
+            if job['finished']:
+                del self.jobs[job_id]
+        if job['finished'] and job['error'] is not None:
+            raise job['error']
+        return {'finished': 1 if job['finished'] else 0, 'result': job['result']}
+
+    # Workspace
+    def create_workspace(self, params):
+        ws_id = self.registry.create_workspace(params['workspace'])
+        return [ws_id, params['workspace'], 'local', '', 0, 'a', 'n', 'unlocked', {}]
+
+    def delete_workspace(self, params):
+        self.registry.delete_workspace(params['workspace'])
+
+    def get_object_info3(self, params):
+        infos = []
+        paths = []
+        for obj in params['objects']:
+            info = self.registry.get_object(obj['ref'])['info']
+            infos.append(info)
+            paths.append([ref_of(info)])
+        return {'infos': infos, 'paths': paths}
+
+    def get_object_info_new(self, params):
+        return self.get_object_info3(params)['infos']
+
+    def get_objects2(self, params):
+        # the whole data is returned, whatever the included paths
+        data = []
+        for obj in params['objects']:
+            stored = self.registry.get_object(obj['ref'])
+            data.append({'info': stored['info'], 'data': stored['data'], 'provenance': [],
+                         'refs': [], 'path': [ref_of(stored['info'])]})
+        return {'data': data}
+
+    # ReadsUtils
+    def download_reads(self, params):
+        files = {}
+        for ref in params['read_libraries']:
+            stored = self.registry.get_object(ref)
+            data = stored['data']
+            out_dir = os.path.join(self.registry.root, 'downloads', str(uuid.uuid4()))
+            os.makedirs(out_dir)
+            record = {'fwd': None, 'rev': None, 'otype': 'single', 'type': 'single',
+                      'fwd_name': None, 'rev_name': None}
+            for lib, fkey in (('lib', 'fwd'), ('lib1', 'fwd'), ('lib2', 'rev')):
+                if lib in data:
+                    path = os.path.join(out_dir, '{}.{}.fastq'.format(data[lib]['file'][
+                        'file_name'].split('.')[0], fkey))
+                    _export_fastq(data[lib]['file']['path'], path)
+                    record[fkey] = path
+                    record[fkey + '_name'] = data[lib]['file']['file_name']
+            if record['rev']:
+                record['otype'] = record['type'] = 'paired'
+            files[ref] = {'files': record, 'ref': ref_of(stored['info']),
+                          'sequencing_tech': data['sequencing_tech'],
+                          'single_genome': data.get('single_genome', 1),
+                          'read_count': data.get('read_count', None),
+                          'total_bases': data.get('total_bases', None)}
+        return {'files': files}
+
+    def upload_reads(self, params):
+        info = self.registry.add_reads(params['wsname'], params['name'], params['fwd_file'],
+                                       params.get('rev_file', None),
+                                       params.get('sequencing_tech', 'Illumina'))
+        return {'obj_ref': ref_of(info)}
+
+    # AssemblyUtil
+    def save_assembly_from_fasta(self, params):
+        info = self.registry.add_assembly(params['workspace_name'], params['assembly_name'],
+                                          params['file']['path'])
+        return ref_of(info)
+
+    def get_assembly_as_fasta(self, params):
+        stored = self.registry.get_object(params['ref'])
+        path = os.path.join(self.registry.root, 'downloads', str(uuid.uuid4()),
+                            stored['info'][1] + '.fa')
+        os.makedirs(os.path.dirname(path))
+        link_or_copy(stored['data']['fasta_path'], path)
+        return {'path': path, 'assembly_name': stored['info'][1]}
+
+    # KBaseReport
+    def create_extended_report(self, params):
+        name = params.get('report_object_name', None) or 'report_' + str(uuid.uuid4())
+        info = self.registry.save_object(params['workspace_name'], name, REPORT_TYPE,
+                                         dict((k, v) for k, v in params.items()
+                                              if k != 'workspace_name'))
+        return {'name': name, 'ref': ref_of(info)}
+
+    # kb_quast
+    def run_QUAST(self, params):
+        quast_dir = self.registry.file_dir()
+        rows = []
+        for f in params['files']:
+            stats = FastaScanner().scan(f['path']).summary()
+            rows.append([f.get('label', None) or os.path.basename(f['path']),
+                         stats['contig_count'], stats['total_length'], stats['max_length'],
+                         stats['n50'], stats['l50'], '{:.2f}'.format(100 * stats['gc_content'])])
+        header = ['Assembly', '# contigs', 'Total length', 'Largest contig', 'N50', 'L50',
+                  'GC (%)']
+        with open(os.path.join(quast_dir, 'report.tsv'), 'w') as tsv:
+            for row in [header] + rows:
+                tsv.write('\t'.join(str(v) for v in row) + '\n')
+        with open(os.path.join(quast_dir, 'report.html'), 'w') as html:
+            html.write('<html><body><table>\n')
+            for row in [header] + rows:
+                html.write('<tr>' + ''.join('<td>{}</td>'.format(v) for v in row) + '</tr>\n')
+            html.write('</table></body></html>\n')
+        return {'quast_path': quast_dir, 'shock_id': 'local:' + quast_dir, 'handle': None,
+                'node_file_name': 'report.html',
+                'size': os.path.getsize(os.path.join(quast_dir, 'report.html'))}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.services.jobs_lock:
+            self.server.services.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        response = {'version': '1.1', 'id': body.get('id', None)}
+        try:
+            response['result'] = self.server.services.call(body['method'], body['params'])
+            status = 200
+        except Exception as e:
+            response['error'] = {'name': 'JSONRPCError', 'code': -32000,
+                                 'message': str(e), 'error': traceback.format_exc()}
+            status = 500
+        out = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-ins for the KBase services')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='serve the registry at root')
+    serve.add_argument('root')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=5000)
+    add_reads = commands.add_parser('add-reads', help='register a reads library')
+    add_reads.add_argument('root')
+    add_reads.add_argument('workspace')
+    add_reads.add_argument('name')
+    add_reads.add_argument('fwd_file')
+    add_reads.add_argument('rev_file', nargs='?')
+    add_reads.add_argument('--sequencing-tech', default='Illumina')
+    add_assembly = commands.add_parser('add-assembly', help='register a FASTA assembly')
+    add_assembly.add_argument('root')
+    add_assembly.add_argument('workspace')
+    add_assembly.add_argument('name')
+    add_assembly.add_argument('fasta_file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        services = LocalServices(args.root, args.host, args.port)
+        print('Serving {} at {}'.format(services.registry.root, services.url))
+        try:
+            services.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'add-reads':
+        print(ref_of(LocalRegistry(args.root).add_reads(
+            args.workspace, args.name, args.fwd_file, args.rev_file, args.sequencing_tech)))
+    elif args.command == 'add-assembly':
+        print(ref_of(LocalRegistry(args.root).add_assembly(
+            args.workspace, args.name, args.fasta_file)))
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())